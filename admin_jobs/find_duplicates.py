@@ -5,7 +5,6 @@ from datetime import datetime
 import numpy as np
 from arrow import Arrow
 from pymongo import MongoClient, UpdateMany, UpdateOne
-from sklearn.cluster import AgglomerativeClustering
 
 from settings import MONGODB_URL
 from winds_mobi_provider import StationStatus
@@ -46,6 +45,9 @@ def station_rating(station, now):
 
 
 def find_duplicates(distance):
+    # Heavy dependency, only imported by the admin process running the job
+    from sklearn.cluster import AgglomerativeClustering
+
     log.info(f"Find duplicate stations within a given distance of {distance} meters")
     mongo_db = MongoClient(MONGODB_URL).get_database()
 
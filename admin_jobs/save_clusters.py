@@ -4,8 +4,6 @@ from datetime import datetime
 
 import numpy as np
 from pymongo import MongoClient, UpdateMany, UpdateOne
-from scipy.spatial import KDTree
-from sklearn.cluster import AgglomerativeClustering
 
 from settings import MONGODB_URL
 from winds_mobi_provider.logging import configure_logging
@@ -15,6 +13,10 @@ log = logging.getLogger(__name__)
 
 
 def save_clusters(min_cluster, nb_clusters):
+    # Heavy dependencies, only imported by the admin process running the job
+    from scipy.spatial import KDTree
+    from sklearn.cluster import AgglomerativeClustering
+
     log.info(f"Creating {nb_clusters} station's clusters")
     mongo_db = MongoClient(MONGODB_URL).get_database()
 
@@ -2,6 +2,8 @@
 
 if [[ $PROVIDER ]]; then
   python -m "providers.${PROVIDER}"
+elif [[ $STATION_WORKER ]]; then
+  python -m winds_mobi_provider.station_queue
 else
   python run_scheduler.py
 fi
@@ -1,8 +1,8 @@
 import re
+from collections.abc import Callable
 from zoneinfo import ZoneInfo
 
 import arrow
-import requests
 from lxml import etree
 
 from winds_mobi_provider import Provider, ProviderException, StationNames, StationStatus
@@ -31,8 +31,8 @@ class FgaType1StationParser:
         self.url = self.url_pattern.format(path)
         self._station = None
 
-    def parse(self, connect_timeout, read_timeout):
-        response = requests.get(self.url, timeout=(connect_timeout, read_timeout))
+    def parse(self, http_get: Callable):
+        response = http_get(self.url)
         response.raise_for_status()
         self._station = etree.fromstring(response.content).find("./station")
 
@@ -92,8 +92,8 @@ class FgaType2StationParser:
         self.lat = lat
         self._station = None
 
-    def parse(self, connect_timeout, read_timeout):
-        response = requests.get(self.url, timeout=(connect_timeout, read_timeout))
+    def parse(self, http_get: Callable):
+        response = http_get(self.url)
         response.raise_for_status()
         self._station = etree.fromstring(response.content).find("./station")
 
@@ -145,8 +145,8 @@ class LorawistaParser:
         self.url = self.url_pattern.format(path)
         self._station = None
 
-    def parse(self, connect_timeout, read_timeout):
-        response = requests.get(self.url, timeout=(connect_timeout, read_timeout))
+    def parse(self, http_get: Callable):
+        response = http_get(self.url)
         response.raise_for_status()
         self._station = etree.fromstring(response.content)
 
@@ -211,49 +211,54 @@ class FluggruppeAletsch(Provider):
     def process_data(self):
         self.log.info("Processing Fluggruppe Aletsch data...")
         for station_id, parser in self.stations:
-            try:
-                parser.parse(self.connect_timeout, self.read_timeout)
-
-                station = self.save_station(
-                    station_id,
-                    StationNames(short_name=parser.name(), name=parser.name()),
-                    parser.latitude(),
-                    parser.longitude(),
-                    StationStatus.GREEN,
-                    altitude=parser.elevation(),
-                )
-
-                key = parser.key()
-                if not self.has_measure(station, key):
-                    try:
-                        measure = self.create_measure(
-                            station,
-                            key,
-                            parser.direction(),
-                            parser.speed(),
-                            parser.speed_max(),
-                            rain=parser.rain(),
-                            temperature=parser.temperature(),
-                            humidity=parser.humidity(),
-                        )
-
-                        self.insert_measures(station, measure)
-                    except ProviderException as e:
-                        self.log.warning(f"Error while processing measure '{key}' for station '{station_id}': {e}")
-                    except Exception as e:
-                        self.log.exception(f"Error while processing measure '{key}' for station '{station_id}': {e}")
-
-            except ProviderException as e:
-                self.log.warning(f"Error while processing station '{station_id}': {e}")
-            except Exception as e:
-                self.log.exception(f"Error while processing station '{station_id}': {e}")
+            with self.trace_station(station_id):
+                try:
+                    parser.parse(self.http_get)
+
+                    station = self.save_station(
+                        station_id,
+                        StationNames(short_name=parser.name(), name=parser.name()),
+                        parser.latitude(),
+                        parser.longitude(),
+                        StationStatus.GREEN,
+                        altitude=parser.elevation(),
+                    )
+
+                    key = parser.key()
+                    if not self.has_measure(station, key):
+                        try:
+                            measure = self.create_measure(
+                                station,
+                                key,
+                                parser.direction(),
+                                parser.speed(),
+                                parser.speed_max(),
+                                rain=parser.rain(),
+                                temperature=parser.temperature(),
+                                humidity=parser.humidity(),
+                            )
+
+                            self.insert_measures(station, measure)
+                        except ProviderException as e:
+                            self.log.warning(f"Error while processing measure '{key}' for station '{station_id}': {e}")
+                        except Exception as e:
+                            self.log.exception(
+                                f"Error while processing measure '{key}' for station '{station_id}': {e}"
+                            )
+
+                except ProviderException as e:
+                    self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
+                except Exception as e:
+                    self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         self.log.info("Done !")
 
 
 def aletsch():
     aletsch_provider = FluggruppeAletsch()
-    aletsch_provider.process_data()
+    aletsch_provider.run()
 
 
 if __name__ == "__main__":
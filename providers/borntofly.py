@@ -48,8 +48,9 @@ class BornToFly(Provider):
 
             session = requests.Session()
             session.headers.update(user_agents.chrome)
-            response = session.post(
+            response = self.http_post(
                 "https://measurements.mobile-alerts.eu/Home/MeasurementDetails",
+                session=session,
                 data={
                     "deviceid": self.device_id,
                     "vendorid": self.vendor_id,
@@ -109,7 +110,7 @@ class BornToFly(Provider):
 
 
 def borntofly():
-    BornToFly(BORN_TO_FLY_VENDOR_ID, BORN_TO_FLY_DEVICE_ID).process_data()
+    BornToFly(BORN_TO_FLY_VENDOR_ID, BORN_TO_FLY_DEVICE_ID).run()
 
 
 if __name__ == "__main__":
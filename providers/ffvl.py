@@ -2,7 +2,6 @@ import json
 from zoneinfo import ZoneInfo
 
 import arrow
-import requests
 
 from settings import FFVL_API_KEY
 from winds_mobi_provider import Pressure, Provider, ProviderException, StationNames, StationStatus
@@ -18,15 +17,28 @@ class Ffvl(Provider):
         super().__init__()
         self.ffvl_api_key = ffvl_api_key
 
+    def get_measure_key(self, ffvl_measure):
+        return arrow.get(ffvl_measure["date"], "YYYY-MM-DD HH:mm:ss").replace(tzinfo=self.timezone).int_timestamp
+
     def process_data(self):
-        stations = {}
+        ffvl_measures = {}
         try:
             self.log.info("Processing FFVL data...")
 
-            result = requests.get(
-                f"https://data.ffvl.fr/api/?base=balises&r=list&mode=json&key={self.ffvl_api_key}",
-                timeout=(self.connect_timeout, self.read_timeout),
-            )
+            # Fetch the measures first to skip the stations without new measure
+            result = self.http_get(f"https://data.ffvl.fr/api/?base=balises&r=releves_meteo&key={self.ffvl_api_key}")
+            # TODO: remove the BOM encoding when the FFVL will fix the forbidden json encoding on their side
+            # https://www.rfc-editor.org/rfc/rfc7159#section-8.1
+            for ffvl_measure in json.loads(result.content.decode("utf-8-sig")):
+                ffvl_measures[self.get_station_id(ffvl_measure["idbalise"])] = ffvl_measure
+
+        except Exception as e:
+            self.log.exception(f"Error while processing measures: {e}")
+
+        stations = {}
+        skipped_stations = set()
+        try:
+            result = self.http_get(f"https://data.ffvl.fr/api/?base=balises&r=list&mode=json&key={self.ffvl_api_key}")
             # TODO: remove the BOM encoding when the FFVL will fix the forbidden json encoding on their side
             # https://www.rfc-editor.org/rfc/rfc7159#section-8.1
             ffvl_stations = json.loads(result.content.decode("utf-8-sig"))
@@ -37,6 +49,15 @@ class Ffvl(Provider):
                     type = ffvl_station.get("station_type", "").lower()
                     if type not in ["holfuy", "pioupiou", "iweathar"]:
                         ffvl_id = ffvl_station["idBalise"]
+                        station_id = self.get_station_id(ffvl_id)
+                        ffvl_measure = ffvl_measures.get(station_id)
+                        if ffvl_measure and not self.is_new_measure(ffvl_id, self.get_measure_key(ffvl_measure)):
+                            skipped_stations.add(station_id)
+                            # The metadata sync refreshes all the stations, the measure sync only the ones with a new
+                            # measure
+                            if not self.sync_metadata:
+                                continue
+
                         station = self.save_station(
                             ffvl_id,
                             StationNames(short_name=ffvl_station["nom"], name=ffvl_station["nom"]),
@@ -50,8 +71,10 @@ class Ffvl(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{ffvl_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{ffvl_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except ProviderException as e:
             self.log.warning(f"Error while processing stations: {e}")
@@ -59,28 +82,15 @@ class Ffvl(Provider):
             self.log.exception(f"Error while processing stations: {e}")
 
         try:
-            result = requests.get(
-                f"https://data.ffvl.fr/api/?base=balises&r=releves_meteo&key={self.ffvl_api_key}",
-                timeout=(self.connect_timeout, self.read_timeout),
-            )
-            # TODO: remove the BOM encoding when the FFVL will fix the forbidden json encoding on their side
-            # https://www.rfc-editor.org/rfc/rfc7159#section-8.1
-            ffvl_measures = json.loads(result.content.decode("utf-8-sig"))
-
-            for ffvl_measure in ffvl_measures:
-                station_id = None
+            for station_id, ffvl_measure in ffvl_measures.items():
                 try:
-                    ffvl_id = ffvl_measure["idbalise"]
-                    station_id = self.get_station_id(ffvl_id)
+                    if station_id in skipped_stations:
+                        continue
                     if station_id not in stations:
                         raise ProviderException(f"Unknown station '{station_id}'")
                     station = stations[station_id]
 
-                    key = (
-                        arrow.get(ffvl_measure["date"], "YYYY-MM-DD HH:mm:ss")
-                        .replace(tzinfo=self.timezone)
-                        .int_timestamp
-                    )
+                    key = self.get_measure_key(ffvl_measure)
 
                     if not self.has_measure(station, key):
                         measure = self.create_measure(
@@ -97,8 +107,10 @@ class Ffvl(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing measures for station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing measures for station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except ProviderException as e:
             self.log.warning(f"Error while processing FFVL: {e}")
@@ -109,7 +121,7 @@ class Ffvl(Provider):
 
 
 def ffvl():
-    Ffvl(FFVL_API_KEY).process_data()
+    Ffvl(FFVL_API_KEY).run()
 
 
 if __name__ == "__main__":
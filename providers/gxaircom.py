@@ -1,5 +1,4 @@
 import arrow
-import requests
 
 from winds_mobi_provider import Q_, Pressure, Provider, StationNames, StationStatus, ureg
 
@@ -12,11 +11,15 @@ class Gxaircom(Provider):
     def process_data(self):
         self.log.info("Processing Gxaircom data...")
         try:
-            data = requests.get(
-                "http://www.gxaircom.net/gxaircom/stations.php", timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
+            data = self.http_get("http://www.gxaircom.net/gxaircom/stations.php").json()
             for station in data:
                 try:
+                    measure_key = arrow.get(station["DT"], "YYYY-MM-DD HH:mm:ss").int_timestamp
+                    new_measure = self.is_new_measure(station["stationId"], measure_key)
+                    # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                    if not new_measure and not self.sync_metadata:
+                        continue
+
                     winds_station = self.save_station(
                         provider_id=station["stationId"],
                         names=lambda names: StationNames(
@@ -27,9 +30,8 @@ class Gxaircom(Provider):
                         status=StationStatus.GREEN if station["online"] == "1" else StationStatus.RED,
                         altitude=station["alt"],
                     )
-                    measure_key = arrow.get(station["DT"], "YYYY-MM-DD HH:mm:ss").int_timestamp
 
-                    if not self.has_measure(winds_station, measure_key):
+                    if new_measure and not self.has_measure(winds_station, measure_key):
                         measure = self.create_measure(
                             station=winds_station,
                             _id=measure_key,
@@ -48,13 +50,14 @@ class Gxaircom(Provider):
                     self.log.exception(
                         f"Error while processing station {station['stationId']}({station['stationName']}): {e}"
                     )
+                    self.metrics.count("stations_failed")
         except Exception as e:
             self.log.exception(f"Error while processing MyProvider: {e}")
         self.log.info("...Done !")
 
 
 def gxaircom():
-    Gxaircom().process_data()
+    Gxaircom().run()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
+import json
+
 import arrow
 import arrow.parser
-import requests
 
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
 
@@ -9,24 +10,66 @@ class Holfuy(Provider):
     provider_code = "holfuy"
     provider_name = "holfuy.com"
     provider_url = "https://holfuy.com"
+    station_queue = True
+
+    def process_station(self, task: dict):
+        holfuy_id = task["provider_id"]
+        holfuy_station = task["station"]
+        holfuy_measure = task["measure"]
+        name = holfuy_station["name"]
+        key = arrow.get(holfuy_measure["dateTime"]).int_timestamp
+
+        location = holfuy_station["location"]
+        latitude = location.get("latitude")
+        longitude = location.get("longitude")
+        if (latitude is None or longitude is None) or (latitude == 0 and longitude == 0):
+            raise ProviderException("No geolocation found")
+        altitude = location.get("altitude")
+
+        station = self.save_station(
+            holfuy_id,
+            StationNames(short_name=name, name=name),
+            latitude,
+            longitude,
+            StationStatus.GREEN,
+            altitude=altitude,
+            url={
+                "default": f"{self.provider_url}/en/weather/{holfuy_id}",
+                "en": f"{self.provider_url}/en/weather/{holfuy_id}",
+                "de": f"{self.provider_url}/de/weather/{holfuy_id}",
+                "fr": f"{self.provider_url}/fr/weather/{holfuy_id}",
+                "it": f"{self.provider_url}/it/weather/{holfuy_id}",
+            },
+        )
+
+        if task["new_measure"] and not self.has_measure(station, key):
+            measure = self.create_measure(
+                station,
+                key,
+                holfuy_measure["wind"]["direction"],
+                Q_(holfuy_measure["wind"]["speed"], ureg.kilometer / ureg.hour),
+                Q_(holfuy_measure["wind"]["gust"], ureg.kilometer / ureg.hour),
+                temperature=Q_(holfuy_measure["temperature"], ureg.degC) if "temperature" in holfuy_measure else None,
+                pressure=Pressure(
+                    qfe=None,
+                    qnh=Q_(holfuy_measure["pressure"], ureg.hPa) if "pressure" in holfuy_measure else None,
+                    qff=None,
+                ),
+            )
+            self.insert_measures(station, measure)
 
     def process_data(self):
         try:
             self.log.info("Processing Holfuy data...")
-            holfuy_stations = requests.get(
-                "https://api.holfuy.com/stations/stations.json", timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-            holfuy_data = requests.get(
-                "https://api.holfuy.com/live/?s=all&m=JSON&tu=C&su=km/h&utc",
-                timeout=(self.connect_timeout, self.read_timeout),
-            ).json()
+            holfuy_stations = json.loads(self.fetch_shared("https://api.holfuy.com/stations/stations.json"))
+            holfuy_data = json.loads(self.fetch_shared("https://api.holfuy.com/live/?s=all&m=JSON&tu=C&su=km/h&utc"))
             holfuy_measures = {}
             for holfuy_measure in holfuy_data["measurements"]:
                 holfuy_measures[holfuy_measure["stationId"]] = holfuy_measure
 
+            tasks = []
             for holfuy_station in holfuy_stations["holfuyStationsList"]:
                 holfuy_id = None
-                station_id = None
                 try:
                     holfuy_id = holfuy_station["id"]
                     name = holfuy_station["name"]
@@ -34,57 +77,28 @@ class Holfuy(Provider):
                     if holfuy_id not in holfuy_measures:
                         raise ProviderException(f"Station '{name}' not found in 'api.holfuy.com/live/'")
 
-                    location = holfuy_station["location"]
-                    latitude = location.get("latitude")
-                    longitude = location.get("longitude")
-                    if (latitude is None or longitude is None) or (latitude == 0 and longitude == 0):
-                        raise ProviderException("No geolocation found")
-                    altitude = location.get("altitude")
-
-                    station = self.save_station(
-                        holfuy_id,
-                        StationNames(short_name=name, name=name),
-                        latitude,
-                        longitude,
-                        StationStatus.GREEN,
-                        altitude=altitude,
-                        url={
-                            "default": f"{self.provider_url}/en/weather/{holfuy_id}",
-                            "en": f"{self.provider_url}/en/weather/{holfuy_id}",
-                            "de": f"{self.provider_url}/de/weather/{holfuy_id}",
-                            "fr": f"{self.provider_url}/fr/weather/{holfuy_id}",
-                            "it": f"{self.provider_url}/it/weather/{holfuy_id}",
-                        },
-                    )
-                    station_id = station["_id"]
-
                     holfuy_measure = holfuy_measures[holfuy_id]
-                    last_measure_date = arrow.get(holfuy_measure["dateTime"])
-                    key = last_measure_date.int_timestamp
-                    if not self.has_measure(station, key):
-                        measure = self.create_measure(
-                            station,
-                            key,
-                            holfuy_measure["wind"]["direction"],
-                            Q_(holfuy_measure["wind"]["speed"], ureg.kilometer / ureg.hour),
-                            Q_(holfuy_measure["wind"]["gust"], ureg.kilometer / ureg.hour),
-                            temperature=(
-                                Q_(holfuy_measure["temperature"], ureg.degC)
-                                if "temperature" in holfuy_measure
-                                else None
-                            ),
-                            pressure=Pressure(
-                                qfe=None,
-                                qnh=Q_(holfuy_measure["pressure"], ureg.hPa) if "pressure" in holfuy_measure else None,
-                                qff=None,
-                            ),
+                    key = arrow.get(holfuy_measure["dateTime"]).int_timestamp
+                    new_measure = self.is_new_measure(holfuy_id, key)
+                    # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                    if new_measure or self.sync_metadata:
+                        tasks.append(
+                            {
+                                "provider_id": holfuy_id,
+                                "station": holfuy_station,
+                                "measure": holfuy_measure,
+                                "new_measure": new_measure,
+                            }
                         )
-                        self.insert_measures(station, measure)
 
                 except ProviderException as e:
-                    self.log.warning(f"Error while processing station '{station_id or holfuy_id}': {e}")
+                    self.log.warning(f"Error while processing station '{holfuy_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
-                    self.log.exception(f"Error while processing station '{station_id or holfuy_id}': {e}")
+                    self.log.exception(f"Error while processing station '{holfuy_id}': {e}")
+                    self.metrics.count("stations_failed")
+
+            self.dispatch_station_tasks(tasks)
 
         except Exception as e:
             self.log.exception(f"Error while processing Holfuy: {e}")
@@ -93,7 +107,7 @@ class Holfuy(Provider):
 
 
 def holfuy():
-    Holfuy().process_data()
+    Holfuy().run()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,3 @@
-import requests
 from lxml import etree
 
 from settings import IWEATHAR_KEY
@@ -28,10 +27,7 @@ class IWeathar(Provider):
             self.log.info("Processing iWeathar data...")
 
             result_tree = etree.fromstring(
-                requests.get(
-                    f"https://iweathar.co.za/live_data.php?unit=kmh&key={self.iweathar_key}",
-                    timeout=(self.connect_timeout, self.read_timeout),
-                ).content
+                self.http_get(f"https://iweathar.co.za/live_data.php?unit=kmh&key={self.iweathar_key}").content
             )
 
             for item in result_tree.xpath("//ITEM"):
@@ -112,8 +108,10 @@ class IWeathar(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id or iweathar_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id or iweathar_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing iWeathar: {e}")
@@ -122,7 +120,7 @@ class IWeathar(Provider):
 
 
 def iweathar():
-    IWeathar(IWEATHAR_KEY).process_data()
+    IWeathar(IWEATHAR_KEY).run()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import arrow
-import requests
 
 from settings import KACHELMANN_API_KEY
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
@@ -15,6 +14,7 @@ class KachelmannWetter(Provider):
     provider_code = "kachelmannwetter"
     provider_name = "kachelmannwetter.com"
     provider_url = "https://api.kachelmannwetter.com"
+    adaptive_station_polling = True
 
     def process_data(self):
         headers = {"x-api-Key": KACHELMANN_API_KEY}
@@ -26,9 +26,12 @@ class KachelmannWetter(Provider):
             stations = {KachelmannWetterStation(station_id="KM0023", name="schruns0at")}
 
             for station in stations:
+                # The metadata sync refreshes all the stations, the measure sync only the due ones
+                if not self.sync_metadata and not self.is_station_due(station.id):
+                    continue
                 url = "https://api.kachelmannwetter.com/v02/station/" + station.id + "/observations/latest"
 
-                response = requests.get(url, timeout=(self.connect_timeout, self.read_timeout), headers=headers)
+                response = self.http_get(url, headers=headers)
                 response.raise_for_status()
                 data = response.json()
 
@@ -77,8 +80,10 @@ class KachelmannWetter(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station.id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station.id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing KachelmannWetter: {e}")
@@ -87,7 +92,7 @@ class KachelmannWetter(Provider):
 
 
 def kachelmannwetter():
-    KachelmannWetter().process_data()
+    KachelmannWetter().run()
 
 
 if __name__ == "__main__":
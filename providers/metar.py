@@ -6,7 +6,6 @@ from random import randint
 
 import arrow
 import arrow.parser
-import requests
 from lxml import etree
 
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
@@ -37,113 +36,124 @@ class Metar(Provider):
     provider_code = "metar"
     provider_name = "aviationweather.gov"
     provider_url = "https://www.aviationweather.gov"
+    station_queue = True
+
+    def process_station(self, task: dict):
+        metar_id = task["provider_id"]
+        station = task["station"]
+        metar = etree.fromstring(task["metar"])
+
+        def get_station_names(names: StationNames) -> StationNames:
+            short_name = station["site"]
+            name = names.name or station["site"]
+            if len(short_name) > len(name):
+                # Swap short_name and name
+                short_name, name = name, short_name
+            return StationNames(short_name, name)
+
+        station = self.save_station(
+            metar_id,
+            get_station_names,
+            station["lat"],
+            station["lon"],
+            StationStatus.GREEN,
+            altitude=station["elev"],
+            url=f"{self.provider_url}/data/metar/?id={metar_id}&hours=0&decoded=yes&include_taf=yes",
+        )
+
+        station_id = station["_id"]
+        key = arrow.get(get_attr(metar, "observation_time")).int_timestamp
+
+        if not self.has_measure(station, key):
+            try:
+                if (
+                    not metar.xpath("wind_dir_degrees")
+                    and not metar.xpath("wind_speed_kt")
+                    and not metar.xpath("wind_gust_kt")
+                ):
+                    raise ProviderException("No wind data")
+
+                wind_dir_attr = get_attr(metar, "wind_dir_degrees")
+                if wind_dir_attr == "VRB":
+                    # For VaRiaBle direction, use a random value
+                    wind_dir = Q_(randint(0, 359), ureg.degree)
+                else:
+                    wind_dir = Q_(int(wind_dir_attr), ureg.degree)
+
+                wind_avg_attr = get_attr(metar, "wind_speed_kt")
+                wind_avg = Q_(float(wind_avg_attr), ureg.knot)
+
+                wind_max_attr = get_attr(metar, "wind_gust_kt", None)
+                wind_max = Q_(float(wind_max_attr), ureg.knot) if wind_max_attr else wind_avg
+
+                temp_attr = get_attr(metar, "temp_c", None)
+                temp = Q_(float(temp_attr), ureg.degC) if temp_attr else None
+
+                dewpoint_attr = get_attr(metar, "dewpoint_c", None)
+                dewpoint = Q_(float(dewpoint_attr), ureg.degC) if dewpoint_attr else None
+
+                pressure_sea_attr = get_attr(metar, "sea_level_pressure_mb", None)
+                pressure_sea = Q_(float(pressure_sea_attr), ureg.hPa) if pressure_sea_attr else None
+
+                measure = self.create_measure(
+                    station,
+                    key,
+                    wind_dir,
+                    wind_avg,
+                    wind_max,
+                    temperature=temp,
+                    humidity=compute_humidity(dewpoint, temp),
+                    pressure=Pressure(
+                        qfe=None,
+                        qnh=None,
+                        qff=pressure_sea,
+                    ),
+                )
+                self.insert_measures(station, measure)
+            except ProviderException as e:
+                self.log.warning(f"Error while processing measure '{key}' for station '{station_id}': {e}")
+                self.metrics.count("stations_failed")
+            except Exception as e:
+                self.log.exception(f"Error while processing measure '{key}' for station '{station_id}': {e}")
+                self.metrics.count("stations_failed")
 
     def process_data(self):
         try:
             self.log.info("Processing Metar data...")
 
-            request = requests.get(
-                "https://aviationweather.gov/data/cache/stations.cache.json.gz",
-                timeout=(self.connect_timeout, self.read_timeout),
-            )
+            content = self.fetch_shared("https://aviationweather.gov/data/cache/stations.cache.json.gz")
             stations = {
                 station["icaoId"]: station
-                for station in json.loads(GzipFile(fileobj=io.BytesIO(request.content)).read().decode("utf-8"))
+                for station in json.loads(GzipFile(fileobj=io.BytesIO(content)).read().decode("utf-8"))
             }
-            request = requests.get(
-                "https://aviationweather.gov/data/cache/metars.cache.xml.gz",
-                timeout=(self.connect_timeout, self.read_timeout),
-            )
-            metar_tree = etree.parse(GzipFile(fileobj=io.BytesIO(request.content)))
+            content = self.fetch_shared("https://aviationweather.gov/data/cache/metars.cache.xml.gz")
+            metar_tree = etree.parse(GzipFile(fileobj=io.BytesIO(content)))
 
+            tasks = []
             for metar in metar_tree.xpath("//METAR"):
                 metar_id = None
-                station_id = None
                 try:
                     metar_id = get_attr(metar, "station_id")
                     station = stations.get(metar_id)
                     if not station:
                         self.log.warning(f"Unable to find icao '{metar_id}' in stations.cache.json")
                         continue
-
-                    def get_station_names(names: StationNames) -> StationNames:
-                        short_name = station["site"]
-                        name = names.name or station["site"]
-                        if len(short_name) > len(name):
-                            # Swap short_name and name
-                            short_name, name = name, short_name
-                        return StationNames(short_name, name)
-
-                    station = self.save_station(
-                        metar_id,
-                        get_station_names,
-                        station["lat"],
-                        station["lon"],
-                        StationStatus.GREEN,
-                        altitude=station["elev"],
-                        url=f"{self.provider_url}/data/metar/?id={metar_id}&hours=0&decoded=yes&include_taf=yes",
+                    tasks.append(
+                        {
+                            "provider_id": metar_id,
+                            "station": station,
+                            "metar": etree.tostring(metar, encoding="unicode", with_tail=False),
+                        }
                     )
 
-                    station_id = station["_id"]
-                    key = arrow.get(get_attr(metar, "observation_time")).int_timestamp
-
-                    if not self.has_measure(station, key):
-                        try:
-                            if (
-                                not metar.xpath("wind_dir_degrees")
-                                and not metar.xpath("wind_speed_kt")
-                                and not metar.xpath("wind_gust_kt")
-                            ):
-                                raise ProviderException("No wind data")
-
-                            wind_dir_attr = get_attr(metar, "wind_dir_degrees")
-                            if wind_dir_attr == "VRB":
-                                # For VaRiaBle direction, use a random value
-                                wind_dir = Q_(randint(0, 359), ureg.degree)
-                            else:
-                                wind_dir = Q_(int(wind_dir_attr), ureg.degree)
-
-                            wind_avg_attr = get_attr(metar, "wind_speed_kt")
-                            wind_avg = Q_(float(wind_avg_attr), ureg.knot)
-
-                            wind_max_attr = get_attr(metar, "wind_gust_kt", None)
-                            wind_max = Q_(float(wind_max_attr), ureg.knot) if wind_max_attr else wind_avg
-
-                            temp_attr = get_attr(metar, "temp_c", None)
-                            temp = Q_(float(temp_attr), ureg.degC) if temp_attr else None
-
-                            dewpoint_attr = get_attr(metar, "dewpoint_c", None)
-                            dewpoint = Q_(float(dewpoint_attr), ureg.degC) if dewpoint_attr else None
-
-                            pressure_sea_attr = get_attr(metar, "sea_level_pressure_mb", None)
-                            pressure_sea = Q_(float(pressure_sea_attr), ureg.hPa) if pressure_sea_attr else None
-
-                            measure = self.create_measure(
-                                station,
-                                key,
-                                wind_dir,
-                                wind_avg,
-                                wind_max,
-                                temperature=temp,
-                                humidity=compute_humidity(dewpoint, temp),
-                                pressure=Pressure(
-                                    qfe=None,
-                                    qnh=None,
-                                    qff=pressure_sea,
-                                ),
-                            )
-                            self.insert_measures(station, measure)
-                        except ProviderException as e:
-                            self.log.warning(f"Error while processing measure '{key}' for station '{station_id}': {e}")
-                        except Exception as e:
-                            self.log.exception(
-                                f"Error while processing measure '{key}' for station '{station_id}': {e}"
-                            )
-
                 except ProviderException as e:
-                    self.log.warning(f"Error while processing station '{station_id or metar_id}': {e}")
+                    self.log.warning(f"Error while processing station '{metar_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
-                    self.log.exception(f"Error while processing station '{station_id or metar_id}': {e}")
+                    self.log.exception(f"Error while processing station '{metar_id}': {e}")
+                    self.metrics.count("stations_failed")
+
+            self.dispatch_station_tasks(tasks)
 
         except Exception as e:
             self.log.exception(f"Error while processing Metar: {e}")
@@ -152,7 +162,7 @@ class Metar(Provider):
 
 
 def metar():
-    Metar().process_data()
+    Metar().run()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 
 import arrow
-import requests
 from pyproj import CRS, Transformer
 
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
 
+# Building a Transformer is expensive: build it once per process
+lv95_to_wgs84 = Transformer.from_crs(CRS.from_epsg(2056), CRS.from_epsg(4326))
+
 
 class MeteoSwiss(Provider):
     provider_code = "meteoswiss"
@@ -13,15 +16,23 @@ class MeteoSwiss(Provider):
     provider_url = "https://www.meteoswiss.admin.ch"
     timezone = ZoneInfo("Europe/Zurich")
 
-    def __init__(self):
-        super().__init__()
-
-        lv95 = CRS.from_epsg(2056)
-        wgs84 = CRS.from_epsg(4326)
-        self.lv85_to_wgs84 = Transformer.from_crs(lv95, wgs84)
-
-    def to_dict(self, features):
-        return {feature["id"]: feature for feature in features}
+    url_pattern = (
+        "https://data.geo.admin.ch/ch.meteoschweiz.messwerte-{parameter}/ch.meteoschweiz.messwerte-{parameter}_en.json"
+    )
+    parameters = {
+        # The wind file is the reference: only its stations are processed
+        "wind": "windgeschwindigkeit-kmh-10min",
+        "gust": "wind-boeenspitze-kmh-10min",
+        "temperature": "lufttemperatur-10min",
+        "humidity": "luftfeuchtigkeit-10min",
+        "qfe": "luftdruck-qfe-10min",
+        "qnh": "luftdruck-qnh-10min",
+        "qff": "luftdruck-qff-10min",
+        "rain": "niederschlag-10min",
+    }
+
+    # Stations don't move: keep the transformed coordinates across runs, {(x, y): (lat, lon)}
+    wgs84_coordinates = {}
 
     def fix_unit(self, unit):
         return unit.replace("/h", "/hour")
@@ -33,77 +44,56 @@ class MeteoSwiss(Provider):
             return Q_(properties["value"], unit)
         return None
 
-    def get_pressure_value(self, pressure_data, meteoswiss_id):
+    def get_pressure_value(self, record, parameter):
         try:
-            return self.get_value(pressure_data[meteoswiss_id]["properties"])
+            return self.get_value(record[parameter])
         except KeyError:
             return None
 
+    def transform_coordinates(self, locations):
+        missing = {(location[0], location[1]) for location in locations} - self.wgs84_coordinates.keys()
+        if missing:
+            # Transform all the new locations in a single vectorized call
+            xs, ys = zip(*missing, strict=True)
+            latitudes, longitudes = lv95_to_wgs84.transform(xs, ys)
+            self.wgs84_coordinates.update(zip(missing, zip(latitudes, longitudes, strict=True), strict=True))
+
+    def get_parameter_file(self, parameter):
+        return self.http_get(self.url_pattern.format(parameter=parameter)).json()
+
     def process_data(self):
         try:
             self.log.info("Processing MeteoSwiss data...")
 
-            url_pattern = (
-                "https://data.geo.admin.ch/ch.meteoschweiz.messwerte-{parameter}/"
-                "ch.meteoschweiz.messwerte-{parameter}_en.json"
-            )
-
-            main_wind = requests.get(
-                url_pattern.format(parameter="windgeschwindigkeit-kmh-10min"),
-                timeout=(self.connect_timeout, self.read_timeout),
-            ).json()
-            wind_gust = requests.get(
-                url_pattern.format(parameter="wind-boeenspitze-kmh-10min"),
-                timeout=(self.connect_timeout, self.read_timeout),
-            ).json()
-            temperature = requests.get(
-                url_pattern.format(parameter="lufttemperatur-10min"), timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-            humidity = requests.get(
-                url_pattern.format(parameter="luftfeuchtigkeit-10min"),
-                timeout=(self.connect_timeout, self.read_timeout),
-            ).json()
-            pressure_qfe = requests.get(
-                url_pattern.format(parameter="luftdruck-qfe-10min"), timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-            pressure_qnh = requests.get(
-                url_pattern.format(parameter="luftdruck-qnh-10min"), timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-            pressure_qff = requests.get(
-                url_pattern.format(parameter="luftdruck-qff-10min"), timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-            rain = requests.get(
-                url_pattern.format(parameter="niederschlag-10min"), timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
-
-            if (
-                main_wind["creation_time"]
-                != wind_gust["creation_time"]
-                != temperature["creation_time"]
-                != humidity["creation_time"]
-                != pressure_qfe["creation_time"]
-                != pressure_qnh["creation_time"]
-                != pressure_qff["creation_time"]
-                != rain["creation_time"]
-            ):
-                self.log.error("Creation time of parameters files are not the same")
-
-            main_wind_data = main_wind["features"]
-            wind_gust_data = self.to_dict(wind_gust["features"])
-            temperature_data = self.to_dict(temperature["features"])
-            humidity_data = self.to_dict(humidity["features"])
-            pressure_qfe_data = self.to_dict(pressure_qfe["features"])
-            pressure_qnh_data = self.to_dict(pressure_qnh["features"])
-            pressure_qff_data = self.to_dict(pressure_qff["features"])
-            rain_data = self.to_dict(rain["features"])
+            # All the files are independent: fetch them concurrently, the wall time is the slowest file
+            with ThreadPoolExecutor(max_workers=len(self.parameters)) as executor:
+                parameter_files = dict(
+                    zip(self.parameters, executor.map(self.get_parameter_file, self.parameters.values()), strict=True)
+                )
+
+            creation_times = {name: parameter_file["creation_time"] for name, parameter_file in parameter_files.items()}
+            if len(set(creation_times.values())) > 1:
+                self.log.error(f"Creation time of parameters files are not the same: {creation_times}")
+
+            # Join all the parameters by station id: {meteoswiss_id: {"wind": properties, "gust": properties, ...}}
+            records = {}
+            for name, parameter_file in parameter_files.items():
+                for feature in parameter_file["features"]:
+                    records.setdefault(feature["id"], {})[name] = feature["properties"]
+            coordinates = {
+                feature["id"]: feature["geometry"]["coordinates"] for feature in parameter_files["wind"]["features"]
+            }
+            self.transform_coordinates(coordinates.values())
 
             station_id = None
-            for meteoswiss_station in main_wind_data:
+            for meteoswiss_id, record in records.items():
                 try:
-                    meteoswiss_id = meteoswiss_station["id"]
-                    name = meteoswiss_station["properties"]["station_name"]
-                    location = meteoswiss_station["geometry"]["coordinates"]
-                    lat, lon = self.lv85_to_wgs84.transform(location[0], location[1])
+                    if "wind" not in record:
+                        continue
+                    properties = record["wind"]
+                    name = properties["station_name"]
+                    location = coordinates[meteoswiss_id]
+                    lat, lon = self.wgs84_coordinates[location[0], location[1]]
 
                     station = self.save_station(
                         meteoswiss_id,
@@ -111,7 +101,7 @@ class MeteoSwiss(Provider):
                         lat,
                         lon,
                         StationStatus.GREEN,
-                        altitude=meteoswiss_station["properties"]["altitude"],
+                        altitude=properties["altitude"],
                         timezone=self.timezone,
                         url={
                             "default": "https://www.meteoswiss.admin.ch/services-and-publications/applications/"
@@ -133,36 +123,31 @@ class MeteoSwiss(Provider):
                     )
                     station_id = station["_id"]
 
-                    timestamp = meteoswiss_station["properties"].get("reference_ts", None)
+                    timestamp = properties.get("reference_ts", None)
                     if not timestamp or timestamp == "-":
                         self.log.warning(f"'{station_id}' has no timestamp field")
                         continue
-                    key = arrow.get(
-                        meteoswiss_station["properties"]["reference_ts"], "YYYY-MM-DDTHH:mm:ssZ"
-                    ).int_timestamp
+                    key = arrow.get(timestamp, "YYYY-MM-DDTHH:mm:ssZ").int_timestamp
 
-                    if meteoswiss_id in temperature_data:
-                        temperature = self.get_value(temperature_data[meteoswiss_id]["properties"], unit=ureg.degC)
+                    if "temperature" in record:
+                        temperature = self.get_value(record["temperature"], unit=ureg.degC)
                     else:
                         temperature = None
 
-                    if meteoswiss_id in humidity_data:
-                        humidity = humidity_data[meteoswiss_id]["properties"]["value"]
-                    else:
-                        humidity = None
+                    humidity = record["humidity"]["value"] if "humidity" in record else None
 
-                    if meteoswiss_id in pressure_qfe_data:
+                    if "qfe" in record:
                         pressure = Pressure(
-                            qfe=self.get_pressure_value(pressure_qfe_data, meteoswiss_id),
-                            qnh=self.get_pressure_value(pressure_qnh_data, meteoswiss_id),
-                            qff=self.get_pressure_value(pressure_qff_data, meteoswiss_id),
+                            qfe=self.get_pressure_value(record, "qfe"),
+                            qnh=self.get_pressure_value(record, "qnh"),
+                            qff=self.get_pressure_value(record, "qff"),
                         )
                     else:
                         pressure = None
 
-                    if meteoswiss_id in rain_data:
+                    if "rain" in record:
                         # 1mm = 1 liter/m^2
-                        rain = self.get_value(rain_data[meteoswiss_id]["properties"], unit=ureg.liter / (ureg.meter**2))
+                        rain = self.get_value(record["rain"], unit=ureg.liter / (ureg.meter**2))
                     else:
                         rain = None
 
@@ -170,9 +155,9 @@ class MeteoSwiss(Provider):
                         measure = self.create_measure(
                             station,
                             key,
-                            meteoswiss_station["properties"]["wind_direction"],
-                            self.get_value(meteoswiss_station["properties"]),
-                            self.get_value(wind_gust_data[meteoswiss_id]["properties"]),
+                            properties["wind_direction"],
+                            self.get_value(properties),
+                            self.get_value(record["gust"]),
                             temperature=temperature,
                             humidity=humidity,
                             pressure=pressure,
@@ -182,8 +167,10 @@ class MeteoSwiss(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing MeteoSwiss: {e}")
@@ -192,7 +179,7 @@ class MeteoSwiss(Provider):
 
 
 def meteoswiss():
-    MeteoSwiss().process_data()
+    MeteoSwiss().run()
 
 
 if __name__ == "__main__":
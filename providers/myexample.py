@@ -11,9 +11,8 @@ class MyExample(Provider):
     def process_data(self):
         self.log.info("Processing MyExample data...")
         try:
-            # data = requests.get(
-            #     "https://api.myexample.com/stations.json", timeout=(self.connect_timeout, self.read_timeout)
-            # ).json()
+            # Use self.http_get() to fetch the data: the requests are measured in the run metrics
+            # data = self.http_get("https://api.myexample.com/stations.json").json()
             # Result example:
             data = [
                 {
@@ -83,8 +82,10 @@ class MyExample(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing MyExample: {e}")
@@ -93,7 +94,7 @@ class MyExample(Provider):
 
 
 def myexample():
-    MyExample().process_data()
+    MyExample().run()
 
 
 if __name__ == "__main__":
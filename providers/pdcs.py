@@ -1,5 +1,3 @@
-import requests
-
 from winds_mobi_provider import Pressure, Provider, ProviderException, StationNames, StationStatus
 
 
@@ -12,12 +10,17 @@ class Pdcs(Provider):
         station_id = "unknown"
         try:
             self.log.info("Processing Pdcs data...")
-            pdcs_data = requests.get(
-                "https://ws.lubu.ch/ws/data.php?minutes=20", timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
+            pdcs_data = self.http_get("https://ws.lubu.ch/ws/data.php?minutes=20").json()
 
             for pdcs_station in pdcs_data["stations"]:
                 try:
+                    new_measure = bool(pdcs_station["measurement"]) and self.is_new_measure(
+                        pdcs_station["id"], pdcs_station["measurement"][0]["time"]
+                    )
+                    # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                    if not new_measure and not self.sync_metadata:
+                        continue
+
                     station = self.save_station(
                         pdcs_station["id"],
                         StationNames(pdcs_station["shortName"], pdcs_station["name"]),
@@ -28,7 +31,7 @@ class Pdcs(Provider):
                     )
                     station_id = station["_id"]
 
-                    if pdcs_station["measurement"]:
+                    if new_measure:
                         measure = pdcs_station["measurement"][0]
                         key = measure["time"]
 
@@ -45,8 +48,10 @@ class Pdcs(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing Pdcs: {e}")
@@ -55,7 +60,7 @@ class Pdcs(Provider):
 
 
 def pdcs():
-    Pdcs().process_data()
+    Pdcs().run()
 
 
 if __name__ == "__main__":
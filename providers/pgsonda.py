@@ -1,7 +1,5 @@
 from zoneinfo import ZoneInfo
 
-import requests
-
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
 
 
@@ -17,7 +15,7 @@ class PgSonda(Provider):
 
         try:
             api_url = "https://pgsonda.cz/api/api_json_complete.php?limit=1"
-            response = requests.get(api_url, timeout=(self.connect_timeout, self.read_timeout))
+            response = self.http_get(api_url)
             response.raise_for_status()
 
             stations_raw = response.json()
@@ -73,6 +71,7 @@ class PgSonda(Provider):
                     self.log.warning(f"Skipping station record due to missing field: {e}")
                 except Exception as e:
                     self.log.exception(f"Error while mapping station '{rec.get('name', '<unknown>')}': {e}")
+                    self.metrics.count("stations_failed")
 
             for station in data:
                 try:
@@ -106,8 +105,10 @@ class PgSonda(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing PGsonda: {e}")
@@ -116,7 +117,7 @@ class PgSonda(Provider):
 
 
 def pgsonda():
-    PgSonda().process_data()
+    PgSonda().run()
 
 
 if __name__ == "__main__":
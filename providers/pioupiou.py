@@ -1,5 +1,6 @@
+import json
+
 import arrow
-import requests
 
 from winds_mobi_provider import Pressure, Provider, ProviderException, StationNames, StationStatus
 
@@ -8,6 +9,7 @@ class Pioupiou(Provider):
     provider_code = "pioupiou"
     provider_name = "openwindmap.org"
     provider_url = "https://www.openwindmap.org"
+    station_queue = True
 
     def get_status(self, station_id, status, location_date, location_status):
         if status == "on":
@@ -28,57 +30,69 @@ class Pioupiou(Provider):
         else:
             return StationStatus.HIDDEN
 
+    def process_station(self, task: dict):
+        piou_id = task["provider_id"]
+        piou_station = task["station"]
+        short_name = piou_station.get("meta", {}).get("name", None)
+        location = piou_station["location"]
+        piou_measure = piou_station["measurements"]
+        key = arrow.get(piou_measure["date"]).int_timestamp
+
+        location_date = None
+        if location.get("date"):
+            location_date = arrow.get(location["date"])
+
+        station = self.save_station(
+            piou_id,
+            lambda names: StationNames(short_name, names.name or short_name),
+            location["latitude"],
+            location["longitude"],
+            self.get_status(
+                self.get_station_id(piou_id), piou_station["status"]["state"], location_date, location["success"]
+            ),
+            url=f"{self.provider_url}/PP{piou_id}",
+        )
+
+        if task["new_measure"] and not self.has_measure(station, key):
+            measure = self.create_measure(
+                station,
+                key,
+                piou_measure["wind_heading"],
+                piou_measure["wind_speed_avg"],
+                piou_measure["wind_speed_max"],
+                pressure=Pressure(qfe=piou_measure["pressure"], qnh=None, qff=None),
+            )
+            self.insert_measures(station, measure)
+
     def process_data(self):
         try:
             self.log.info("Processing Pioupiou data...")
-            result = requests.get(
-                "https://api.pioupiou.fr/v1/live-with-meta/all", timeout=(self.connect_timeout, self.read_timeout)
-            )
-            station_id = None
-            for piou_station in result.json()["data"]:
+            piou_stations = json.loads(self.fetch_shared("https://api.pioupiou.fr/v1/live-with-meta/all"))
+            tasks = []
+            for piou_station in piou_stations["data"]:
+                piou_id = None
                 try:
                     piou_id = piou_station["id"]
-                    short_name = piou_station.get("meta", {}).get("name", None)
                     location = piou_station["location"]
                     latitude = location.get("latitude")
                     longitude = location.get("longitude")
                     if (latitude is None or longitude is None) or (latitude == 0 and longitude == 0):
                         continue
 
-                    location_date = None
-                    if location.get("date"):
-                        location_date = arrow.get(location["date"])
-
-                    station = self.save_station(
-                        piou_id,
-                        lambda names: StationNames(short_name, names.name or short_name),
-                        latitude,
-                        longitude,
-                        self.get_status(
-                            station_id, piou_station["status"]["state"], location_date, location["success"]
-                        ),
-                        url=f"{self.provider_url}/PP{piou_id}",
-                    )
-                    station_id = station["_id"]
-
-                    piou_measure = piou_station["measurements"]
-                    last_measure_date = arrow.get(piou_measure["date"])
-                    key = last_measure_date.int_timestamp
-                    if not self.has_measure(station, key):
-                        measure = self.create_measure(
-                            station,
-                            key,
-                            piou_measure["wind_heading"],
-                            piou_measure["wind_speed_avg"],
-                            piou_measure["wind_speed_max"],
-                            pressure=Pressure(qfe=piou_measure["pressure"], qnh=None, qff=None),
-                        )
-                        self.insert_measures(station, measure)
+                    key = arrow.get(piou_station["measurements"]["date"]).int_timestamp
+                    new_measure = self.is_new_measure(piou_id, key)
+                    # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                    if new_measure or self.sync_metadata:
+                        tasks.append({"provider_id": piou_id, "station": piou_station, "new_measure": new_measure})
 
                 except ProviderException as e:
-                    self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.log.warning(f"Error while processing station '{piou_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
-                    self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.log.exception(f"Error while processing station '{piou_id}': {e}")
+                    self.metrics.count("stations_failed")
+
+            self.dispatch_station_tasks(tasks)
 
         except Exception as e:
             self.log.exception(f"Error while processing Pioupiou: {e}")
@@ -87,7 +101,7 @@ class Pioupiou(Provider):
 
 
 def pioupiou():
-    Pioupiou().process_data()
+    Pioupiou().run()
 
 
 if __name__ == "__main__":
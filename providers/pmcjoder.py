@@ -2,7 +2,6 @@ import re
 from zoneinfo import ZoneInfo
 
 import arrow
-import requests
 from lxml import html
 
 from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
@@ -57,7 +56,7 @@ class PmcJoder(Provider):
         try:
             url = "https://www.pmcjoder.ch/webcam/neuhaus/wetterstation/details.htm"
 
-            page = requests.get(url, timeout=(self.connect_timeout, self.read_timeout))
+            page = self.http_get(url)
 
             tree = html.fromstring(page.content)
 
@@ -116,8 +115,10 @@ class PmcJoder(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing MyProvider: {e}")
@@ -126,7 +127,7 @@ class PmcJoder(Provider):
 
 
 def pmcjoder():
-    PmcJoder().process_data()
+    PmcJoder().run()
 
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@ import urllib.parse
 from zoneinfo import ZoneInfo
 
 import arrow
-import requests
 from lxml import etree
 
 from settings import ROMMA_KEY
@@ -47,10 +46,7 @@ class Romma(Provider):
         try:
             self.log.info("Processing Romma data...")
 
-            content = requests.get(
-                f"https://www.romma.fr/releves_romma_xml.php?id={self.romma_key}",
-                timeout=(self.connect_timeout, self.read_timeout),
-            ).text
+            content = self.http_get(f"https://www.romma.fr/releves_romma_xml.php?id={self.romma_key}").text
             result_tree = etree.fromstring(content)
 
             for report in result_tree.xpath("//releves/releve"):
@@ -105,8 +101,10 @@ class Romma(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing Romma: {e}")
@@ -115,7 +113,7 @@ class Romma(Provider):
 
 
 def romma():
-    Romma(ROMMA_KEY).process_data()
+    Romma(ROMMA_KEY).run()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ class Slf(Provider):
     provider_code = "slf"
     provider_name = "slf.ch"
     provider_url = "https://www.slf.ch"
+    adaptive_station_polling = True
 
     provider_urls = {
         "default": "https://whiterisk.ch/en/snow/station/{network}/{id}",
@@ -28,9 +29,9 @@ class Slf(Provider):
             session = requests.Session()
             session.headers.update(user_agents.chrome)
 
-            result = session.get(
+            result = self.http_get(
                 "https://public-meas-data.slf.ch/public/station-data/timepoint/WIND_MEAN/current/geojson",
-                timeout=(self.connect_timeout, self.read_timeout),
+                session=session,
             )
             slf_stations = result.json()
 
@@ -59,11 +60,13 @@ class Slf(Provider):
                         },
                     )
                     station_id = station["_id"]
+                    if not self.is_station_due(slf_id):
+                        continue
 
-                    result = session.get(
+                    result = self.http_get(
                         "https://public-meas-data.slf.ch"
                         f"/public/station-data/timeseries/week/current/{slf_network}/{slf_id}",
-                        timeout=(self.connect_timeout, self.read_timeout),
+                        session=session,
                     )
                     slf_measures = result.json()
 
@@ -112,8 +115,10 @@ class Slf(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing SLF: {e}")
@@ -122,7 +127,7 @@ class Slf(Provider):
 
 
 def slf():
-    Slf().process_data()
+    Slf().run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+import math
+import random
+import time
+from dataclasses import dataclass
+
+from settings import SYNTHETIC_MEASURES, SYNTHETIC_SEED, SYNTHETIC_STATIONS
+from winds_mobi_provider import Q_, Pressure, Provider, ProviderException, StationNames, StationStatus, ureg
+
+# Regions of the synthetic stations: latitude, longitude, spread in degrees and weight
+regions = [
+    (46.5, 8.5, 1.5, 45),
+    (42.7, 1.0, 1.0, 10),
+    (45.0, 6.5, 1.0, 15),
+    (39.5, -106.0, 3.0, 12),
+    (-43.5, 171.0, 2.0, 8),
+    (36.0, 138.0, 2.0, 10),
+]
+# Seconds between the reports of a station
+cadences = [60, 120, 300, 600, 900, 1800, 3600]
+cadence_weights = [5, 10, 30, 25, 15, 10, 5]
+statuses = [StationStatus.GREEN, StationStatus.ORANGE, StationStatus.RED, StationStatus.HIDDEN]
+status_weights = [85, 8, 5, 2]
+# Units of the wind speeds and pressure values sent by the upstream, None for km/h floats
+speed_units = [None, "meter / second", "knot"]
+speed_unit_weights = [50, 30, 20]
+pressure_types = [None, "qfe", "qnh", "qff"]
+pressure_type_weights = [40, 25, 20, 15]
+# Stations without a new report for days
+silent_ratio = 0.05
+# Missing value of a report
+missing_value_ratio = 0.02
+
+
+@dataclass
+class SyntheticStation:
+    id: str
+    name: str
+    latitude: float
+    longitude: float
+    altitude: int
+    status: StationStatus
+    cadence: int
+    # Delay of the last report, days for the silent stations
+    delay: int
+    speed_unit: str | None
+    pressure_type: str | None
+    has_temperature: bool
+    has_humidity: bool
+
+
+def create_station(seed, index) -> SyntheticStation:
+    rng = random.Random(f"{seed}-{index}")
+    lat, lon, spread, _ = rng.choices(regions, weights=[region[3] for region in regions])[0]
+    cadence = rng.choices(cadences, weights=cadence_weights)[0]
+    return SyntheticStation(
+        id=f"{index:06d}",
+        name=f"Synthetic {index}",
+        latitude=round(max(min(rng.gauss(lat, spread), 89), -89), 6),
+        longitude=round((rng.gauss(lon, spread) + 180) % 360 - 180, 6),
+        altitude=int(min(rng.lognormvariate(6.8, 0.6), 4500)),
+        status=rng.choices(statuses, weights=status_weights)[0],
+        cadence=cadence,
+        delay=rng.randint(2, 10) * 24 * 3600 if rng.random() < silent_ratio else rng.randint(0, cadence),
+        speed_unit=rng.choices(speed_units, weights=speed_unit_weights)[0],
+        pressure_type=rng.choices(pressure_types, weights=pressure_type_weights)[0],
+        has_temperature=rng.random() < 0.85,
+        has_humidity=rng.random() < 0.5,
+    )
+
+
+class Synthetic(Provider):
+    # Generated stations and measures, to measure how the ingestion scales with the size of the network:
+    # SYNTHETIC_STATIONS=100000 python -m providers.synthetic
+    provider_code = "synthetic"
+    provider_name = "synthetic"
+    provider_url = "https://winds.mobi"
+    __elevation_cache_duration = 30 * 24 * 3600
+
+    def __init__(self, stations=SYNTHETIC_STATIONS, measures=SYNTHETIC_MEASURES, seed=SYNTHETIC_SEED):
+        super().__init__()
+        self.stations = [create_station(seed, index) for index in range(stations)]
+        self.speed_units = {name: ureg.Unit(name) for name in speed_units if name}
+        self.measures = measures
+        self.seed = seed
+
+    def add_elevations(self, stations: list[SyntheticStation]):
+        # The stations elevation is known: don't call the Google Elevation API for each new station
+        for start in range(0, len(stations), 1000):
+            pipe = self.redis.pipeline()
+            for station in stations[start : start + 1000]:
+                alt_key = f"alt/{station.latitude},{station.longitude}"
+                pipe.hset(alt_key, mapping={"alt": station.altitude, "is_peak": "False"})
+                pipe.expire(alt_key, self.__elevation_cache_duration)
+            pipe.execute()
+
+    def create_measure_values(self, station: SyntheticStation, key) -> dict:
+        rng = random.Random(f"{self.seed}-{station.id}-{key}")
+
+        def value(enabled, generate):
+            return generate() if enabled and rng.random() >= missing_value_ratio else None
+
+        def speed(kmh):
+            if station.speed_unit is None:
+                return round(kmh, 1)
+            return Q_(kmh, ureg.kilometer / ureg.hour).to(self.speed_units[station.speed_unit])
+
+        wind_average = rng.weibullvariate(12, 2)
+        temperature = value(station.has_temperature, lambda: round(rng.gauss(15 - station.altitude / 150, 6), 1))
+        humidity = value(station.has_humidity, lambda: round(rng.uniform(20, 100)))
+        pressure = None
+        if station.pressure_type and (qnh := value(True, lambda: rng.gauss(1015, 8))):
+            values = {
+                "qnh": Q_(qnh, ureg.hPa),
+                "qfe": Q_(qnh * math.exp(-station.altitude / 8400), ureg.hPa),
+                "qff": Q_(qnh + rng.uniform(-2, 2), ureg.hPa),
+            }
+            pressure = Pressure(
+                **{
+                    pressure_type: values[pressure_type] if pressure_type == station.pressure_type else None
+                    for pressure_type in ("qfe", "qnh", "qff")
+                }
+            )
+        return {
+            "wind_direction": value(True, lambda: rng.randrange(360)),
+            "wind_average": speed(wind_average),
+            "wind_maximum": speed(wind_average * rng.uniform(1.2, 1.8)),
+            "temperature": temperature,
+            "humidity": humidity,
+            "pressure": pressure,
+        }
+
+    def report_scale(self):
+        try:
+            stations = self.mongo_db.stations.count_documents({"pv-code": self.provider_code})
+            collections = len(self.mongo_db.list_collection_names())
+            redis_info = self.redis.info("memory")
+            self.log.info(
+                f"{stations} stations, {collections} Mongo collections, {self.redis.dbsize()} Redis keys "
+                f"using {redis_info['used_memory'] / 1024**2:.1f}MB"
+            )
+        except Exception as e:
+            self.log.warning(f"Unable to report the scale of the databases: {e}")
+
+    def process_data(self):
+        self.log.info(f"Processing {len(self.stations)} synthetic stations...")
+        now = int(time.time())
+        if self.sync_metadata:
+            self.add_elevations(self.stations)
+
+        for station in self.stations:
+            try:
+                last_key = (now - station.delay) // station.cadence * station.cadence
+                new_measure = self.is_new_measure(station.id, last_key)
+                # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                if not new_measure and not self.sync_metadata:
+                    continue
+
+                winds_station = self.save_station(
+                    station.id,
+                    StationNames(short_name=station.name, name=station.name),
+                    station.latitude,
+                    station.longitude,
+                    station.status,
+                    altitude=station.altitude,
+                )
+
+                if not new_measure:
+                    continue
+                measures = []
+                for key in range(last_key, last_key - self.measures * station.cadence, -station.cadence):
+                    if self.has_measure(winds_station, key):
+                        break
+                    try:
+                        measures.append(
+                            self.create_measure(winds_station, key, **self.create_measure_values(station, key))
+                        )
+                    except ProviderException as e:
+                        self.log.warning(f"Error while processing measure '{key}' for station '{station.id}': {e}")
+                self.insert_measures(winds_station, measures[::-1])
+
+            except ProviderException as e:
+                self.log.warning(f"Error while processing station '{station.id}': {e}")
+                self.metrics.count("stations_failed")
+            except Exception as e:
+                self.log.exception(f"Error while processing station '{station.id}': {e}")
+                self.metrics.count("stations_failed")
+
+        self.report_scale()
+        self.log.info("Done !")
+
+
+def synthetic():
+    Synthetic().run()
+
+
+if __name__ == "__main__":
+    synthetic()
@@ -48,9 +48,7 @@ class ThunerWetter(Provider):
             session = requests.Session()
             session.headers.update(user_agents.chrome)
 
-            wind_tree = html.fromstring(
-                session.get(self.provider_url, timeout=(self.connect_timeout, self.read_timeout)).text
-            )
+            wind_tree = html.fromstring(self.http_get(self.provider_url, session=session).text)
 
             # Date
             date_element = wind_tree.xpath('//td[text()[contains(.,"Messwerte von Thun")]]')[0]
@@ -84,9 +82,7 @@ class ThunerWetter(Provider):
                 wind_max_text = wind_elements[1].xpath("following-sibling::td")[0].text.strip()
                 wind_max = wind_pattern.search(wind_max_text).groupdict()
 
-                air_tree = html.fromstring(
-                    session.get(self.provider_url_temp, timeout=(self.connect_timeout, self.read_timeout)).text
-                )
+                air_tree = html.fromstring(self.http_get(self.provider_url_temp, session=session).text)
 
                 # Date
                 date_element = air_tree.xpath('//td[text()[contains(.,"Messwerte von Thun")]]')[0]
@@ -124,14 +120,16 @@ class ThunerWetter(Provider):
 
         except ProviderException as e:
             self.log.warning(f"Error while processing station '{station_id}': {e}")
+            self.metrics.count("stations_failed")
         except Exception as e:
             self.log.exception(f"Error while processing station '{station_id}': {e}")
+            self.metrics.count("stations_failed")
 
         self.log.info("...Done!")
 
 
 def thunerwetter():
-    ThunerWetter().process_data()
+    ThunerWetter().run()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import arrow
-import requests
 
 from winds_mobi_provider import Q_, Provider, ProviderException, StationNames, StationStatus, ureg
 
@@ -12,9 +11,7 @@ class Windball(Provider):
     def process_data(self):
         self.log.info("Processing windball data...")
         try:
-            data = requests.get(
-                "https://server.windball.ch/api/windsmobi?units=kmh", timeout=(self.connect_timeout, self.read_timeout)
-            ).json()
+            data = self.http_get("https://server.windball.ch/api/windsmobi?units=kmh").json()
             for station in data:
                 # Let winds.mobi provide the geocoding_name (if found) with the help of Google Geocoding API
                 def build_station_name(geocoding_names):
@@ -24,6 +21,12 @@ class Windball(Provider):
                         return StationNames(short_name=station["name"], name=geocoding_names.name)
 
                 try:
+                    measure_keys = [arrow.get(measure["time"]).int_timestamp for measure in station["measures"]]
+                    new_measure = not measure_keys or self.is_new_measure(station["id"], max(measure_keys))
+                    # The metadata sync refreshes all the stations, the measure sync only the ones with a new measure
+                    if not new_measure and not self.sync_metadata:
+                        continue
+
                     if "name" in station and station["name"].startswith("Test"):
                         status = StationStatus.HIDDEN
                     elif station["status"] == "enabled":
@@ -45,10 +48,11 @@ class Windball(Provider):
                         },
                     )
                     station_id = winds_station["_id"]
+                    if not new_measure:
+                        continue
 
                     measures = []
-                    for measure in station["measures"]:
-                        measure_key = arrow.get(measure["time"]).int_timestamp
+                    for measure_key, measure in zip(measure_keys, station["measures"], strict=True):
                         if not self.has_measure(winds_station, measure_key):
                             try:
                                 measure = self.create_measure(
@@ -71,8 +75,10 @@ class Windball(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station['id']}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing windball: {e}")
@@ -81,7 +87,7 @@ class Windball(Provider):
 
 
 def windball():
-    Windball().process_data()
+    Windball().run()
 
 
 if __name__ == "__main__":
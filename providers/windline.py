@@ -1,10 +1,14 @@
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime, timedelta
+from operator import itemgetter
 from urllib.parse import urlparse
 
 import arrow
 import MySQLdb
 from cachetools import TTLCache, cached
 from cachetools.keys import hashkey
+from MySQLdb.cursors import SSCursor
 
 from settings import WINDLINE_SQL_URL
 from winds_mobi_provider import Q_, Provider, ProviderException, StationNames, StationStatus, ureg, wgs84
@@ -34,6 +38,9 @@ class Windline(Provider):
     temperature_type = 16400
     humidity_type = 16401
 
+    # Read again the rows before the high-water mark to get the late data
+    high_water_mark_overlap = timedelta(minutes=30)
+
     status = {
         "offline": StationStatus.HIDDEN,
         "maintenance": StationStatus.RED,
@@ -52,24 +59,74 @@ class Windline(Provider):
         except TypeError as e:
             raise ProviderException(f"No property '{key}'") from e
 
-    def get_property_value(self, cursor, station_no, property_id):
+    def get_stations(self, cursor):
+        # Pivot the station properties into columns: a single query for all the stations
         cursor.execute(
-            "SELECT value FROM tblstationproperty WHERE tblstationno=%s AND tblstationpropertylistno=%s",
-            (station_no, property_id),
+            "SELECT tblstation.tblstationno, stationid, stationname, shortdescription, "
+            "MAX(CASE WHEN tblstationpropertylistno=%s THEN value END) AS status, "
+            "MAX(CASE WHEN tblstationpropertylistno=%s THEN value END) AS latitude, "
+            "MAX(CASE WHEN tblstationpropertylistno=%s THEN value END) AS longitude, "
+            "MAX(CASE WHEN tblstationpropertylistno=%s THEN value END) AS altitude "
+            "FROM tblstation "
+            "INNER JOIN tblstationproperty "
+            "ON tblstation.tblstationno = tblstationproperty.tblstationno "
+            "WHERE tblstationpropertylistno IN (%s, %s, %s, %s) "
+            "GROUP BY tblstation.tblstationno, stationid, stationname, shortdescription "
+            # Fetch only stations that have a status
+            "HAVING status IS NOT NULL",
+            (self.status_property_id, self.latitude_property_id, self.longitude_property_id, self.altitude_property_id)
+            * 2,
         )
-        try:
-            return cursor.fetchone()[0]
-        except TypeError as e:
-            raise ProviderException(f"No property value for property '{property_id}'") from e
+        return cursor.fetchall()
 
-    def get_measures(self, cursor, station_id, data_id, start_date):
-        cursor.execute(
-            "SELECT measuredate, data FROM tblstationdata "
-            "WHERE stationid=%s AND dataid=%s AND measuredate>=%s "
-            "ORDER BY measuredate",
-            (station_id, data_id, start_date),
+    def get_high_water_marks(self):
+        # The newest measuredate already ingested for each station
+        return {
+            str(station["pv-id"]): arrow.get(station["last"]["_id"]).naive
+            for station in self.mongo_db.stations.find(
+                {"pv-code": self.provider_code, "last._id": {"$exists": True}},
+                projection={"pv-id": True, "last._id": True},
+            )
+        }
+
+    def get_measures(self, connection, station_ids, start_date):
+        # Fetch the measures of all the stations and data types in a single query, grouped by (station_id, data_id)
+        # and sorted by measuredate. Only the rows after the high-water mark of each station are read.
+        measures = defaultdict(list)
+        if not station_ids:
+            return measures
+        high_water_marks = self.get_high_water_marks()
+        station_conditions = []
+        station_params = []
+        for station_id in station_ids:
+            since = start_date
+            if high_water_mark := high_water_marks.get(str(station_id)):
+                since = max(start_date, high_water_mark - self.high_water_mark_overlap)
+            station_conditions.append("(stationid=%s AND measuredate>=%s)")
+            station_params += [station_id, since]
+        data_ids = (
+            self.wind_average_type,
+            self.wind_maximum_type,
+            self.wind_direction_type,
+            self.temperature_type,
+            self.humidity_type,
         )
-        return cursor.fetchall()
+        # Stream the rows with a server-side cursor instead of buffering the whole result
+        cursor = connection.cursor(SSCursor)
+        try:
+            cursor.execute(
+                "SELECT stationid, dataid, measuredate, data FROM tblstationdata "
+                f"WHERE dataid IN ({', '.join(['%s'] * len(data_ids))}) "
+                f"AND ({' OR '.join(station_conditions)}) "
+                "ORDER BY stationid, dataid, measuredate",
+                (*data_ids, *station_params),
+            )
+            for station_id, data_id, measure_date, data in cursor:
+                # Normalize the keys: stationid might not be typed the same way in tblstation and tblstationdata
+                measures[(str(station_id), int(data_id))].append((measure_date, data))
+        finally:
+            cursor.close()
+        return measures
 
     @cached(
         cache=TTLCache(maxsize=float("inf"), ttl=60 * 60 * 24),
@@ -95,18 +152,24 @@ class Windline(Provider):
                 return value + correction
         return value
 
+    def is_holfuy_station(self, windline_id):
+        # Windline integrate holfuy stations with 6xxx ids
+        try:
+            return 6000 <= int(windline_id) < 7000
+        except ValueError:
+            return False
+
     def get_measure_value(self, rows, start_date, end_date):
-        for row in reversed(rows):
-            date = row[0]
-            if start_date <= date <= end_date:
-                return float(row[1])
+        # rows are sorted by date: the last row before end_date must also be after start_date
+        index = bisect_right(rows, end_date, key=itemgetter(0))
+        if index and rows[index - 1][0] >= start_date:
+            return float(rows[index - 1][1])
         raise NoMeasure()
 
     def get_last_measure_value(self, rows, end_date):
-        for row in reversed(rows):
-            date = row[0]
-            if date <= end_date:
-                return float(row[1])
+        index = bisect_right(rows, end_date, key=itemgetter(0))
+        if index:
+            return float(rows[index - 1][1])
         raise NoMeasure()
 
     def process_data(self):
@@ -114,7 +177,8 @@ class Windline(Provider):
             self.log.info("Processing WINDLINE data...")
 
             connection_info = urlparse(self.windline_sql_url)
-            mysql_connection = MySQLdb.connect(
+            mysql_connection = self.connect_database(
+                MySQLdb.connect,
                 connection_info.hostname,
                 connection_info.username,
                 connection_info.password,
@@ -125,37 +189,24 @@ class Windline(Provider):
             # mysql_connection is buffered by default so we can use the same cursor with fetchall
             mysql_cursor = mysql_connection.cursor()
 
+            # Maximum look back, used for new stations or after a long outage
             start_date = datetime.utcnow() - timedelta(days=2)
 
-            # Fetch only stations that have a status (property_id=13)
-            mysql_cursor.execute(
-                "SELECT tblstation.tblstationno, stationid, stationname, shortdescription, value "
-                "FROM tblstation "
-                "INNER JOIN tblstationproperty "
-                "ON tblstation.tblstationno = tblstationproperty.tblstationno "
-                "WHERE tblstationpropertylistno=%s",
-                (self.status_property_id,),
+            stations = self.get_stations(mysql_cursor)
+            measures_rows = self.get_measures(
+                mysql_connection, [row[1] for row in stations if not self.is_holfuy_station(row[1])], start_date
             )
-            for row in mysql_cursor.fetchall():
-                station_no = row[0]
-                windline_id = row[1]
-                short_name = row[2]
-                name = row[3]
-                status = row[4]
 
+            for station_no, windline_id, short_name, name, status, latitude, longitude, altitude in stations:
                 station_id = None
                 try:
-                    try:
-                        if 6000 <= int(windline_id) < 7000:
-                            # Windline integrate holfuy stations with 6xxx ids
-                            raise ProviderException(f"{windline_id} is an holfuy station, discarding")
-                    except ValueError:
-                        pass
-
-                    latitude = self.get_property_value(mysql_cursor, station_no, self.latitude_property_id)
-                    longitude = self.get_property_value(mysql_cursor, station_no, self.longitude_property_id)
+                    if self.is_holfuy_station(windline_id):
+                        raise ProviderException(f"{windline_id} is an holfuy station, discarding")
+
                     if not (latitude and longitude):
                         raise ProviderException(f"No geo location for {windline_id}")
+                    if altitude is None:
+                        raise ProviderException(f"No property value for property '{self.altitude_property_id}'")
 
                     station = self.save_station(
                         windline_id,
@@ -163,33 +214,24 @@ class Windline(Provider):
                         wgs84.parse_dms(latitude),
                         wgs84.parse_dms(longitude),
                         self.status.get(status, StationStatus.HIDDEN),
-                        altitude=self.get_property_value(mysql_cursor, station_no, self.altitude_property_id),
+                        altitude=altitude,
                     )
                     station_id = station["_id"]
 
                     try:
-                        wind_average_rows = self.get_measures(
-                            mysql_cursor, windline_id, self.wind_average_type, start_date
-                        )
-                        wind_maximum_rows = self.get_measures(
-                            mysql_cursor, windline_id, self.wind_maximum_type, start_date
-                        )
-                        wind_direction_rows = self.get_measures(
-                            mysql_cursor, windline_id, self.wind_direction_type, start_date
-                        )
-                        temperature_rows = self.get_measures(
-                            mysql_cursor, windline_id, self.temperature_type, start_date
-                        )
-                        humidity_rows = self.get_measures(mysql_cursor, windline_id, self.humidity_type, start_date)
+                        wind_average_rows = measures_rows[(str(windline_id), self.wind_average_type)]
+                        wind_maximum_rows = measures_rows[(str(windline_id), self.wind_maximum_type)]
+                        wind_direction_rows = measures_rows[(str(windline_id), self.wind_direction_type)]
+                        temperature_rows = measures_rows[(str(windline_id), self.temperature_type)]
+                        humidity_rows = measures_rows[(str(windline_id), self.humidity_type)]
 
                         measures = []
+                        keys = set()
                         # The wind average measure is the time reference for a measure
                         for wind_average_row in wind_average_rows:
                             try:
                                 key = arrow.get(wind_average_row[0]).int_timestamp
-                                if key not in [measure["_id"] for measure in measures] and not self.has_measure(
-                                    station, key
-                                ):
+                                if key not in keys and not self.has_measure(station, key):
                                     wind_average = Q_(float(wind_average_row[1]), ureg.meter / ureg.second)
 
                                     measure_date = wind_average_row[0]
@@ -241,6 +283,7 @@ class Windline(Provider):
                                         humidity=humidity,
                                     )
                                     measures.append(measure)
+                                    keys.add(key)
                             except NoMeasure:
                                 pass
 
@@ -248,13 +291,17 @@ class Windline(Provider):
 
                     except ProviderException as e:
                         self.log.warning(f"Error while processing measures for station '{station_id}': {e}")
+                        self.metrics.count("stations_failed")
                     except Exception as e:
                         self.log.exception(f"Error while processing measures for station '{station_id}': {e}")
+                        self.metrics.count("stations_failed")
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing Windline: {e}")
@@ -269,7 +316,7 @@ class Windline(Provider):
 
 
 def windline():
-    Windline(WINDLINE_SQL_URL).process_data()
+    Windline(WINDLINE_SQL_URL).run()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,5 @@
 import arrow
 import arrow.parser
-import requests
 import urllib3
 
 from winds_mobi_provider import Provider, ProviderException, StationNames, StationStatus
@@ -13,13 +12,13 @@ class Windspots(Provider):
     provider_code = "windspots"
     provider_name = "windspots.com"
     provider_url = "https://www.windspots.com"
+    adaptive_station_polling = True
 
     def process_data(self):
         try:
             self.log.info("Processing WindsSpots data...")
-            result = requests.get(
+            result = self.http_get(
                 "https://api.windspots.com/windmobile/stationinfo",
-                timeout=(self.connect_timeout, self.read_timeout),
                 verify=False,
             )
 
@@ -27,70 +26,73 @@ class Windspots(Provider):
                 station_id = None
                 try:
                     windspots_id = windspots_station["winId"][10:]
-                    station = self.save_station(
-                        windspots_id,
-                        StationNames(windspots_station["shortName"], windspots_station["name"]),
-                        windspots_station["wgs84Latitude"],
-                        windspots_station["wgs84Longitude"],
-                        StationStatus(windspots_station["maintenanceStatus"]),
-                        altitude=windspots_station["altitude"],
-                    )
-                    station_id = station["_id"]
-
-                    try:
-                        # Asking 2 days of data
-                        result = requests.get(
-                            f"https://api.windspots.com/windmobile/stationdatas/windspots:{windspots_id}",
-                            timeout=(self.connect_timeout, self.read_timeout),
-                            verify=False,
+                    with self.trace_station(windspots_id):
+                        station = self.save_station(
+                            windspots_id,
+                            StationNames(windspots_station["shortName"], windspots_station["name"]),
+                            windspots_station["wgs84Latitude"],
+                            windspots_station["wgs84Longitude"],
+                            StationStatus(windspots_station["maintenanceStatus"]),
+                            altitude=windspots_station["altitude"],
                         )
-                        try:
-                            windspots_measure = result.json()
-                        except ValueError as e:
-                            raise ProviderException("Action=Data return invalid json response") from e
+                        station_id = station["_id"]
+                        if not self.is_station_due(windspots_id):
+                            continue
 
                         try:
-                            key = arrow.get(windspots_measure["@lastUpdate"], "YYYY-M-DTHH:mm:ssZ").int_timestamp
-                        except arrow.parser.ParserError as e:
-                            raise ProviderException(
-                                f"Unable to parse measure date: '{windspots_measure['@lastUpdate']}"
-                            ) from e
-
-                        wind_direction_last = windspots_measure["windDirectionChart"]["serie"]["points"][0]
-                        wind_direction_key = int(wind_direction_last["date"]) // 1000
-                        if arrow.get(key).minute != arrow.get(wind_direction_key).minute:
-                            key_time = arrow.get(key).to("local").format("YY-MM-DD HH:mm:ssZZ")
-                            direction_time = arrow.get(wind_direction_key).to("local").format("YY-MM-DD HH:mm:ssZZ")
-                            self.log.warning(
-                                f"{station['short']} ({station_id}): wind direction time '{direction_time}' is "
-                                f"inconsistent with measure time '{key_time}'"
+                            # Asking 2 days of data
+                            result = self.http_get(
+                                f"https://api.windspots.com/windmobile/stationdatas/windspots:{windspots_id}",
+                                verify=False,
                             )
+                            try:
+                                windspots_measure = result.json()
+                            except ValueError as e:
+                                raise ProviderException("Action=Data return invalid json response") from e
 
-                        if not self.has_measure(station, key):
                             try:
-                                measure = self.create_measure(
-                                    station,
-                                    key,
-                                    wind_direction_last["value"],
-                                    windspots_measure.get("windAverage"),
-                                    windspots_measure.get("windMax"),
-                                    temperature=windspots_measure.get("airTemperature"),
-                                    humidity=windspots_measure.get("airHumidity"),
-                                )
-                                self.insert_measures(station, measure)
-                            except ProviderException as e:
+                                key = arrow.get(windspots_measure["@lastUpdate"], "YYYY-M-DTHH:mm:ssZ").int_timestamp
+                            except arrow.parser.ParserError as e:
+                                raise ProviderException(
+                                    f"Unable to parse measure date: '{windspots_measure['@lastUpdate']}"
+                                ) from e
+
+                            wind_direction_last = windspots_measure["windDirectionChart"]["serie"]["points"][0]
+                            wind_direction_key = int(wind_direction_last["date"]) // 1000
+                            if arrow.get(key).minute != arrow.get(wind_direction_key).minute:
+                                key_time = arrow.get(key).to("local").format("YY-MM-DD HH:mm:ssZZ")
+                                direction_time = arrow.get(wind_direction_key).to("local").format("YY-MM-DD HH:mm:ssZZ")
                                 self.log.warning(
-                                    f"Error while processing measure '{key}' for station '{station_id}': {e}"
-                                )
-                            except Exception as e:
-                                self.log.exception(
-                                    f"Error while processing measure '{key}' for station '{station_id}': {e}"
+                                    f"{station['short']} ({station_id}): wind direction time '{direction_time}' is "
+                                    f"inconsistent with measure time '{key_time}'"
                                 )
 
-                    except Exception as e:
-                        self.log.exception(f"Error while processing measure for station '{station_id}': {e}")
+                            if not self.has_measure(station, key):
+                                try:
+                                    measure = self.create_measure(
+                                        station,
+                                        key,
+                                        wind_direction_last["value"],
+                                        windspots_measure.get("windAverage"),
+                                        windspots_measure.get("windMax"),
+                                        temperature=windspots_measure.get("airTemperature"),
+                                        humidity=windspots_measure.get("airHumidity"),
+                                    )
+                                    self.insert_measures(station, measure)
+                                except ProviderException as e:
+                                    self.log.warning(
+                                        f"Error while processing measure '{key}' for station '{station_id}': {e}"
+                                    )
+                                except Exception as e:
+                                    self.log.exception(
+                                        f"Error while processing measure '{key}' for station '{station_id}': {e}"
+                                    )
+
+                        except Exception as e:
+                            self.log.exception(f"Error while processing measure for station '{station_id}': {e}")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{station_id}': {e}")
+                    self.metrics.count("stations_failed")
         except Exception as e:
             self.log.exception(f"Error while processing Windspots: {e}")
 
@@ -98,7 +100,7 @@ class Windspots(Provider):
 
 
 def windspots():
-    Windspots().process_data()
+    Windspots().run()
 
 
 if __name__ == "__main__":
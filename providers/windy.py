@@ -1,6 +1,7 @@
+import json
+
 import arrow
 import psycopg2
-import requests
 from psycopg2.extras import DictCursor
 
 import settings
@@ -11,17 +12,23 @@ class Windy(Provider):
     provider_code = "windy"
     provider_name = "windy.com"
     provider_url = "https://windy.com"
+    adaptive_station_polling = True
+    station_queue = True
 
     def __init__(self, api_key, admin_db_url):
         super().__init__()
         self.api_key = api_key
         self.admin_db_url = admin_db_url
 
+    @classmethod
+    def create(cls):
+        return cls(settings.WINDY_API_KEY, settings.ADMIN_DB_URL)
+
     def get_stations_metadata(self):
         connection = None
         cursor = None
         try:
-            connection = psycopg2.connect(self.admin_db_url)
+            connection = self.connect_database(psycopg2.connect, self.admin_db_url)
             cursor = connection.cursor(cursor_factory=DictCursor)
             cursor.execute("select * from winds_mobi_windy_station")
             return cursor.fetchall()
@@ -32,103 +39,86 @@ class Windy(Provider):
             except Exception:
                 pass
 
+    def process_station(self, task: dict):
+        windy_id = task["provider_id"]
+        windy_station = task["station"]
+        station = self.save_station(
+            windy_id,
+            lambda names: StationNames(short_name=windy_station["name"], name=names.name or windy_station["name"]),
+            windy_station["lat"],
+            windy_station["lon"],
+            StationStatus.GREEN,
+            altitude=windy_station["elev_m"],
+            url=f"{self.provider_url}/station/pws-{windy_id}",
+        )
+
+        result = self.http_get(f"https://stations.windy.com/pws/station/open/{self.api_key}/{windy_id}")
+        windy_measures = result.json()["data"]
+        if not windy_measures:
+            return
+
+        measures = []
+        for index, ts in enumerate(windy_measures["ts"]):
+            key = arrow.get(ts).int_timestamp
+            wind_direction = windy_measures["wind_dir"][index]
+            wind_average = windy_measures["wind"][index]
+            wind_maximum = windy_measures["wind_gust"][index]
+            if (
+                wind_direction is not None
+                and wind_average is not None
+                and wind_maximum is not None
+                and self.is_new_measure(windy_id, key)
+                and not self.has_measure(station, key)
+            ):
+                measure = self.create_measure(
+                    station,
+                    key,
+                    wind_direction,
+                    Q_(wind_average, ureg.meter / ureg.second),
+                    Q_(wind_maximum, ureg.meter / ureg.second),
+                    temperature=windy_measures["temp"][index] if "temp" in windy_measures else None,
+                    pressure=(
+                        Pressure(
+                            qfe=(
+                                Q_(windy_measures["pressure"][index] / 1000, ureg.hPa)
+                                if windy_measures["pressure"][index] is not None
+                                else None
+                            ),
+                            qnh=None,
+                            qff=None,
+                        )
+                        if "pressure" in windy_measures
+                        else None
+                    ),
+                )
+                measures.append(measure)
+        self.insert_measures(station, measures)
+
     def process_data(self):
         selected_ids = list(map(lambda s: s["id"], self.get_stations_metadata()))
 
-        stations = {}
         try:
             self.log.info("Processing Windy data...")
 
-            result = requests.get(
-                f"https://stations.windy.com/pws/stations/{self.api_key}",
-                timeout=(self.connect_timeout, self.read_timeout),
-            )
-            windy_stations = result.json()
+            windy_stations = json.loads(self.fetch_shared(f"https://stations.windy.com/pws/stations/{self.api_key}"))
 
+            tasks = []
             for windy_station in filter(lambda s: s["id"] in selected_ids, windy_stations):
-                windy_id = None
-                try:
-                    windy_id = windy_station["id"]
-                    station = self.save_station(
-                        windy_id,
-                        lambda names: StationNames(
-                            short_name=windy_station["name"], name=names.name or windy_station["name"]
-                        ),
-                        windy_station["lat"],
-                        windy_station["lon"],
-                        StationStatus.GREEN,
-                        altitude=windy_station["elev_m"],
-                        url=f"{self.provider_url}/station/pws-{windy_id}",
-                    )
-                    stations[windy_id] = station
-
-                except ProviderException as e:
-                    self.log.warning(f"Error while processing station '{windy_id}': {e}")
-                except Exception as e:
-                    self.log.exception(f"Error while processing station '{windy_id}': {e}")
+                # The metadata sync refreshes all the stations, the measure sync only the due ones
+                if self.sync_metadata or self.is_station_due(windy_station["id"]):
+                    tasks.append({"provider_id": windy_station["id"], "station": windy_station})
+            self.dispatch_station_tasks(tasks)
 
         except ProviderException as e:
             self.log.warning(f"Error while processing stations: {e}")
         except Exception as e:
             self.log.exception(f"Error while processing stations: {e}")
 
-        for windy_id, station in stations.items():
-            station_id = station["_id"]
-            try:
-                result = requests.get(
-                    f"https://stations.windy.com/pws/station/open/{self.api_key}/{windy_id}",
-                    timeout=(self.connect_timeout, self.read_timeout),
-                )
-                windy_measures = result.json()["data"]
-                if not windy_measures:
-                    continue
-
-                measures = []
-                for index, ts in enumerate(windy_measures["ts"]):
-                    key = arrow.get(ts).int_timestamp
-                    wind_direction = windy_measures["wind_dir"][index]
-                    wind_average = windy_measures["wind"][index]
-                    wind_maximum = windy_measures["wind_gust"][index]
-                    if (
-                        wind_direction is not None
-                        and wind_average is not None
-                        and wind_maximum is not None
-                        and not self.has_measure(station, key)
-                    ):
-                        measure = self.create_measure(
-                            station,
-                            key,
-                            wind_direction,
-                            Q_(wind_average, ureg.meter / ureg.second),
-                            Q_(wind_maximum, ureg.meter / ureg.second),
-                            temperature=windy_measures["temp"][index] if "temp" in windy_measures else None,
-                            pressure=(
-                                Pressure(
-                                    qfe=(
-                                        Q_(windy_measures["pressure"][index] / 1000, ureg.hPa)
-                                        if windy_measures["pressure"][index] is not None
-                                        else None
-                                    ),
-                                    qnh=None,
-                                    qff=None,
-                                )
-                                if "pressure" in windy_measures
-                                else None
-                            ),
-                        )
-                        measures.append(measure)
-                self.insert_measures(station, measures)
-
-            except ProviderException as e:
-                self.log.warning(f"Error while processing measures for station '{station_id}': {e}")
-            except Exception as e:
-                self.log.exception(f"Error while processing measures for station '{station_id}': {e}")
-
         self.log.info("...Done!")
 
 
 def windy():
-    Windy(settings.WINDY_API_KEY, settings.ADMIN_DB_URL).process_data()
+    Windy.create().run()
 
 
 if __name__ == "__main__":
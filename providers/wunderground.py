@@ -1,6 +1,5 @@
 import arrow
 import psycopg2
-import requests
 from psycopg2.extras import DictCursor
 
 import settings
@@ -11,6 +10,7 @@ class WUnderground(Provider):
     provider_code = "wunderground"
     provider_name = "wunderground.com"
     provider_url = "https://www.wunderground.com"
+    adaptive_station_polling = True
 
     def __init__(self, admin_db_url):
         super().__init__()
@@ -20,7 +20,7 @@ class WUnderground(Provider):
         connection = None
         cursor = None
         try:
-            connection = psycopg2.connect(self.admin_db_url)
+            connection = self.connect_database(psycopg2.connect, self.admin_db_url)
             cursor = connection.cursor(cursor_factory=DictCursor)
             cursor.execute("select * from winds_mobi_wunderground_station")
             return cursor.fetchall()
@@ -37,16 +37,18 @@ class WUnderground(Provider):
             wu_station_ids = list(map(lambda s: s["id"], self.get_stations_metadata()))
 
             for wu_station_id in wu_station_ids:
+                # The metadata sync refreshes all the stations, the measure sync only the due ones
+                if not self.sync_metadata and not self.is_station_due(wu_station_id):
+                    continue
                 try:
                     url = (
                         "https://api.weather.com/v2/pws/observations/current"
-                        # the API key didn't change for years
-                        + "?apiKey=e1f10a1e78da46f5b10a1e78da96f525"
+                        + f"?apiKey={settings.WU_API_KEY}"
                         + f"&stationId={wu_station_id}"
                         + "&format=json"
                         + "&units=m"
                     )
-                    result = requests.get(url, timeout=(self.connect_timeout, self.read_timeout))
+                    result = self.http_get(url)
                     if not result.text:
                         raise ProviderException("No data")
                     data = result.json()
@@ -135,8 +137,10 @@ class WUnderground(Provider):
 
                 except ProviderException as e:
                     self.log.warning(f"Error while processing station '{wu_station_id}': {e}")
+                    self.metrics.count("stations_failed")
                 except Exception as e:
                     self.log.exception(f"Error while processing station '{wu_station_id}': {e}")
+                    self.metrics.count("stations_failed")
 
         except Exception as e:
             self.log.exception(f"Error while processing WUndergroundProvider: {e}")
@@ -145,7 +149,7 @@ class WUnderground(Provider):
 
 
 def wunderground():
-    WUnderground(settings.ADMIN_DB_URL).process_data()
+    WUnderground(settings.ADMIN_DB_URL).run()
 
 
 if __name__ == "__main__":
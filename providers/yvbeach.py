@@ -29,9 +29,7 @@ class YVBeach(Provider):
 
             session = requests.Session()
             session.headers.update(user_agents.chrome)
-            content = session.get(
-                "http://www.yvbeach.com/yvmeteo.wml", timeout=(self.connect_timeout, self.read_timeout)
-            ).text.replace("\r\n", "")
+            content = self.http_get("http://www.yvbeach.com/yvmeteo.wml", session=session).text.replace("\r\n", "")
 
             station = self.save_station(
                 "yvbeach",
@@ -66,14 +64,16 @@ class YVBeach(Provider):
 
         except ProviderException as e:
             self.log.warning(f"Error while processing station '{station_id}': {e}")
+            self.metrics.count("stations_failed")
         except Exception as e:
             self.log.exception(f"Error while processing station '{station_id}': {e}")
+            self.metrics.count("stations_failed")
 
         self.log.info("...Done!")
 
 
 def yvbeach():
-    YVBeach().process_data()
+    YVBeach().run()
 
 
 if __name__ == "__main__":
@@ -65,9 +65,7 @@ class Zermatt(Provider):
             session = requests.Session()
             session.headers.update(user_agents.chrome)
 
-            wind_tree = html.fromstring(
-                session.get(self.provider_url, timeout=(self.connect_timeout, self.read_timeout)).text
-            )
+            wind_tree = html.fromstring(self.http_get(self.provider_url, session=session).text)
 
             groups = wind_tree.xpath("//table[@class='w-all']")
 
@@ -164,8 +162,10 @@ class Zermatt(Provider):
                             self.log.warning(f"No data for station '{station_id}'")
                     except ProviderException as e:
                         self.log.warning(f"Error while processing station '{station_id}': {e}")
+                        self.metrics.count("stations_failed")
                     except Exception as e:
                         self.log.exception(f"Error while processing station '{station_id}': {e}")
+                        self.metrics.count("stations_failed")
                     finally:
                         i += next_row
 
@@ -174,7 +174,7 @@ class Zermatt(Provider):
 
 
 def zermatt():
-    Zermatt(ADMIN_DB_URL).process_data()
+    Zermatt(ADMIN_DB_URL).run()
 
 
 if __name__ == "__main__":
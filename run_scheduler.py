@@ -1,19 +1,269 @@
-import os
+import copy
+import logging
+import multiprocessing
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import arrow
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ProcessPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from pydantic import TypeAdapter
+from pymongo import MongoClient
+from sentry_sdk import metrics
+
+from settings import (
+    ADAPTIVE_SCHEDULING,
+    DISTRIBUTED_SCHEDULING,
+    METADATA_SYNC_INTERVAL,
+    MONGODB_URL,
+    REDIS_URL,
+    SCHEDULER_LEASE_TTL,
+    SCHEDULER_NODE_ID,
+    SCHEDULER_RUNNER,
+    SCHEDULER_SPEEDUP,
+    THREAD_RUNNER_CONCURRENCY,
+    WORKER_MAX_RUNS,
+)
+from winds_mobi_provider.cadence import Cadence
+from winds_mobi_provider.lease import run_leased_job
+from winds_mobi_provider.logging import configure_logging
+from winds_mobi_provider.phases import assign_phase_offsets
+from winds_mobi_provider.registry import get_enabled_provider_jobs
+from winds_mobi_provider.run_metrics import write_textfile
+
+log = logging.getLogger("scheduler")
+
+# The scheduler doesn't wait for an unavailable Mongo: it starts and runs the jobs without the run statistics
+mongo_timeout_ms = 5000
+
+
+class LeasedProcessPoolExecutor(ProcessPoolExecutor):
+    # Run each job only once across the scheduler nodes: the pool worker claims a Redis lease for the run and renews it
+    # until the end of the run. The nodes with the most free workers claim first.
+
+    claim_backoff = 2
+
+    def __init__(self, max_workers=10, pool_kwargs=None, node_id=None, lease_ttl=60):
+        super().__init__(max_workers, pool_kwargs)
+        self.max_workers = int(max_workers)
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.last_run_times = {}
+
+    def submit_job(self, job, run_times):
+        # The delay since the previous run of the job, shorter than the interval with the adaptive scheduling
+        run_time = run_times[-1].timestamp()
+        last_run_time = self.last_run_times.get(job.id)
+        self.last_run_times[job.id] = run_time
+        with self._lock:
+            running_jobs = sum(self._instances.values())
+        if running_jobs >= self.max_workers:
+            self._logger.info(f"No free worker on node '{self.node_id}' to claim '{job.id}'")
+            return
+        if last_run_time is not None:
+            delay = run_time - last_run_time
+        else:
+            delay = job.trigger.interval.total_seconds() if hasattr(job.trigger, "interval") else 0
+        # A run is claimed once, even if the nodes schedule it at slightly different times
+        min_gap = delay / 2
+        leased_job = copy.copy(job)
+        leased_job._jobstore_alias = job._jobstore_alias
+        leased_job.func = run_leased_job
+        leased_job.func_ref = "winds_mobi_provider.lease:run_leased_job"
+        leased_job.args = (
+            job.id,
+            job.func_ref,
+            job.args,
+            job.kwargs,
+            REDIS_URL,
+            self.node_id,
+            self.lease_ttl,
+            self.claim_backoff * running_jobs / self.max_workers,
+            run_time,
+            min_gap,
+        )
+        leased_job.kwargs = {}
+        super().submit_job(leased_job, run_times)
+
+
+def create_listeners_executor() -> ThreadPoolExecutor:
+    # The listeners run on the scheduler thread: their Mongo queries run in a single thread, in the events order, to
+    # not delay the dispatch of the jobs
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="scheduler-listeners")
+
+
+def adapt_intervals(scheduler, mongo_db, listeners_executor, provider_intervals):
+    # Reschedule each provider job after its run from the refresh cadence learned from its newest measure, the job
+    # keeps its configured interval if Mongo is unavailable
+    cadences = defaultdict(Cadence)
+
+    def adapt_interval(job_id):
+        interval, min_interval, max_interval = provider_intervals[job_id]
+        try:
+            provider = mongo_db.providers.find_one(job_id, projection={"lastMeasureAt": True})
+        except Exception as e:
+            log.warning(f"Unable to adapt '{job_id}' interval, keeping {interval} minutes: {e}")
+            return
+        try:
+            last_measure = None
+            if provider and provider.get("lastMeasureAt"):
+                last_measure = arrow.get(provider["lastMeasureAt"]).timestamp()
+            now = time.time()
+            cadence = cadences[job_id]
+            cadence.observe(last_measure, now)
+            delay = cadence.next_run_delay(now, interval * 60, min_interval * 60, max_interval * 60)
+            scheduler.modify_job(job_id, next_run_time=datetime.now().astimezone() + timedelta(seconds=delay))
+            log.info(
+                f"'{job_id}' next run in {delay / 60:.1f} minutes "
+                f"(cadence={(cadence.interval or 0) / 60:.1f}, stale runs={cadence.stale_runs})"
+            )
+        except Exception as e:
+            log.exception(f"Unable to adapt '{job_id}' interval: {e}")
+
+    def on_job_done(event):
+        if event.job_id in provider_intervals:
+            listeners_executor.submit(adapt_interval, event.job_id)
+
+    scheduler.add_listener(on_job_done, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+
+def get_phase_offsets(mongo_db, provider_intervals) -> dict[str, float]:
+    # Stable phase offset of each provider within its interval, from the statistics of its previous runs. Without
+    # statistics, e.g. if Mongo is unavailable, the providers start at the beginning of their interval.
+    try:
+        run_stats = {
+            provider["_id"]: provider
+            for provider in mongo_db.providers.find(
+                {"_id": {"$in": list(provider_intervals)}},
+                projection={"avgRunDuration": True, "avgInsertedMeasures": True},
+            )
+        }
+    except Exception as e:
+        log.warning(f"Unable to read the providers run statistics, the runs are not spread: {e}")
+        return {func_name: 0 for func_name in provider_intervals}
+    return assign_phase_offsets(
+        {
+            func_name: (
+                interval * 60,
+                run_stats.get(func_name, {}).get("avgRunDuration", 30),
+                run_stats.get(func_name, {}).get("avgInsertedMeasures", 0),
+            )
+            for func_name, (interval, _, _) in provider_intervals.items()
+        }
+    )
+
+
+def track_runs(scheduler, mongo_db, listeners_executor, provider_intervals):
+    # Save the average duration and inserted measures of the measure syncs, report the queueing delay and the skipped
+    # runs of the jobs
+
+    def save_run_stats(job_id, run_duration, run_inserted_measures):
+        try:
+            provider = mongo_db.providers.find_one(
+                job_id, projection={"avgRunDuration": True, "avgInsertedMeasures": True}
+            )
+            if provider and "avgRunDuration" in provider:
+                # Exponential moving average
+                duration = 0.8 * provider["avgRunDuration"] + 0.2 * run_duration
+                inserted_measures = 0.8 * provider["avgInsertedMeasures"] + 0.2 * run_inserted_measures
+            else:
+                duration, inserted_measures = run_duration, run_inserted_measures
+            mongo_db.providers.update_one(
+                {"_id": job_id},
+                {"$set": {"avgRunDuration": duration, "avgInsertedMeasures": inserted_measures}},
+                upsert=True,
+            )
+        except Exception as e:
+            log.warning(f"Unable to save '{job_id}' run statistics: {e}")
+
+    def on_job_executed(event):
+        if not isinstance(event.retval, dict) or "started_at" not in event.retval:
+            return
+        try:
+            queueing_delay = max(event.retval["started_at"] - event.scheduled_run_time.timestamp(), 0)
+            metrics.distribution(
+                "scheduler.queueing_delay", queueing_delay, unit="second", attributes={"job": event.job_id}
+            )
+            log.info(
+                f"'{event.job_id}' queued {queueing_delay:.1f}s, ran {event.retval['duration']:.1f}s, "
+                f"inserted {event.retval['inserted_measures']} measures"
+            )
+            if event.job_id in provider_intervals:
+                listeners_executor.submit(
+                    save_run_stats, event.job_id, event.retval["duration"], event.retval["inserted_measures"]
+                )
+        except Exception as e:
+            log.exception(f"Unable to track '{event.job_id}' run: {e}")
+
+    scheduler.add_listener(on_job_executed, EVENT_JOB_EXECUTED)
+
+    # Missed: too late to run within the misfire grace time. Max instances: the previous run of the job is still
+    # running.
+    skipped_runs = Counter()
+
+    def on_job_skipped(event):
+        reason = "missed" if event.code == EVENT_JOB_MISSED else "max_instances"
+        skipped_runs[event.job_id, reason] += 1
+        log.warning(f"'{event.job_id}' run {reason}")
+        try:
+            metrics.count(f"scheduler.{reason}_runs", 1, attributes={"job": event.job_id})
+            write_textfile(
+                "scheduler",
+                {
+                    "winds_mobi_scheduler_skipped_runs_total": (
+                        "counter",
+                        [({"job": job_id, "reason": reason}, nb) for (job_id, reason), nb in skipped_runs.items()],
+                    )
+                },
+            )
+        except Exception as e:
+            log.exception(f"Unable to export '{event.job_id}' skipped runs: {e}")
+
+    scheduler.add_listener(on_job_skipped, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
 
 
 def run_scheduler():
+    configure_logging()
+    # The thread runner runs all the providers concurrently in the scheduler process
+    use_threads = SCHEDULER_RUNNER == "threads"
     scheduler = BlockingScheduler()
-    scheduler.configure(
-        executors={
-            "admin": {"type": "processpool", "max_workers": 1},
-            "providers": {"type": "processpool", "max_workers": 2},
+    executors = {
+        "admin": {"type": "processpool", "max_workers": 1},
+        "providers": {
+            "type": "processpool",
+            "max_workers": 2,
+            # Workers keep their clients and caches warm between runs: recycle them after WORKER_MAX_RUNS runs
+            "pool_kwargs": {"max_tasks_per_child": WORKER_MAX_RUNS},
         },
+    }
+    if use_threads:
+        executors["providers"] = {"type": "threadpool", "max_workers": THREAD_RUNNER_CONCURRENCY}
+        # Forking the scheduler process while its threads are running is unsafe
+        executors["providers_processes"] = {
+            "type": "processpool",
+            "max_workers": 2,
+            "pool_kwargs": {"mp_context": multiprocessing.get_context("spawn"), "max_tasks_per_child": WORKER_MAX_RUNS},
+        }
+    if TypeAdapter(bool).validate_python(DISTRIBUTED_SCHEDULING):
+        # Several scheduler nodes share the jobs
+        if use_threads:
+            raise ValueError("Distributed scheduling is only supported by the processpool runner")
+        executors = {
+            name: LeasedProcessPoolExecutor(
+                executor["max_workers"],
+                pool_kwargs=executor.get("pool_kwargs"),
+                node_id=SCHEDULER_NODE_ID,
+                lease_ttl=SCHEDULER_LEASE_TTL,
+            )
+            for name, executor in executors.items()
+        }
+    scheduler.configure(
+        executors=executors,
         job_defaults={
-            "misfire_grace_time": 3 * 60,
+            "misfire_grace_time": max(int(3 * 60 / SCHEDULER_SPEEDUP), 1),
             "coalesce": True,  # Reschedule a single job if it failed 3 minutes ago
             "max_instances": 1,  # Only 1 job instance executing concurrently
         },
@@ -45,46 +295,49 @@ def run_scheduler():
         executor="admin",
     )
 
-    # start_date must be in the future when the scheduler starts
-    start_date = datetime.now().astimezone() + timedelta(seconds=10)
-
-    for provider_job in [
-        # Alphabetical order
-        ("providers.aletsch:aletsch", 5),
-        ("providers.borntofly:borntofly", 5),
-        ("providers.ffvl:ffvl", 5),
-        ("providers.gxaircom:gxaircom", 5),
-        ("providers.holfuy:holfuy", 5),
-        ("providers.iweathar:iweathar", 5),
-        ("providers.kachelmannwetter:kachelmannwetter", 5),
-        ("providers.metar:metar", 10),
-        ("providers.meteoswiss:meteoswiss", 5),
-        ("providers.pdcs:pdcs", 5),
-        ("providers.pioupiou:pioupiou", 5),
-        ("providers.pmcjoder:pmcjoder", 5),
-        ("providers.pgsonda:pgsonda", 5),
-        ("providers.slf:slf", 5),
-        ("providers.thunerwetter:thunerwetter", 5),
-        ("providers.windball:windball", 5),
-        ("providers.windline:windline", 5),
-        ("providers.windspots:windspots", 5),
-        ("providers.windy:windy", 5),
-        ("providers.wunderground:wunderground", 5),
-        ("providers.yvbeach:yvbeach", 5),
-        ("providers.zermatt:zermatt", 5),
-    ]:
-        func = provider_job[0]
-        func_name = func.split(":")[1]
-        if not TypeAdapter(bool).validate_python(os.environ.get(f"DISABLE_PROVIDER_{func_name.upper()}", False)):
-            interval = provider_job[1]
-            scheduler.add_job(
-                func,
-                trigger="interval",
-                start_date=start_date,
-                minutes=interval,
-                jitter=5 * 60,  # randomize start_date during 5 minutes period
-                executor="providers",
-            )
+    provider_jobs = get_enabled_provider_jobs()
+    provider_intervals = {
+        provider_job.name: (provider_job.interval, provider_job.min_interval, provider_job.max_interval)
+        for provider_job in provider_jobs
+    }
+
+    # A single client for the run statistics of the scheduler, queried in the background by the listeners
+    mongo_db = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=mongo_timeout_ms).get_database()
+    listeners_executor = create_listeners_executor()
+
+    # Spread the runs at stable phases, aligned on the day to stay the same after a restart
+    phase_offsets = get_phase_offsets(mongo_db, provider_intervals)
+    day_start = arrow.now().floor("day").datetime
+    for provider_job in provider_jobs:
+        func_name = provider_job.name
+        start_date = day_start + timedelta(seconds=phase_offsets[func_name] / SCHEDULER_SPEEDUP)
+        log.info(f"'{func_name}' runs every {provider_job.interval} minutes at +{phase_offsets[func_name]}s")
+        # A single tick per provider: a measure sync reusing the saved stations documents, promoted to a full station
+        # metadata sync by the first run after METADATA_SYNC_INTERVAL
+        kwargs = {
+            "shards": provider_job.shards,
+            "metadata_sync_interval": METADATA_SYNC_INTERVAL * 60 / SCHEDULER_SPEEDUP,
+        }
+        run_func, executor = "winds_mobi_provider.provider:run_provider", provider_job.executor
+        if use_threads:
+            if provider_job.cpu_bound:
+                executor = "providers_processes"
+            else:
+                run_func = "winds_mobi_provider.thread_runner:run_provider_in_thread"
+        scheduler.add_job(
+            run_func,
+            args=(provider_job.func_ref, False),
+            kwargs=kwargs,
+            id=func_name,
+            name=func_name,
+            trigger="interval",
+            start_date=start_date,
+            seconds=provider_job.interval * 60 / SCHEDULER_SPEEDUP,
+            executor=executor,
+        )
+    track_runs(scheduler, mongo_db, listeners_executor, provider_intervals)
+    if TypeAdapter(bool).validate_python(ADAPTIVE_SCHEDULING):
+        adapt_intervals(scheduler, mongo_db, listeners_executor, provider_intervals)
     scheduler.start()
 
 
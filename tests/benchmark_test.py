@@ -0,0 +1,25 @@
+import json
+
+from winds_mobi_provider.benchmark import compare_results, main
+
+
+def test_benchmark(tmp_path, capsys):
+    main(["pioupiou", "--runs", "2", "--output", str(tmp_path / "baseline.json")])
+    main(["pioupiou", "--runs", "2", "--sync", "measure", "--compare", str(tmp_path / "baseline.json")])
+
+    result = json.loads((tmp_path / "baseline.json").read_text())
+    assert result["stations"] == 3
+    assert result["measures"] == 3
+    assert result["stations_per_second"] > 0
+    assert set(result["round_trips"]) == {"http", "mongo", "redis"}
+    assert "stations_per_second" in capsys.readouterr().out
+
+
+def test_compare_results():
+    baseline = {"revision": "abc", "stations_per_second": 100, "measures_per_second": 0, "duration": 2}
+    result = {"stations_per_second": 50, "measures_per_second": 10, "duration": 1}
+    assert compare_results(result, baseline) == [
+        "Compared to 'abc':",
+        "  stations_per_second: 100 -> 50 (-50.0%, worse)",
+        "  duration: 2 -> 1 (-50.0%, better)",
+    ]
@@ -0,0 +1,47 @@
+import pytest
+
+from winds_mobi_provider.cadence import Cadence
+
+
+def test_default_delay_without_cadence():
+    cadence = Cadence()
+    assert cadence.next_run_delay(1000, default=300, minimum=120, maximum=1800) == 300
+    cadence.observe(900, now=1000)
+    assert cadence.next_run_delay(1000, default=300, minimum=120, maximum=1800) == 300
+
+
+def test_poll_after_expected_refresh():
+    cadence = Cadence()
+    # Upstream refreshed every 600s, published 100s after the measure time
+    for measure in range(0, 3000, 600):
+        assert cadence.observe(measure, now=measure + 100)
+    assert cadence.interval == 600
+    assert cadence.delay == 100
+    # Last measure 2400 found at 2500, next one expected at 3000 + 100
+    assert cadence.next_run_delay(2500, default=300, minimum=120, maximum=1800) == pytest.approx(600)
+
+
+def test_back_off_when_stale():
+    cadence = Cadence()
+    for measure in range(0, 3000, 600):
+        cadence.observe(measure, now=measure + 100)
+    delays = []
+    for now in (3200, 3500, 4100, 5300):
+        assert not cadence.observe(2400, now=now)
+        delays.append(cadence.next_run_delay(now, default=300, minimum=120, maximum=1800))
+    assert delays == [300, 600, 1200, 1800]
+
+
+def test_station_due():
+    cadence = Cadence()
+    assert cadence.is_due(0, silent_duration=6 * 3600, slow_interval=3600)
+    for measure in range(0, 3000, 600):
+        cadence.observe(measure, now=measure + 100)
+    cadence = Cadence.from_dict(cadence.to_dict())
+    # Next report expected at 3000, published at 3100
+    assert not cadence.is_due(2700, silent_duration=6 * 3600, slow_interval=3600)
+    assert cadence.is_due(3100, silent_duration=6 * 3600, slow_interval=3600)
+    # Silent station: polled once per slow interval
+    cadence.checked_at = 30000
+    assert not cadence.is_due(32000, silent_duration=6 * 3600, slow_interval=3600)
+    assert cadence.is_due(33600, silent_duration=6 * 3600, slow_interval=3600)
@@ -0,0 +1,91 @@
+import gzip
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from winds_mobi_provider.cassettes import Cassette, CassetteException, create_response, use_cassettes
+from winds_mobi_provider.fakes import fake_backends, load_payloads
+from winds_mobi_provider.provider import run_provider
+
+payloads_dir = Path(__file__).parent / "payloads"
+
+
+def test_record_replay_http(tmp_path):
+    with use_cassettes("record", tmp_path), fake_backends(load_payloads(payloads_dir / "windspots.json")) as backends:
+        run_provider("providers.windspots:windspots")
+        recorded_measures = backends.mongo_db["windspots-vil"].documents
+    # 3 upstream responses, the Google APIs calls are not recorded
+    assert len(list((tmp_path / "windspots").glob("*/*-http-*.json.gz"))) == 3
+
+    with use_cassettes("replay", tmp_path), fake_backends({}) as backends:
+        run_provider("providers.windspots:windspots")
+        assert backends.round_trips.total("http") == 0
+        assert backends.mongo_db["windspots-vil"].documents.keys() == recorded_measures.keys()
+
+
+def test_redact_secrets(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.FFVL_API_KEY", "ffvl-secret")
+    url = "https://data.ffvl.fr/api/?base=balises&r=list&mode=json&key=ffvl-secret"
+    Cassette(tmp_path, "record").record_response("GET", url, {}, create_response(url, b"[]"), 0.1)
+
+    (interaction_path,) = tmp_path.glob("*/*-http-*.json.gz")
+    assert b"ffvl-secret" not in gzip.decompress(interaction_path.read_bytes())
+    assert Cassette(tmp_path, "replay").replay_response("GET", url, {}).content == b"[]"
+
+
+def test_record_replay_sql(tmp_path):
+    query = "SELECT stationid, measuredate, data FROM tblstationdata WHERE stationid=?"
+    cassette = Cassette(tmp_path, "record")
+    connection = cassette.connect_database(sqlite3.connect, ":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE tblstationdata (stationid TEXT, measuredate TIMESTAMP, data DECIMAL)")
+    cursor.execute("INSERT INTO tblstationdata VALUES ('a', '2026-10-19 10:00:00', 12.5)")
+    cursor.execute(query, ("a",))
+    assert cursor.fetchall() == [["a", "2026-10-19 10:00:00", 12.5]]
+    connection.close()
+
+    cassette = Cassette(tmp_path, "replay")
+    cursor = cassette.connect_database(sqlite3.connect, "unused.db").cursor()
+    cursor.execute(query, ("a",))
+    row = cursor.fetchone()
+    assert row == ["a", "2026-10-19 10:00:00", 12.5]
+    assert row["data"] == 12.5
+    assert cursor.fetchone() is None
+    with pytest.raises(CassetteException):
+        cursor.execute("SELECT * FROM tblstation")
+
+
+def test_replay_sql_by_query(tmp_path):
+    query = "SELECT data FROM tblstationdata WHERE stationid=%s AND measuredate>=%s"
+    cassette = Cassette(tmp_path, "record")
+    cassette.record_rows(query, ("a", datetime(2026, 10, 17)), ["data"], [[1]], 0.1)
+    cassette.record_rows(query, ("b", datetime(2026, 10, 17)), ["data"], [[2]], 0.1)
+    cassette.record_rows(query, ("c", datetime(2026, 10, 17)), ["data"], [[3]], 0.1)
+
+    # Replayed later: the time-dependent params don't match, the same params first then the recording order
+    cassette = Cassette(tmp_path, "replay")
+    assert cassette.replay_rows(query, ("b", datetime(2026, 10, 17)))[1] == [[2]]
+    assert cassette.replay_rows(query, ("a", datetime(2026, 10, 19)))[1] == [[1]]
+    assert cassette.replay_rows(query, ("c", datetime(2026, 10, 19)))[1] == [[3]]
+    assert cassette.replay_rows(query, ("c", datetime(2026, 10, 19)))[1] == [[3]]
+
+
+def test_record_concurrent_runs(tmp_path):
+    # E.g. the shards of a run or a metadata and a measure sync
+    cassettes = [Cassette(tmp_path, "record") for _ in range(2)]
+    for index, cassette in enumerate(cassettes):
+        cassette.record_rows("SELECT", None, ["run"], [[index]], 0.1)
+
+    assert len(list(tmp_path.glob("*/000001-sql-*.json.gz"))) == 2
+    cassette = Cassette(tmp_path, "replay")
+    assert sorted(cassette.replay_rows("SELECT", None)[1] for _ in range(2)) == [[[0]], [[1]]]
+
+
+def test_encode_values(tmp_path):
+    cassette = Cassette(tmp_path, "record")
+    rows = [[datetime(2026, 10, 19, 10, 0), Decimal("1.5"), b"\x00"]]
+    cassette.record_rows("SELECT", None, ["date", "value", "raw"], rows, 0.1)
+    assert Cassette(tmp_path, "replay").replay_rows("SELECT", None) == (["date", "value", "raw"], rows)
@@ -0,0 +1,10 @@
+import pytest
+
+from winds_mobi_provider.provider import release_warm_resources
+
+
+@pytest.fixture(autouse=True)
+def warm_resources():
+    # Don't share the (mocked) clients between tests
+    yield
+    release_warm_resources()
@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from winds_mobi_provider.registry import ProviderJob, provider_jobs
+
+# Seconds to import the providers base module in a new process, run by the scheduler and the workers on startup
+import_time_budget = 1.0
+# Only imported when a provider first needs them
+lazy_modules = ["pint", "timezonefinder", "numpy", "scipy", "sklearn"]
+
+
+def import_module(module_name) -> tuple[float, list[str]]:
+    code = (
+        "import json, sys, time\n"
+        "started_at = time.perf_counter()\n"
+        f"import {module_name}\n"
+        "print(json.dumps([time.perf_counter() - started_at, list(sys.modules)]))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).parents[1], capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_import_time_budget():
+    duration, modules = import_module("winds_mobi_provider")
+    assert "winds_mobi_provider.provider" not in modules
+
+    duration, modules = import_module("winds_mobi_provider.provider")
+    assert duration < import_time_budget
+    assert not [module for module in modules if module.split(".")[0] in lazy_modules]
+
+
+def test_registry():
+    _, modules = import_module("winds_mobi_provider.registry")
+    assert not [module for module in modules if module.split(".")[0] == "providers"]
+
+    assert len({provider_job.name for provider_job in provider_jobs}) == len(provider_jobs)
+    provider_job = ProviderJob("providers.windy:windy", required_settings=("WINDY_API_KEY", "UNKNOWN_SETTING"))
+    assert provider_job.name == "windy"
+    assert "UNKNOWN_SETTING" in provider_job.missing_settings()
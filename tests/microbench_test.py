@@ -0,0 +1,57 @@
+import json
+
+from winds_mobi_provider.microbench import (
+    benchmarks,
+    compare_results,
+    default_baselines_path,
+    run_microbench,
+    update_baselines,
+)
+
+
+def test_microbench():
+    result = run_microbench(min_time=0.001, repeat=1)
+
+    assert set(result["benchmarks"]) == set(benchmarks)
+    assert all(benchmark["per_call_us"] > 0 for benchmark in result["benchmarks"].values())
+    assert result["reference_us"] > 0
+
+
+def test_baselines():
+    # Each benchmark has a tracked baseline
+    baselines = json.loads(default_baselines_path.read_text())
+    assert set(baselines["benchmarks"]) == set(benchmarks)
+
+
+def test_compare_results():
+    baselines = {
+        "revision": "abc",
+        "benchmarks": {
+            "to_int": {"per_call_us": 1, "relative": 0.01},
+            "to_float": {"per_call_us": 1, "relative": 0.01, "threshold": 1},
+        },
+    }
+    result = {
+        "benchmarks": {
+            "to_int": {"per_call_us": 2, "relative": 0.02},
+            "to_float": {"per_call_us": 2, "relative": 0.015},
+            "to_bool": {"per_call_us": 1, "relative": 0.01},
+        }
+    }
+    lines, regressions = compare_results(result, baselines, threshold=0.5)
+    assert lines == [
+        "Compared to 'abc':",
+        "  to_int: 1us -> 2us (+100.0%, FAIL, threshold +50%)",
+        "  to_float: 1us -> 2us (+50.0%, ok, threshold +100%)",
+        "  to_bool: no baseline",
+    ]
+    assert regressions == ["to_int"]
+
+
+def test_update_baselines():
+    baselines = {"benchmarks": {"to_int": {"per_call_us": 1, "relative": 0.01, "threshold": 1}}}
+    result = {"revision": "def", "benchmarks": {"to_int": {"per_call_us": 2, "relative": 0.02}}}
+    assert update_baselines(result, baselines) == {
+        "revision": "def",
+        "benchmarks": {"to_int": {"per_call_us": 2, "relative": 0.02, "threshold": 1}},
+    }
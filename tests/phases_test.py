@@ -0,0 +1,19 @@
+from winds_mobi_provider.phases import assign_phase_offsets
+
+
+def test_spread_jobs_over_interval():
+    offsets = assign_phase_offsets({f"job{i}": (300, 60, 0) for i in range(5)})
+    assert sorted(offsets.values()) == [0, 60, 120, 180, 240]
+
+
+def test_heaviest_jobs_apart():
+    offsets = assign_phase_offsets(
+        {"metar": (600, 120, 5000), "holfuy": (300, 60, 1000), "light": (300, 10, 10), "other": (300, 10, 10)}
+    )
+    assert offsets == assign_phase_offsets(
+        {"metar": (600, 120, 5000), "holfuy": (300, 60, 1000), "light": (300, 10, 10), "other": (300, 10, 10)}
+    )
+    # holfuy doesn't run during any metar run
+    metar_runs = [(offsets["metar"] + start) % 600 for start in range(0, 120)]
+    holfuy_runs = [(offsets["holfuy"] + start) % 300 for start in range(0, 60)]
+    assert not set(holfuy_runs) & {run % 300 for run in metar_runs}
@@ -0,0 +1,32 @@
+import logging
+import os
+from unittest import mock
+
+import pytest
+
+from winds_mobi_provider.profiling import get_profiling_rate, profile_run
+
+log = logging.getLogger("test")
+
+
+@pytest.mark.parametrize(
+    "value,expected_rate",
+    [(None, 0), ("", 0), ("false", 0), ("true", 1), ("1", 1), ("0.05", 0.05), ("2", 1)],
+)
+def test_profiling_rate(value, expected_rate):
+    environ = {"PROFILE_PROVIDER_TEST": value} if value is not None else {}
+    with mock.patch.dict(os.environ, environ):
+        assert get_profiling_rate("test") == expected_rate
+
+
+def test_profile_run(tmp_path):
+    with mock.patch("winds_mobi_provider.profiling.PROFILING_DIR", tmp_path):
+        with mock.patch.dict(os.environ, {"PROFILE_PROVIDER_TEST": "true"}), profile_run("test", "test-measure", log):
+            data = [str(i) for i in range(10000)]
+        with profile_run("test", "test-metadata", log):
+            data.append("not profiled")
+
+    assert len(list(tmp_path.glob("test-measure-*.pstats"))) == 1
+    allocations = next(tmp_path.glob("test-measure-*.allocations.txt")).read_text()
+    assert allocations.startswith("Peak traced memory")
+    assert not list(tmp_path.glob("test-metadata-*"))
@@ -1,9 +1,13 @@
+import contextvars
+import json
 from unittest import mock
 
 import pytest
 import requests
 
-from winds_mobi_provider import Provider
+from winds_mobi_provider import Provider, ProviderException, StationStatus
+from winds_mobi_provider import provider as provider_module
+from winds_mobi_provider.fakes import fake_backends
 
 
 @pytest.mark.skip("Need a redis connection to Google API caches")
@@ -18,3 +22,172 @@ def test_parse_reverse_geocoding_results(mongodb, station_id, expected_name):
     short_name, name = provider._Provider__parse_reverse_geocoding_results(f"address2/{lat},{lon}", None, None, None)
     assert short_name == expected_name
     assert name == expected_name
+
+
+class FakeProvider(Provider):
+    provider_code = "test"
+    provider_name = "test.com"
+    provider_url = "https://test.com"
+
+
+def create_provider(provider_class, **run_context):
+    # Create a provider in the context of a run, e.g. sync_metadata=False
+    def create():
+        for name, value in run_context.items():
+            getattr(provider_module, f"_{name}").set(value)
+        return provider_class()
+
+    return contextvars.copy_context().run(create)
+
+
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_watermarks(mongodb, redis):
+    redis_client = redis.StrictRedis.from_url.return_value
+    redis_client.hgetall.return_value = {"test-1": "1000"}
+    provider = FakeProvider()
+    provider.load_watermarks()
+    redis_client.hgetall.assert_called_once_with("watermarks/test")
+
+    assert not provider.is_new_measure(1, 999)
+    assert not provider.is_new_measure(1, 1000)
+    assert provider.is_new_measure(1, 1001)
+    assert provider.is_new_measure(2, 1)
+
+    station = {"_id": "test-2", "tz": "Europe/Zurich", "short": "Test", "name": "Test"}
+    provider.insert_measures(station, [{"_id": 1200}, {"_id": 1100}])
+    provider.save_watermarks()
+    redis_client.pipeline.return_value.hset.assert_called_once_with("watermarks/test", mapping={"test-2": 1200})
+    assert not provider.is_new_measure(2, 1200)
+
+
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_measure_sync_reuses_saved_stations(mongodb, redis):
+    stations_collection = mongodb.return_value.get_database.return_value.stations
+    saved_station = {"_id": "test-1", "short": "Test", "name": "Test", "alt": 500, "tz": "Europe/Zurich"}
+    stations_collection.find.return_value = [saved_station]
+
+    provider = create_provider(FakeProvider, sync_metadata=False)
+    assert provider.save_station(1, lambda names: names, 46.5, 6.5, StationStatus.GREEN) == saved_station
+    assert provider.save_station(1, lambda names: names, 46.5, 6.5, StationStatus.GREEN) == saved_station
+    stations_collection.find.assert_called_once()
+    stations_collection.update_one.assert_not_called()
+    redis.StrictRedis.from_url.return_value.exists.assert_not_called()
+
+
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_fencing(mongodb, redis):
+    redis_client = redis.StrictRedis.from_url.return_value
+    station = {"_id": "test-1", "tz": "Europe/Zurich", "short": "Test", "name": "Test"}
+
+    provider = create_provider(FakeProvider, fencing=("test", 3))
+    redis_client.hget.return_value = "4"
+    with pytest.raises(ProviderException):
+        provider.insert_measures(station, [{"_id": 1000}])
+    redis_client.hget.assert_called_once_with("fencing/test", "token")
+    mongodb.return_value.get_database.return_value["test-1"].insert_many.assert_not_called()
+
+
+class QueueProvider(FakeProvider):
+    station_queue = True
+
+    def __init__(self):
+        super().__init__()
+        self.processed = []
+
+    def process_station(self, task):
+        if task["provider_id"] == "error":
+            raise ProviderException("Error")
+        self.processed.append(task["provider_id"])
+
+
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_dispatch_station_tasks(mongodb, redis):
+    provider = QueueProvider()
+    provider.dispatch_station_tasks([{"provider_id": 1}, {"provider_id": "error"}, {"provider_id": 2}])
+    assert provider.processed == [1, 2]
+    redis.StrictRedis.from_url.return_value.rpush.assert_not_called()
+
+
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_dispatch_station_tasks_without_process_station(mongodb, redis):
+    with pytest.raises(ProviderException, match="doesn't define process_station"):
+        FakeProvider().dispatch_station_tasks([{"provider_id": 1}])
+
+
+@mock.patch("winds_mobi_provider.provider.STATION_QUEUE", True)
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_dispatch_station_tasks_to_queue(mongodb, redis):
+    redis_client = redis.StrictRedis.from_url.return_value
+    provider = QueueProvider()
+    queued_tasks = []
+    redis_client.pipeline.return_value.rpush.side_effect = lambda key, *tasks: queued_tasks.extend(tasks)
+
+    def lpop(key, count):
+        # A worker processes the first task, the run processes the others
+        popped = queued_tasks[1:]
+        queued_tasks.clear()
+        return popped
+
+    redis_client.lpop.side_effect = lpop
+    redis_client.hmget.return_value = ["3", "2", "1"]
+    redis_client.hgetall.return_value = {"total": "3", "done": "2", "failed": "1", "count/measures_inserted": "4"}
+    provider.dispatch_station_tasks([{"provider_id": 1}, {"provider_id": 2}, {"provider_id": "error"}])
+
+    assert provider.processed == [2]
+    redis_client.pipeline.return_value.rpush.assert_called_once()
+    assert redis_client.pipeline.return_value.rpush.call_args.args[0] == "station-queue/test"
+    run_key = redis_client.pipeline.return_value.hset.call_args.args[0]
+    redis_client.pipeline.return_value.hincrby.assert_any_call(run_key, "done", 1)
+    redis_client.pipeline.return_value.hincrby.assert_any_call(run_key, "failed", 1)
+    assert provider.metrics.counts["stations_failed"] == 1
+    assert provider.metrics.counts["measures_inserted"] == 4
+
+
+def test_process_queued_tasks_of_several_runs():
+    providers = []
+
+    class WorkerProvider(QueueProvider):
+        def __init__(self):
+            super().__init__()
+            providers.append(self)
+
+    with fake_backends({}) as backends:
+        runs = backends.redis.data
+        runs["station-queue/test/run-1"] = {"total": "2", "done": "0", "failed": "0", "sync_metadata": "1"}
+        runs["station-queue/test/run-2"] = {"total": "1", "done": "0", "failed": "0", "sync_metadata": "0"}
+        runs["station-queue/test/run-2"]["fencing"] = json.dumps(["test", 3])
+        WorkerProvider.process_queued_tasks(
+            [
+                json.dumps({"run": "run-1", "task": {"provider_id": 1}}),
+                json.dumps({"run": "run-2", "task": {"provider_id": 2}}),
+                json.dumps({"run": "run-1", "task": {"provider_id": "error"}}),
+            ]
+        )
+
+    # A provider by run, in the context of the run
+    assert [(provider.processed, provider.sync_metadata) for provider in providers] == [([1], True), ([2], False)]
+    assert providers[1]._Provider__fencing == ("test", 3)
+    assert (runs["station-queue/test/run-1"]["done"], runs["station-queue/test/run-1"]["failed"]) == ("1", "1")
+    assert runs["station-queue/test/run-2"]["done"] == "1"
+    assert runs["station-queue/test/run-2"]["count/stations_seen"] == "0"
+
+
+@mock.patch("winds_mobi_provider.provider.requests")
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_shards(mongodb, redis, requests, tmp_path):
+    requests.Session.return_value.get.return_value.content = b"payload"
+    shards = [create_provider(QueueProvider, shard=(index, 3, str(tmp_path))) for index in range(3)]
+
+    for shard in shards:
+        assert shard.fetch_shared("https://test.com/all") == b"payload"
+        shard.dispatch_station_tasks([{"provider_id": provider_id} for provider_id in range(100)])
+    requests.Session.return_value.get.assert_called_once()
+    assert sorted(sum((shard.processed for shard in shards), [])) == list(range(100))
+    assert all(shard.processed for shard in shards)
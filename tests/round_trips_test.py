@@ -0,0 +1,212 @@
+import json
+import re
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+
+from winds_mobi_provider.cassettes import decode_value
+from winds_mobi_provider.fakes import fake_backends, load_payloads
+from winds_mobi_provider.provider import run_provider
+
+payloads_dir = Path(__file__).parent / "payloads"
+
+# Round trips allowed by backend: (by station, by run)
+new_stations_budgets = {"mongo": (12, 2), "redis": (6, 6), "google": (2, 0)}
+known_stations_budgets = {"mongo": (1, 1), "redis": (0, 5), "google": (0, 0)}
+ingested_measures_budgets = {"mongo": (0, 0), "redis": (0, 4), "google": (0, 0)}
+new_measures_budgets = {"mongo": (6, 1), "redis": (0, 6), "google": (0, 0)}
+
+# Provider code and number of valid stations of the recorded payloads, each one with a new measure
+providers = [
+    ("pioupiou", 3),
+    ("holfuy", 3),
+    ("gxaircom", 3),
+    ("windspots", 2),
+    ("meteoswiss", 3),
+    ("metar", 3),
+    ("ffvl", 3),
+    ("pdcs", 3),
+    ("windball", 3),
+    ("windy", 3),
+    ("wunderground", 3),
+    ("kachelmannwetter", 1),
+    ("slf", 2),
+]
+watermarks_providers = ["pioupiou", "holfuy", "gxaircom", "ffvl", "pdcs", "windball"]
+adaptive_polling_providers = ["windspots", "kachelmannwetter", "slf", "windy", "wunderground"]
+# Driver of the SQL database of the providers, its tables are recorded in tests/payloads/{provider_code}.sql.json
+sql_drivers = {"windline": "MySQLdb", "windy": "psycopg2", "wunderground": "psycopg2"}
+
+
+def run(provider_code, sync_metadata=True):
+    run_provider(f"providers.{provider_code}:{provider_code}", sync_metadata)
+
+
+class FakeCursor:
+    # Rows of the queried table, the conditions of the queries are not applied
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.rows = list(self.tables[re.search(r"FROM (\w+)", query, re.IGNORECASE).group(1)])
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        yield from rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, tables: dict):
+        self.tables = tables
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.tables)
+
+    def close(self):
+        pass
+
+
+def provider_backends(provider_code, monkeypatch):
+    # The recorded HTTP payloads and SQL tables of the provider
+    if driver := sql_drivers.get(provider_code):
+        pytest.importorskip(driver)
+        tables = decode_value(json.loads((payloads_dir / f"{provider_code}.sql.json").read_text()))
+        monkeypatch.setattr(
+            f"providers.{provider_code}.{driver}.connect", lambda *args, **kwargs: FakeConnection(tables)
+        )
+    payloads_path = payloads_dir / f"{provider_code}.json"
+    return fake_backends(load_payloads(payloads_path) if payloads_path.exists() else {})
+
+
+def assert_round_trips(round_trips, stations, budgets):
+    for backend, (by_station, by_run) in budgets.items():
+        budget = by_station * stations + by_run
+        assert round_trips.total(backend) <= budget, (
+            f"{round_trips.total(backend)} {backend} round trips for {stations} stations, budget is {budget}: "
+            f"{dict(round_trips.counts)}"
+        )
+
+
+@pytest.mark.parametrize("provider_code,stations", providers)
+def test_new_stations(provider_code, stations, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+
+        assert len(backends.mongo_db.stations.documents) == stations
+        assert_round_trips(backends.round_trips, stations, new_stations_budgets)
+
+
+@pytest.mark.parametrize("provider_code,stations", providers)
+def test_known_stations(provider_code, stations, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+        # The measures are not skipped by the watermarks, the saved stations are reused by the measure sync
+        backends.redis.data.pop(f"watermarks/{provider_code}", None)
+        backends.redis.data.pop(f"cadences/{provider_code}", None)
+        backends.round_trips.reset()
+        run(provider_code, sync_metadata=False)
+
+        assert_round_trips(backends.round_trips, stations, known_stations_budgets)
+
+
+@pytest.mark.parametrize("provider_code,stations", providers)
+def test_new_measures_on_known_stations(provider_code, stations, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+        # The measure sync inserts the new measures of the saved stations and refreshes their lastSeenAt
+        backends.forget_measures(provider_code)
+        last_seen_at = datetime(2026, 1, 1, tzinfo=UTC)
+        for station in backends.mongo_db.stations.documents.values():
+            station["lastSeenAt"] = last_seen_at
+        backends.round_trips.reset()
+        run(provider_code, sync_metadata=False)
+
+        assert backends.round_trips.counts[("mongo", "insert_many")] == stations
+        assert all(station["lastSeenAt"] > last_seen_at for station in backends.mongo_db.stations.documents.values())
+        assert_round_trips(backends.round_trips, stations, new_measures_budgets)
+
+
+def test_windline(monkeypatch):
+    # The holfuy station is discarded. The measure syncs read the high-water marks of the stations with one more mongo
+    # query, the ingested measures are skipped by them and not by the watermarks.
+    with provider_backends("windline", monkeypatch) as backends:
+        run("windline")
+
+        assert len(backends.mongo_db.stations.documents) == 3
+        assert_round_trips(backends.round_trips, 3, new_stations_budgets)
+
+        backends.round_trips.reset()
+        run("windline", sync_metadata=False)
+
+        assert_round_trips(backends.round_trips, 3, {**known_stations_budgets, "mongo": (1, 2)})
+
+        backends.forget_measures("windline")
+        backends.round_trips.reset()
+        run("windline", sync_metadata=False)
+
+        assert backends.round_trips.counts[("mongo", "insert_many")] == 3
+        assert_round_trips(backends.round_trips, 3, {**new_measures_budgets, "mongo": (6, 2)})
+
+
+@pytest.mark.parametrize("provider_code", watermarks_providers)
+def test_ingested_measures(provider_code, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+        backends.round_trips.reset()
+        run(provider_code, sync_metadata=False)
+
+        assert_round_trips(backends.round_trips, 0, ingested_measures_budgets)
+
+
+@pytest.mark.parametrize("provider_code", watermarks_providers)
+def test_metadata_sync_refreshes_ingested_stations(provider_code, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+        stations = backends.mongo_db.stations.documents
+        for station in stations.values():
+            station["status"] = "outdated"
+        # The measures are already ingested, the stations are still refreshed
+        run(provider_code)
+
+        assert all(station["status"] != "outdated" for station in stations.values())
+
+
+@pytest.mark.parametrize("provider_code", adaptive_polling_providers)
+def test_metadata_sync_refreshes_not_due_stations(provider_code, monkeypatch):
+    with provider_backends(provider_code, monkeypatch) as backends:
+        run(provider_code)
+        stations = backends.mongo_db.stations.documents
+        # The stations are not due before their next hourly report
+        now = time.time()
+        cadence = {"intervals": [3600], "delays": [0], "last_measure": now, "checked_at": now, "found_at": now}
+        backends.redis.data[f"cadences/{provider_code}"] = {station_id: json.dumps(cadence) for station_id in stations}
+        last_seen_at = datetime(2026, 1, 1, tzinfo=UTC)
+        for station in stations.values():
+            station["lastSeenAt"] = last_seen_at
+        run(provider_code)
+
+        assert all(station["lastSeenAt"] > last_seen_at for station in stations.values())
+
+
+def test_metadata_sync_interval():
+    with fake_backends(load_payloads(payloads_dir / "holfuy.json")):
+        # The first measure sync is promoted to a metadata sync, the next ones are measure syncs until the key expires
+        first = run_provider("providers.holfuy:holfuy", False, metadata_sync_interval=3600)
+        second = run_provider("providers.holfuy:holfuy", False, metadata_sync_interval=3600)
+
+        assert first["sync_metadata"] is True
+        assert second["sync_metadata"] is False
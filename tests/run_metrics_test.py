@@ -0,0 +1,100 @@
+import threading
+import time
+from unittest import mock
+
+from winds_mobi_provider import Provider
+from winds_mobi_provider.run_metrics import RunMetrics, run_metrics_context, timer
+
+
+class MetricsProvider(Provider):
+    provider_code = "test"
+    provider_name = "test.com"
+    provider_url = "https://test.com"
+
+    def process_data(self):
+        self.http_get("https://test.com/stations.json")
+        station = {"_id": "test-1", "tz": "Europe/Zurich", "short": "Test", "name": "Test"}
+        for provider_id in (1, 2):
+            if self.is_new_measure(provider_id, 1000):
+                self.insert_measures(station, [{"_id": 1000}, {"_id": 1100}])
+        self.log.warning("Error while processing station 'test-3'")
+        self.metrics.count("stations_failed")
+
+
+def test_phases():
+    run_metrics = RunMetrics("test")
+    with run_metrics_context(run_metrics):
+        with timer("http"):
+            time.sleep(0.01)
+        with timer("enrichment"):
+            # Attributed to the outermost phase
+            with timer("redis"):
+                time.sleep(0.01)
+            with timer("mongo"):
+                pass
+    with timer("redis"):
+        # Outside the run
+        time.sleep(0.01)
+    run_metrics.stop()
+
+    timings = run_metrics.to_dict()["timings"]
+    assert timings["http"] >= 0.01
+    assert timings["enrichment"] >= 0.01
+    assert timings["mongo"] == 0
+    assert timings["redis"] == 0
+    assert timings["parsing"] >= 0
+
+
+def test_concurrent_phases():
+    run_metrics = RunMetrics("test")
+
+    def fetch():
+        with run_metrics_context(run_metrics), timer("http"):
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    run_metrics.stop()
+
+    # The concurrent requests count once
+    assert 0.1 <= run_metrics.timings["http"] <= run_metrics.duration
+
+
+def test_ingestion_lag():
+    run_metrics = RunMetrics("test")
+    assert run_metrics.get_lag_quantiles() == {"p50": 0, "p95": 0, "max": 0}
+
+    run_metrics.observe_lags("test-1", [float(lag) for lag in range(1, 91)])
+    run_metrics.observe_lags("test-2", [600.0] * 10)
+    run_metrics.observe_lags("test-3", [30.0])
+    assert run_metrics.get_lag_quantiles() == {"p50": 50, "p95": 600, "max": 600}
+    assert run_metrics.get_worst_lag_stations() == [("test-2", 600), ("test-1", 90), ("test-3", 30)]
+
+
+@mock.patch("winds_mobi_provider.provider.requests")
+@mock.patch("winds_mobi_provider.provider.redis")
+@mock.patch("winds_mobi_provider.provider.MongoClient")
+def test_run_metrics(mongodb, redis, requests, tmp_path):
+    requests.Session.return_value.get.return_value.content = b"[]"
+    mongo_db = mongodb.return_value.get_database.return_value
+    mongo_db.__getitem__.return_value.insert_many.return_value.inserted_ids = [1100]
+    redis.StrictRedis.from_url.return_value.hgetall.return_value = {"test-2": "1000"}
+
+    provider = MetricsProvider()
+    with mock.patch("winds_mobi_provider.run_metrics.METRICS_TEXTFILE_DIR", tmp_path):
+        provider.run()
+
+    counts = provider.metrics.to_dict()["counts"]
+    assert counts == {
+        "stations_seen": 2,
+        "stations_skipped": 1,
+        "stations_failed": 1,
+        "measures_inserted": 1,
+        "measures_duplicate": 1,
+        "payload_bytes": 2,
+    }
+    textfile = (tmp_path / "provider_test_metadata.prom").read_text()
+    assert 'winds_mobi_provider_run_count{provider="test",sync="metadata",shard="0",name="payload_bytes"} 2' in textfile
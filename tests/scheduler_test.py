@@ -0,0 +1,70 @@
+import threading
+import time
+from datetime import UTC, datetime
+from types import SimpleNamespace
+from unittest import mock
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+from run_scheduler import create_listeners_executor, get_phase_offsets, track_runs
+
+provider_intervals = {"holfuy": (5, 2, 30), "metar": (10, 5, 30)}
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, callback, mask):
+        self.listeners.append((callback, mask))
+
+
+def test_phase_offsets_without_mongo():
+    mongo_db = mock.MagicMock()
+    mongo_db.providers.find.side_effect = ServerSelectionTimeoutError("No servers found")
+
+    assert get_phase_offsets(mongo_db, provider_intervals) == {"holfuy": 0, "metar": 0}
+
+
+def test_track_runs_in_background():
+    mongo_db = mock.MagicMock()
+    mongo_db.providers.find_one.return_value = {"avgRunDuration": 10, "avgInsertedMeasures": 100}
+    threads = []
+    mongo_db.providers.update_one.side_effect = lambda *args, **kwargs: threads.append(threading.current_thread().name)
+    scheduler = FakeScheduler()
+    listeners_executor = create_listeners_executor()
+    track_runs(scheduler, mongo_db, listeners_executor, provider_intervals)
+    on_job_executed = scheduler.listeners[0][0]
+
+    event = SimpleNamespace(
+        job_id="holfuy",
+        retval={"started_at": time.time(), "duration": 20, "inserted_measures": 0},
+        scheduled_run_time=datetime.now(UTC),
+    )
+    on_job_executed(event)
+    listeners_executor.shutdown(wait=True)
+
+    # The statistics are saved by the listeners thread, not by the scheduler thread
+    assert threads[0].startswith("scheduler-listeners")
+    mongo_db.providers.update_one.assert_called_once_with(
+        {"_id": "holfuy"}, {"$set": {"avgRunDuration": 12, "avgInsertedMeasures": 80}}, upsert=True
+    )
+
+
+def test_track_runs_without_mongo():
+    mongo_db = mock.MagicMock()
+    mongo_db.providers.find_one.side_effect = ServerSelectionTimeoutError("No servers found")
+    scheduler = FakeScheduler()
+    listeners_executor = create_listeners_executor()
+    track_runs(scheduler, mongo_db, listeners_executor, provider_intervals)
+    on_job_executed = scheduler.listeners[0][0]
+
+    event = SimpleNamespace(
+        job_id="holfuy",
+        retval={"started_at": time.time(), "duration": 20, "inserted_measures": 0},
+        scheduled_run_time=datetime.now(UTC),
+    )
+    on_job_executed(event)
+    listeners_executor.shutdown(wait=True)
+
+    mongo_db.providers.update_one.assert_not_called()
@@ -0,0 +1,88 @@
+import os
+import subprocess
+
+import requests
+
+from winds_mobi_provider.soak import SoakStats, create_report, get_recorded_providers, start_google_api
+
+scheduler_logs = [
+    "2026-01-01 12:00:00+0000 INFO [scheduler] | 'holfuy' queued 0.5s, ran 2.0s, inserted 10 measures",
+    "2026-01-01 12:00:30+0000 INFO [scheduler] | 'holfuy' queued 1.5s, ran 4.0s, inserted 0 measures",
+    "2026-01-01 12:00:40+0000 WARNING [scheduler] | 'holfuy' run max_instances",
+    "2026-01-01 12:00:50+0000 WARNING [scheduler] | 'metar' run missed",
+    '2026-01-01 12:01:00+0000 ERROR [apscheduler.executors.default] | Job "metar (trigger: interval[0:01:00], '
+    'next run at: 2026-01-01 12:02:00 UTC)" raised an exception',
+    "2026-01-01 12:01:10+0000 INFO [holfuy] | Done !",
+]
+
+
+def test_parse_scheduler_logs():
+    stats = SoakStats()
+    for line in scheduler_logs:
+        stats.parse_line(line)
+
+    assert stats.runs == {"holfuy": [(0.5, 2.0, 10), (1.5, 4.0, 0)]}
+    assert stats.skipped_runs == {("holfuy", "max_instances"): 1, ("metar", "missed"): 1}
+    assert stats.failed_runs == {"metar": 1}
+
+
+def test_create_report():
+    stats = SoakStats()
+    for line in scheduler_logs:
+        stats.parse_line(line)
+    stats.processes[10] = {
+        "role": "worker",
+        "first_seen": 0,
+        "last_seen": 360,
+        "first_rss_mb": 100,
+        "last_rss_mb": 110,
+        "max_rss_mb": 120,
+    }
+
+    # 1 simulated hour
+    report = create_report(stats, {"holfuy": 5, "metar": 10}, 10, 360, {"mongo": 600, "redis": 3600})
+
+    assert report["jobs"]["holfuy"]["expected_runs"] == 12
+    assert report["jobs"]["holfuy"]["runs"] == 2
+    assert report["jobs"]["holfuy"]["max_instances_runs"] == 1
+    assert report["jobs"]["holfuy"]["queueing"] == {"p50": 5, "p95": 15, "max": 15}
+    assert report["jobs"]["holfuy"]["duration"] == {"p50": 2, "p95": 4, "max": 4}
+    assert report["jobs"]["holfuy"]["inserted_measures"] == 10
+    assert report["jobs"]["metar"]["failed_runs"] == 1
+    assert report["processes"][10]["growth_mb_per_simulated_hour"] == 10
+    assert report["writes"]["mongo"] == {"total": 600, "per_second": 600 / 360, "per_simulated_minute": 10}
+
+
+def test_recorded_providers(tmp_path):
+    (tmp_path / "holfuy").mkdir()
+    (tmp_path / "holfuy" / "000001-http-0123456789.json.gz").write_bytes(b"")
+    (tmp_path / "metar").mkdir()
+
+    assert get_recorded_providers(tmp_path) == {"holfuy"}
+    assert get_recorded_providers(tmp_path / "missing") == set()
+
+
+def test_google_api():
+    server = start_google_api()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/maps/api/geocode/json?latlng=46.5,6.5"
+        result = requests.get(url, timeout=5).json()
+    finally:
+        server.shutdown()
+
+    assert result["status"] == "OK"
+    assert result["results"][0]["address_components"][0]["short_name"] == "Place 46.50,6.50"
+
+
+def test_sample_processes():
+    stats = SoakStats()
+    worker = subprocess.Popen(["sleep", "10"])
+    try:
+        stats.sample_processes(os.getpid())
+    finally:
+        worker.kill()
+        worker.wait()
+
+    assert stats.processes[os.getpid()]["role"] == "scheduler"
+    assert stats.processes[worker.pid]["role"] == "worker"
+    assert stats.processes[worker.pid]["first_rss_mb"] > 0
@@ -0,0 +1,25 @@
+from providers.synthetic import Synthetic, create_station
+from winds_mobi_provider.fakes import fake_backends
+
+
+def test_create_station():
+    assert create_station(1, 42) == create_station(1, 42)
+    assert create_station(1, 42) != create_station(2, 42)
+
+
+def test_synthetic():
+    with fake_backends({}) as backends:
+        provider = Synthetic(stations=200, measures=3, seed=1)
+        provider.run()
+
+        counts = provider.metrics.to_dict()["counts"]
+        assert counts["stations_seen"] == 200
+        assert counts["stations_failed"] == 0
+        assert counts["measures_inserted"] == 600
+        assert len(backends.mongo_db.stations.documents) == 200
+        # The elevations are cached by the provider
+        assert backends.round_trips.total("google") == 0
+
+        provider = Synthetic(stations=200, measures=3, seed=1)
+        provider.run()
+        assert provider.metrics.to_dict()["counts"]["measures_inserted"] < 50
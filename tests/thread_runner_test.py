@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sentry_sdk
+
+from winds_mobi_provider import provider
+from winds_mobi_provider.thread_runner import run_provider_in_thread
+
+runs = []
+
+
+def slow_provider():
+    sentry_sdk.set_tag("provider", "slow")
+    time.sleep(0.3)
+    runs.append((provider._sync_metadata.get(), sentry_sdk.get_isolation_scope()._tags.get("provider")))
+
+
+def fast_provider():
+    sentry_sdk.set_tag("provider", "fast")
+    time.sleep(0.1)
+
+
+def test_run_providers_concurrently():
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(3) as executor:
+        futures = [
+            executor.submit(run_provider_in_thread, "tests.thread_runner_test:slow_provider", True),
+            executor.submit(run_provider_in_thread, "tests.thread_runner_test:slow_provider", False),
+            executor.submit(run_provider_in_thread, "tests.thread_runner_test:fast_provider", True),
+        ]
+        results = [future.result() for future in futures]
+
+    assert time.monotonic() - started_at < 0.6
+    assert [result["inserted_measures"] for result in results] == [0, 0, 0]
+    # The tags set by a run don't leak to the others
+    assert sorted(runs) == [(False, "slow"), (True, "slow")]
+
+
+def test_isolated_sentry_scope():
+    # The pool threads are reused by the next runs
+    with sentry_sdk.isolation_scope():
+        sentry_sdk.set_tag("provider", "scheduler")
+        run_provider_in_thread("tests.thread_runner_test:fast_provider")
+
+        assert sentry_sdk.get_isolation_scope()._tags["provider"] == "scheduler"
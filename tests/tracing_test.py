@@ -0,0 +1,44 @@
+import json
+import logging
+import time
+from unittest import mock
+
+from winds_mobi_provider.tracing import Tracer
+
+log = logging.getLogger("test")
+
+
+@mock.patch("winds_mobi_provider.tracing.TRACING", "jsonl")
+def test_tracing(tmp_path):
+    tracing_file = tmp_path / "traces.jsonl"
+    tracer = Tracer("test", log)
+    with tracer.span("http"):
+        # Outside the run
+        pass
+    with mock.patch("winds_mobi_provider.tracing.TRACING_FILE", tracing_file), tracer.trace_run("test-measure"):
+        with tracer.span("http"):
+            pass
+        with tracer.span("station", "test-1"):
+            with tracer.span("http"):
+                time.sleep(0.02)
+            with tracer.span("save_station", "test-1"):
+                pass
+        with tracer.span("save_station", "test-2"), tracer.span("google_api"):
+            time.sleep(0.01)
+        with tracer.span("insert_measures", "test-2"):
+            pass
+        slowest_stations = tracer.get_slowest_stations()
+
+    assert [station_id for station_id, _, _ in slowest_stations] == ["test-1", "test-2"]
+    station_id, duration, operations = slowest_stations[0]
+    assert duration >= 0.02
+    assert set(operations) == {"http", "save_station"}
+
+    spans = [json.loads(line) for line in tracing_file.read_text().splitlines()]
+    assert len(spans) == 7
+    assert {span["run"] for span in spans} != {None}
+    assert [(span["station"], span["operation"]) for span in spans if span["root"] and span["station"]] == [
+        ("test-1", "station"),
+        ("test-2", "save_station"),
+        ("test-2", "insert_measures"),
+    ]
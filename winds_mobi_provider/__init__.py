@@ -1,13 +1,21 @@
-from .provider import Provider, ProviderException, StationNames, StationStatus, UsageLimitException
-from .units import Q_, Pressure, ureg
-
-__all__ = [
-    "Provider",
-    "ProviderException",
-    "StationNames",
-    "StationStatus",
-    "UsageLimitException",
-    "Q_",
-    "Pressure",
-    "ureg",
-]
+import importlib
+
+# Exported names and their module, imported on first access to keep the package import cheap for the scheduler
+_exports = {
+    "Provider": "provider",
+    "ProviderException": "provider",
+    "StationNames": "provider",
+    "StationStatus": "provider",
+    "UsageLimitException": "provider",
+    "Q_": "units",
+    "Pressure": "units",
+    "ureg": "units",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(f".{_exports[name]}", __name__), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
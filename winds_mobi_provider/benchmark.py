@@ -0,0 +1,147 @@
+import argparse
+import json
+import logging
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+from pathlib import Path
+
+from winds_mobi_provider.cassettes import use_cassettes
+from winds_mobi_provider.fakes import fake_backends, load_payloads
+from winds_mobi_provider.logging import configure_logging
+from winds_mobi_provider.provider import run_provider
+from winds_mobi_provider.run_metrics import phases
+
+default_payloads_dir = Path(__file__).parents[1] / "tests" / "payloads"
+# Compared metrics: a higher value is better
+compared_metrics = {
+    "stations_per_second": True,
+    "measures_per_second": True,
+    "duration": False,
+    "peak_memory_mb": False,
+}
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(provider_code, payloads_path, runs=10, sync_metadata=True, cassettes_dir=None) -> dict:
+    # Run a provider against recorded payloads, or the responses of a cassette, with the in-process stand-ins. Each run
+    # inserts the same measures again, with the stations and the Google APIs results saved by the warm-up run.
+    func_ref = f"providers.{provider_code}:{provider_code}"
+    payloads = load_payloads(payloads_path) if not cassettes_dir else {}
+    results = []
+    cassettes = use_cassettes("replay", cassettes_dir) if cassettes_dir else nullcontext()
+    with cassettes, fake_backends(payloads) as backends:
+        # Warm-up: imports, units registry, timezone finder and new stations
+        run_provider(func_ref)
+        for _ in range(runs):
+            backends.forget_measures(provider_code)
+            backends.round_trips.reset()
+            result = run_provider(func_ref, sync_metadata)
+            results.append((result["metrics"], backends.round_trips.by_backend()))
+
+        # Python allocations of an extra run, tracemalloc would slow down the measured runs
+        backends.forget_measures(provider_code)
+        tracemalloc.start()
+        try:
+            run_provider(func_ref, sync_metadata)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    durations = [metrics["duration"] for metrics, _ in results]
+    return {
+        "provider": provider_code,
+        "payloads": str(Path(cassettes_dir, provider_code) if cassettes_dir else payloads_path),
+        "sync": "metadata" if sync_metadata else "measure",
+        "runs": runs,
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "created_at": time.time(),
+        "stations": results[-1][0]["counts"]["stations_seen"],
+        "measures": results[-1][0]["counts"]["measures_inserted"],
+        "duration": statistics.median(durations),
+        "duration_min": min(durations),
+        "duration_max": max(durations),
+        "stations_per_second": statistics.median(
+            metrics["counts"]["stations_seen"] / metrics["duration"] for metrics, _ in results
+        ),
+        "measures_per_second": statistics.median(
+            metrics["counts"]["measures_inserted"] / metrics["duration"] for metrics, _ in results
+        ),
+        "phases": {phase: statistics.median(metrics["timings"][phase] for metrics, _ in results) for phase in phases},
+        "round_trips": results[-1][1],
+        "peak_memory_mb": peak_memory / 1024**2,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare_results(result: dict, baseline: dict) -> list[str]:
+    lines = [f"Compared to '{baseline.get('revision')}':"]
+    for name, higher_is_better in compared_metrics.items():
+        if not baseline.get(name):
+            continue
+        change = (result[name] - baseline[name]) / baseline[name]
+        better = change > 0 if higher_is_better else change < 0
+        lines.append(
+            f"  {name}: {baseline[name]:.4g} -> {result[name]:.4g} ({change:+.1%}, {'better' if better else 'worse'})"
+        )
+    return lines
+
+
+def print_result(result: dict):
+    print(
+        f"{result['provider']} {result['sync']} sync, {result['runs']} runs: {result['stations']} stations, "
+        f"{result['measures']} measures"
+    )
+    print(
+        f"  duration: {result['duration'] * 1000:.1f}ms (min {result['duration_min'] * 1000:.1f}ms, "
+        f"max {result['duration_max'] * 1000:.1f}ms)"
+    )
+    print(
+        f"  throughput: {result['stations_per_second']:.1f} stations/s, {result['measures_per_second']:.1f} measures/s"
+    )
+    print("  phases: " + ", ".join(f"{phase}={duration * 1000:.1f}ms" for phase, duration in result["phases"].items()))
+    print("  round trips: " + ", ".join(f"{backend}={nb}" for backend, nb in result["round_trips"].items()))
+    print(f"  memory: peak {result['peak_memory_mb']:.2f}MB traced, {result['max_rss_mb']:.0f}MB max RSS")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark a provider against recorded payloads, without network")
+    parser.add_argument("provider", help="Provider module of 'providers', e.g. 'pioupiou'")
+    parser.add_argument("--payloads", type=Path, help="Recorded payloads, default: 'tests/payloads/{provider}.json'")
+    parser.add_argument("--cassettes", type=Path, help="Replay the cassette of the provider recorded in this directory")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--sync", choices=["metadata", "measure"], default="metadata")
+    parser.add_argument("--output", type=Path, help="Write the results to a json file")
+    parser.add_argument("--compare", type=Path, help="Compare the results to a previous json file")
+    args = parser.parse_args(args)
+
+    configure_logging()
+    # The providers log each station
+    logging.getLogger().setLevel(logging.WARNING)
+    payloads_path = args.payloads or default_payloads_dir / f"{args.provider}.json"
+    result = run_benchmark(args.provider, payloads_path, args.runs, args.sync == "metadata", args.cassettes)
+    print_result(result)
+    if args.compare:
+        for line in compare_results(result, json.loads(args.compare.read_text())):
+            print(line)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Results written to '{args.output}'")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import statistics
+from collections import deque
+
+
+class Cadence:
+    # Learn the refresh cadence of an upstream from the timestamps of its newest measure, all values in seconds
+
+    def __init__(self, max_samples=10):
+        self.intervals = deque(maxlen=max_samples)
+        # Delay between the measure time and the time we found it
+        self.delays = deque(maxlen=max_samples)
+        self.last_measure = None
+        self.stale_runs = 0
+        # Wall clock times of the last check and of the last time new data was found
+        self.checked_at = None
+        self.found_at = None
+
+    @classmethod
+    def from_dict(cls, values: dict, max_samples=10) -> "Cadence":
+        cadence = cls(max_samples)
+        cadence.intervals.extend(values.get("intervals", []))
+        cadence.delays.extend(values.get("delays", []))
+        cadence.last_measure = values.get("last_measure")
+        cadence.stale_runs = values.get("stale_runs", 0)
+        cadence.checked_at = values.get("checked_at")
+        cadence.found_at = values.get("found_at")
+        return cadence
+
+    def to_dict(self) -> dict:
+        return {
+            "intervals": list(self.intervals),
+            "delays": list(self.delays),
+            "last_measure": self.last_measure,
+            "stale_runs": self.stale_runs,
+            "checked_at": self.checked_at,
+            "found_at": self.found_at,
+        }
+
+    @property
+    def interval(self) -> float | None:
+        return statistics.median(self.intervals) if self.intervals else None
+
+    @property
+    def delay(self) -> float:
+        # The smallest delay is the closest to the upstream publication delay
+        return min(self.delays) if self.delays else 0
+
+    def observe(self, last_measure: float | None, now: float) -> bool:
+        self.checked_at = now
+        if last_measure is None or (self.last_measure is not None and last_measure <= self.last_measure):
+            self.stale_runs += 1
+            return False
+        if self.last_measure is not None:
+            self.intervals.append(last_measure - self.last_measure)
+        self.delays.append(max(now - last_measure, 0))
+        self.last_measure = last_measure
+        self.stale_runs = 0
+        self.found_at = now
+        return True
+
+    def next_run_delay(self, now: float, default: float, minimum: float, maximum: float) -> float:
+        interval = self.interval
+        if interval is None:
+            next_delay = default
+        else:
+            expected_refresh = self.last_measure + interval + self.delay
+            if expected_refresh > now:
+                # Poll right after the expected upstream refresh
+                next_delay = expected_refresh - now
+            else:
+                # The upstream is late: back off while the data is stale
+                next_delay = default * 2 ** max(self.stale_runs - 1, 0)
+        return min(max(next_delay, minimum), maximum)
+
+    def is_due(self, now: float, silent_duration: float, slow_interval: float) -> bool:
+        if self.interval is None:
+            # Not enough data yet to learn the cadence
+            return True
+        if self.found_at is None or now - self.found_at > silent_duration:
+            # Silent for a long time: fall back to slow polling
+            return self.checked_at is None or now - self.checked_at >= slow_interval
+        return now >= self.last_measure + self.interval + self.delay
@@ -0,0 +1,299 @@
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+import requests
+from furl import furl
+from pydantic import TypeAdapter
+
+import settings
+from settings import CASSETTE_DIR, CASSETTE_MODE, CASSETTE_REPLAY_TIMINGS, GOOGLE_API_URL
+
+# Record the upstream responses of the runs of a provider, HTTP responses and SQL rows, into a directory of compressed
+# interactions by run, and replay the interactions of all the recorded runs without network. The Google APIs requests
+# are not recorded: their url contains the API key and their results are cached in Redis.
+modes = ["record", "replay"]
+# Settings of the upstream secrets, e.g. the API keys in the urls: redacted from the recorded interactions
+secret_settings = [
+    "BORN_TO_FLY_DEVICE_ID",
+    "BORN_TO_FLY_VENDOR_ID",
+    "FFVL_API_KEY",
+    "GOOGLE_API_KEY",
+    "IWEATHAR_KEY",
+    "KACHELMANN_API_KEY",
+    "ROMMA_KEY",
+    "WINDY_API_KEY",
+    "WU_API_KEY",
+]
+# Response headers that don't match the decoded body
+skipped_headers = {"content-encoding", "content-length", "transfer-encoding"}
+
+# Mode, directory and replay timings of the runs of the current context, overriding CASSETTE_MODE
+_cassettes_config = ContextVar("cassettes_config", default=None)
+
+
+class CassetteException(Exception):
+    pass
+
+
+@contextmanager
+def use_cassettes(mode, directory, replay_timings=False):
+    if mode not in modes:
+        raise CassetteException(f"Invalid cassette mode '{mode}'")
+    token = _cassettes_config.set((mode, directory, replay_timings))
+    try:
+        yield
+    finally:
+        _cassettes_config.reset(token)
+
+
+def get_cassette(provider_code) -> "Cassette | None":
+    if config := _cassettes_config.get():
+        mode, directory, replay_timings = config
+    elif CASSETTE_MODE:
+        mode, directory = CASSETTE_MODE, CASSETTE_DIR
+        replay_timings = TypeAdapter(bool).validate_python(CASSETTE_REPLAY_TIMINGS)
+    else:
+        return None
+    return Cassette(Path(directory, provider_code), mode, replay_timings)
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    elif isinstance(value, date):
+        return {"$date": value.isoformat()}
+    elif isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    elif isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode()}
+    elif isinstance(value, list | tuple):
+        return [encode_value(item) for item in value]
+    elif isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+        elif "$date" in value:
+            return date.fromisoformat(value["$date"])
+        elif "$decimal" in value:
+            return Decimal(value["$decimal"])
+        elif "$bytes" in value:
+            return base64.b64decode(value["$bytes"])
+        return {key: decode_value(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def redact_secrets(value: str) -> str:
+    for name in secret_settings:
+        if secret := getattr(settings, name, None):
+            value = value.replace(secret, f"<{name}>")
+    return value
+
+
+def get_http_key(method, url, kwargs: dict) -> str:
+    # Recorded and replayed with the secrets redacted
+    body = {name: kwargs[name] for name in ("params", "data", "json") if kwargs.get(name) is not None}
+    return redact_secrets(f"{method.upper()} {url} {json.dumps(encode_value(body), sort_keys=True, default=str)}")
+
+
+def get_sql_key(query) -> str:
+    # The params can depend on the time of the run, e.g. the start date of the measures: the rows are replayed by query
+    return f"SQL {query}"
+
+
+def get_sql_params(params) -> str:
+    return json.dumps(encode_value(params), default=str)
+
+
+def create_response(url, content: bytes, status_code=200, headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+    return response
+
+
+class Cassette:
+    def __init__(self, path: Path, mode, replay_timings=False):
+        if mode not in modes:
+            raise CassetteException(f"Invalid cassette mode '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.replay_timings = replay_timings
+        self.__lock = threading.Lock()
+        self.__sequence = 0
+        # Recorded interactions by key, in their recording order
+        self.__interactions = {}
+        if mode == "record":
+            # A directory for each run: the runs recording concurrently, e.g. the shards or the station queue workers,
+            # don't overwrite each other
+            self.path = Path(path, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:8]}")
+            self.path.mkdir(parents=True)
+        else:
+            if not self.path.is_dir():
+                raise CassetteException(f"No cassette in '{self.path}'")
+            # The runs in their recording order
+            for interaction_path in sorted(self.path.rglob("*.json.gz")):
+                interaction = json.loads(gzip.decompress(interaction_path.read_bytes()))
+                self.__interactions.setdefault(interaction["key"], []).append(interaction)
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def is_recorded(self, url) -> bool:
+        return furl(url).host != furl(GOOGLE_API_URL).host
+
+    def __write(self, interaction: dict):
+        with self.__lock:
+            self.__sequence += 1
+            sequence = self.__sequence
+        digest = hashlib.sha1(interaction["key"].encode()).hexdigest()[:10]
+        Path(self.path, f"{sequence:06d}-{interaction['kind']}-{digest}.json.gz").write_bytes(
+            gzip.compress(json.dumps(interaction).encode())
+        )
+
+    def __read(self, key, params=None) -> dict:
+        with self.__lock:
+            interactions = self.__interactions.get(key)
+            if not interactions:
+                raise CassetteException(f"No recorded interaction for '{key}' in '{self.path}'")
+            # Replayed in the recording order, the ones with the same params first, the last one is repeated
+            index = next(
+                (index for index, interaction in enumerate(interactions) if interaction.get("params") == params), 0
+            )
+            interaction = interactions.pop(index) if len(interactions) > 1 else interactions[0]
+        if self.replay_timings:
+            time.sleep(interaction["duration"])
+        return interaction
+
+    def record_response(self, method, url, kwargs: dict, response: requests.Response, duration):
+        self.__write(
+            {
+                "kind": "http",
+                "key": get_http_key(method, url, kwargs),
+                "method": method.upper(),
+                "url": redact_secrets(url),
+                "status_code": response.status_code,
+                "headers": {
+                    name: value for name, value in response.headers.items() if name.lower() not in skipped_headers
+                },
+                "body": base64.b64encode(response.content).decode(),
+                "duration": duration,
+                "recorded_at": time.time(),
+            }
+        )
+
+    def replay_response(self, method, url, kwargs: dict) -> requests.Response:
+        interaction = self.__read(get_http_key(method, url, kwargs))
+        return create_response(
+            interaction["url"],
+            base64.b64decode(interaction["body"]),
+            interaction["status_code"],
+            interaction["headers"],
+        )
+
+    def record_rows(self, query, params, columns, rows, duration):
+        self.__write(
+            {
+                "kind": "sql",
+                "key": get_sql_key(query),
+                "params": get_sql_params(params),
+                "columns": columns,
+                "rows": encode_value([list(row) for row in rows]),
+                "duration": duration,
+                "recorded_at": time.time(),
+            }
+        )
+
+    def replay_rows(self, query, params) -> tuple[list, list]:
+        interaction = self.__read(get_sql_key(query), get_sql_params(params))
+        return interaction["columns"], decode_value(interaction["rows"])
+
+    def connect_database(self, connect, *args, **kwargs):
+        if self.replaying:
+            return CassetteConnection(self, None)
+        return CassetteConnection(self, connect(*args, **kwargs))
+
+
+class CassetteRow(list):
+    # Row accessed by index, like a MySQLdb row, or by column name, like a psycopg2 DictRow
+
+    def __init__(self, values, columns):
+        super().__init__(values)
+        self.columns = columns
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(self.columns.index(key))
+        return super().__getitem__(key)
+
+
+class CassetteCursor:
+    # Rows of a query are fetched at once: recorded from the database cursor or replayed from the cassette
+
+    def __init__(self, cassette: Cassette, cursor):
+        self.cassette = cassette
+        self.cursor = cursor
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if self.cassette.replaying:
+            columns, rows = self.cassette.replay_rows(query, params)
+        else:
+            started_at = time.perf_counter()
+            self.cursor.execute(query, *([params] if params is not None else []))
+            rows = list(self.cursor.fetchall()) if self.cursor.description else []
+            columns = [column[0] for column in self.cursor.description or []]
+            self.cassette.record_rows(query, params, columns, rows, time.perf_counter() - started_at)
+        self.rows = [CassetteRow(row, columns) for row in rows]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        yield from rows
+
+    def close(self):
+        if self.cursor:
+            self.cursor.close()
+
+
+class CassetteConnection:
+    def __init__(self, cassette: Cassette, connection):
+        self.cassette = cassette
+        self.connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return CassetteCursor(self.cassette, self.connection.cursor(*args, **kwargs) if self.connection else None)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
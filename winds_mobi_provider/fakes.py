@@ -0,0 +1,394 @@
+import gzip
+import json
+import math
+from collections import Counter
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from furl import furl
+from pymongo.errors import BulkWriteError
+
+from settings import GOOGLE_API_URL
+from winds_mobi_provider.cassettes import create_response
+from winds_mobi_provider.provider import get_warm_resource, release_warm_resources
+
+# In-process stand-ins of Mongo, Redis, the upstream APIs and the Google APIs, counting their round trips. Used by the
+# round trips budget tests and the offline benchmarks.
+
+
+class RoundTrips:
+    def __init__(self):
+        self.counts = Counter()
+
+    def count(self, backend, operation):
+        self.counts[backend, operation] += 1
+
+    def total(self, backend) -> int:
+        return sum(nb for (counted_backend, _), nb in self.counts.items() if counted_backend == backend)
+
+    def by_backend(self) -> dict[str, int]:
+        return {backend: self.total(backend) for backend in sorted({backend for backend, _ in self.counts})}
+
+    def reset(self):
+        self.counts.clear()
+
+
+def get_value(document: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(document, dict) or key not in document:
+            return None
+        document = document[key]
+    return document
+
+
+def matches(document: dict, query) -> bool:
+    if not isinstance(query, dict):
+        query = {"_id": query}
+    return all(get_value(document, key) == value for key, value in query.items())
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    if not projection:
+        return dict(document)
+    projected = {"_id": document["_id"]}
+    for path in projection:
+        if (value := get_value(document, path)) is not None:
+            target = projected
+            *parents, key = path.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[key] = value
+    return projected
+
+
+class FakeCollection:
+    def __init__(self, name, round_trips: RoundTrips):
+        self.name = name
+        self.round_trips = round_trips
+        self.documents = {}
+
+    def create_index(self, *args, **kwargs):
+        self.round_trips.count("mongo", "create_index")
+
+    def filter(self, query) -> list[dict]:
+        if not isinstance(query, dict):
+            query = {"_id": query}
+        if "_id" in query and not isinstance(query["_id"], dict):
+            # Lookup by id, the scale tests save many stations
+            document = self.documents.get(query["_id"])
+            return [document] if document is not None and matches(document, query) else []
+        return [document for document in self.documents.values() if matches(document, query)]
+
+    def find(self, query=None, projection=None):
+        self.round_trips.count("mongo", "find")
+        return [project(document, projection) for document in self.filter(query or {})]
+
+    def find_one(self, query=None, projection=None):
+        self.round_trips.count("mongo", "find_one")
+        query = query if query is not None else {}
+        if isinstance(query, dict) and "$query" in query:
+            # Legacy query modifiers, e.g. the last measure of a station
+            documents = self.filter(query["$query"])
+            for key, direction in query.get("$orderby", {}).items():
+                documents.sort(key=lambda document: get_value(document, key), reverse=direction < 0)
+        else:
+            documents = self.filter(query)
+        return project(documents[0], projection) if documents else None
+
+    def count_documents(self, query):
+        self.round_trips.count("mongo", "count_documents")
+        return len(self.filter(query))
+
+    def insert_many(self, documents, ordered=True):
+        self.round_trips.count("mongo", "insert_many")
+        inserted_ids = []
+        write_errors = []
+        for index, document in enumerate(documents):
+            if document["_id"] in self.documents:
+                write_errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key error"})
+                if ordered:
+                    break
+                continue
+            self.documents[document["_id"]] = dict(document)
+            inserted_ids.append(document["_id"])
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "nInserted": len(inserted_ids)})
+        return SimpleNamespace(inserted_ids=inserted_ids)
+
+    def update_one(self, query, update, upsert=False):
+        self.round_trips.count("mongo", "update_one")
+        document = next(iter(self.filter(query)), None)
+        if document is None:
+            if not upsert:
+                return SimpleNamespace(matched_count=0)
+            document = {key: value for key, value in query.items() if not key.startswith("$")}
+            document.update(update.get("$setOnInsert", {}))
+            self.documents[document["_id"]] = document
+        document.update(update.get("$set", {}))
+        for key, value in update.get("$max", {}).items():
+            if document.get(key) is None or value > document[key]:
+                document[key] = value
+        return SimpleNamespace(matched_count=1)
+
+
+class FakeDatabase:
+    def __init__(self, round_trips: RoundTrips):
+        self.round_trips = round_trips
+        self.collections = {}
+
+    def __getitem__(self, name) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.round_trips)
+        return self.collections[name]
+
+    def __getattr__(self, name) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        self.round_trips.count("mongo", "list_collection_names")
+        return list(self.collections)
+
+    def create_collection(self, name):
+        self.round_trips.count("mongo", "create_collection")
+        return self[name]
+
+
+class FakeMongoClient:
+    def __init__(self, round_trips: RoundTrips):
+        self.database = FakeDatabase(round_trips)
+
+    def get_database(self):
+        return self.database
+
+
+class FakeLock:
+    def __init__(self, redis_client, name):
+        self.redis_client = redis_client
+        self.name = name
+
+    def acquire(self, blocking_timeout=None):
+        self.redis_client.round_trips.count("redis", "lock")
+        if self.name in self.redis_client.data:
+            return False
+        self.redis_client.data[self.name] = "locked"
+        return True
+
+    def release(self):
+        self.redis_client.round_trips.count("redis", "unlock")
+        self.redis_client.data.pop(self.name, None)
+
+
+class FakeRedis:
+    # Commands of a client created with decode_responses=True
+
+    def __init__(self, round_trips: RoundTrips):
+        self.round_trips = round_trips
+        self.data = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not hasattr(self, f"_{name}"):
+            raise AttributeError(name)
+        command = getattr(self, f"_{name}")
+
+        def call(*args, **kwargs):
+            self.round_trips.count("redis", name)
+            return command(*args, **kwargs)
+
+        return call
+
+    def _dbsize(self):
+        return len(self.data)
+
+    def _info(self, section=None):
+        # Size of the keys and values, a rough estimate of the memory used by Redis
+        return {"used_memory": sum(len(key) + len(str(value)) for key, value in self.data.items())}
+
+    def _exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _set(self, key, value, nx=False, **kwargs):
+        # The keys don't expire
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def _delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def _expire(self, key, duration):
+        return key in self.data
+
+    def _hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def _hmget(self, key, fields, *args):
+        values = self.data.get(key, {})
+        fields = [fields, *args] if isinstance(fields, str) else fields
+        return [values.get(str(field)) for field in fields]
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        values = self.data.setdefault(key, {})
+        mapping = {**(mapping or {}), **({field: value} if field is not None else {})}
+        values.update({str(name): str(value) for name, value in mapping.items()})
+        return len(mapping)
+
+    def _hincrby(self, key, field, amount=1):
+        values = self.data.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+        return int(values[field])
+
+    def _rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(str(value) for value in values)
+        return len(self.data[key])
+
+    def _lpop(self, key, count=None):
+        values = self.data.get(key, [])
+        if count is None:
+            return values.pop(0) if values else None
+        popped, self.data[key] = values[:count], values[count:]
+        return popped or None
+
+    def lock(self, name, timeout=None):
+        return FakeLock(self, name)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis_client: FakeRedis):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        command = getattr(self.redis_client, f"_{name}")
+
+        def call(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return call
+
+    def execute(self):
+        # A single round trip for all the commands
+        self.redis_client.round_trips.count("redis", "pipeline")
+        results = [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeGoogleApi:
+    # Geocoding and elevation results of a fictitious place, the names depend on the location to create distinct
+    # stations
+
+    def get(self, url) -> dict:
+        path = furl(url)
+        if path.path.segments[-2] == "geocode":
+            lat, lon = path.args["latlng"].split(",")
+            name = f"Place {float(lat):.2f},{float(lon):.2f}"
+            return {
+                "status": "OK",
+                "results": [
+                    {
+                        "types": ["locality", "political"],
+                        "address_components": [{"types": ["locality"], "short_name": name, "long_name": name}],
+                    },
+                    {
+                        "types": ["country", "political"],
+                        "address_components": [{"types": ["country"], "short_name": "CH", "long_name": "Suisse"}],
+                    },
+                ],
+            }
+        elif path.path.segments[-2] == "elevation":
+            locations = path.args["locations"].split("|")
+            lat = float(locations[0].split(",")[0])
+            # A gentle slope
+            elevation = 1000 + 100 * math.sin(lat)
+            return {
+                "status": "OK",
+                "results": [{"elevation": elevation - 10 * index} for index in range(len(locations))],
+            }
+        return {"status": "INVALID_REQUEST"}
+
+
+class FakeSession:
+    # Serves recorded payloads by url, and the Google APIs
+
+    def __init__(self, payloads: dict[str, bytes], round_trips: RoundTrips):
+        self.payloads = payloads
+        self.round_trips = round_trips
+        self.google_api = FakeGoogleApi()
+        self.headers = {}
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        if furl(url).host == furl(GOOGLE_API_URL).host:
+            self.round_trips.count("google", furl(url).path.segments[-2])
+            return create_response(url, json.dumps(self.google_api.get(url)).encode())
+        self.round_trips.count("http", method)
+        if url not in self.payloads:
+            return create_response(url, b"", status_code=404)
+        return create_response(url, self.payloads[url])
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("post", url, **kwargs)
+
+    def close(self):
+        pass
+
+
+def encode_payload(payload) -> bytes:
+    if isinstance(payload, dict) and "$gzip" in payload:
+        return gzip.compress(encode_payload(payload["$gzip"]), mtime=0)
+    return (payload if isinstance(payload, str) else json.dumps(payload)).encode()
+
+
+def load_payloads(path) -> dict[str, bytes]:
+    # Recorded payloads by url: a string body, a json document, or a gzip file of one of them: {"$gzip": payload}
+    with open(path) as file:
+        payloads = json.load(file)
+    return {url: encode_payload(payload) for url, payload in payloads.items()}
+
+
+class FakeBackends:
+    def __init__(self, payloads: dict[str, bytes]):
+        self.round_trips = RoundTrips()
+        self.mongo_client = FakeMongoClient(self.round_trips)
+        self.mongo_db = self.mongo_client.get_database()
+        self.redis = FakeRedis(self.round_trips)
+        self.session = FakeSession(payloads, self.round_trips)
+
+    def forget_measures(self, provider_code):
+        # The next run inserts the same measures again, with the stations and the Google APIs results already saved
+        for name, collection in self.mongo_db.collections.items():
+            if name.startswith(f"{provider_code}-"):
+                collection.documents.clear()
+        self.redis.data.pop(f"watermarks/{provider_code}", None)
+        self.redis.data.pop(f"cadences/{provider_code}", None)
+
+
+@contextmanager
+def fake_backends(payloads: dict[str, bytes]):
+    # Replace the warm clients of the process, and the sessions created by the providers, by the stand-ins
+    backends = FakeBackends(payloads)
+    release_warm_resources()
+    get_warm_resource("mongo_client", lambda: backends.mongo_client)
+    get_warm_resource("redis_client", lambda: backends.redis)
+    get_warm_resource("http_session", lambda: backends.session)
+    try:
+        with mock.patch.object(requests, "Session", lambda: backends.session):
+            yield backends
+    finally:
+        release_warm_resources()
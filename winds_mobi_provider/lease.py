@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+import redis
+from apscheduler.util import ref_to_obj
+
+log = logging.getLogger("scheduler")
+
+# Claim the lease of a job run if nobody holds it and the previous run is far enough, returns the fencing token
+_claim_script = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+local last_run_time = tonumber(redis.call('hget', KEYS[2], 'run_time') or '0')
+if tonumber(ARGV[3]) <= last_run_time + tonumber(ARGV[4]) then
+    return 0
+end
+local token = redis.call('hincrby', KEYS[2], 'token', 1)
+redis.call('hset', KEYS[2], 'run_time', ARGV[3])
+redis.call('set', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+return token
+"""
+
+_renew_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_release_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Lease:
+    # A lease on the runs of a job shared by several scheduler nodes, expiring if its node stops renewing it.
+    # Every claim increments a fencing token: a run must stop writing when the token is not the current one anymore.
+
+    def __init__(self, redis_client: redis.StrictRedis, name: str, node_id: str, ttl: float):
+        self.redis = redis_client
+        self.name = name
+        self.node_id = node_id
+        self.ttl = ttl
+        self.token = None
+
+    @property
+    def lease_key(self):
+        return f"lease/{self.name}"
+
+    @property
+    def fencing_key(self):
+        return f"fencing/{self.name}"
+
+    @property
+    def value(self):
+        return f"{self.node_id}:{self.token}"
+
+    def claim(self, run_time: float, min_gap: float) -> bool:
+        token = self.redis.register_script(_claim_script)(
+            keys=[self.lease_key, self.fencing_key], args=[self.node_id, int(self.ttl * 1000), run_time, min_gap]
+        )
+        self.token = int(token) or None
+        return self.token is not None
+
+    def renew(self) -> bool:
+        return bool(
+            self.redis.register_script(_renew_script)(keys=[self.lease_key], args=[self.value, int(self.ttl * 1000)])
+        )
+
+    def release(self):
+        self.redis.register_script(_release_script)(keys=[self.lease_key], args=[self.value])
+        self.token = None
+
+
+def is_fencing_token_valid(redis_client: redis.StrictRedis, name: str, token: int) -> bool:
+    return int(redis_client.hget(f"fencing/{name}", "token") or 0) == token
+
+
+def run_leased_job(
+    job_id: str,
+    func_ref: str,
+    args,
+    kwargs,
+    redis_url: str,
+    node_id: str,
+    ttl: float,
+    backoff: float,
+    run_time,
+    min_gap,
+):
+    # Run in a pool worker: claim the lease of the job run after a backoff giving the nodes with more free workers a
+    # head start, renew it and pass the fencing token to the provider runs until the end of the run
+    time.sleep(backoff)
+    lease = Lease(redis.StrictRedis.from_url(url=redis_url, decode_responses=True), job_id, node_id, ttl)
+    if not lease.claim(run_time, min_gap):
+        log.info(f"'{job_id}' claimed by another node")
+        return None
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(ttl / 3):
+            try:
+                if not lease.renew():
+                    log.warning(f"Lease of '{job_id}' lost by node '{node_id}'")
+                    return
+            except Exception as e:
+                log.exception(f"Unable to renew lease of '{job_id}': {e}")
+
+    threading.Thread(target=renew, daemon=True).start()
+    try:
+        if func_ref == "winds_mobi_provider.provider:run_provider":
+            kwargs = {**kwargs, "fencing": (lease.name, lease.token)}
+        return ref_to_obj(func_ref)(*args, **kwargs)
+    finally:
+        stopped.set()
+        try:
+            lease.release()
+        except Exception as e:
+            log.exception(f"Unable to release lease of '{job_id}': {e}")
@@ -4,12 +4,19 @@ from pathlib import Path
 import sentry_sdk
 import yaml
 
-from settings import ENVIRONMENT, SENTRY_URL
+from settings import ENVIRONMENT, SENTRY_URL, TRACING
 
 HERE = Path(__file__).parents[0]
 
+_configured = False
+
 
 def configure_logging():
+    # Called by each entry point and by the providers on their creation, only configures the process once
+    global _configured
+    if _configured:
+        return
     with open(Path(HERE, "logging.yml")) as file:
         dictConfig(yaml.load(file, Loader=yaml.FullLoader))
-    sentry_sdk.init(SENTRY_URL, environment=ENVIRONMENT)
+    sentry_sdk.init(SENTRY_URL, environment=ENVIRONMENT, traces_sample_rate=1.0 if TRACING == "sentry" else None)
+    _configured = True
@@ -0,0 +1,307 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+from winds_mobi_provider import units
+from winds_mobi_provider.benchmark import get_revision
+from winds_mobi_provider.fakes import fake_backends
+from winds_mobi_provider.provider import Provider, StationNames, StationStatus
+from winds_mobi_provider.units import Pressure
+from winds_mobi_provider.uwxutils import TWxUtils
+from winds_mobi_provider.wgs84 import parse_dms
+
+# Micro-benchmarks of the per-measure and per-station functions of the providers. The times are divided by the time of
+# a reference loop to compare them to the tracked baselines on another machine. Mongo, Redis and the Google APIs are the
+# in-process stand-ins: the times don't include the round trips.
+default_baselines_path = Path(__file__).parents[1] / "tests" / "microbench_baselines.json"
+# Allowed slowdown compared to the baseline, unless the baseline has its own threshold
+default_threshold = 0.5
+
+# Setup functions of the benchmarks by name, they return the function to time
+benchmarks = {}
+
+
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+
+    return register
+
+
+class MicrobenchProvider(Provider):
+    provider_code = "microbench"
+    provider_name = "microbench"
+    provider_url = "https://winds.mobi"
+
+
+station = {"_id": "microbench-1", "alt": 1588}
+
+
+def reference():
+    # Float conversions and rounding, like the converters
+    total = 0.0
+    for value in range(100):
+        total += round(float(value) * 1.5, 1)
+    return total
+
+
+@benchmark("create_measure")
+def create_measure(provider):
+    return lambda: provider.create_measure(station, 1767225600, 270, 12.5, 20.3, temperature=8.2, humidity=65)
+
+
+@benchmark("create_measure_quantities")
+def create_measure_quantities(provider):
+    wind_average, wind_maximum = units.Q_(3.5, units.ureg.meter / units.ureg.second), units.Q_(11, units.ureg.knot)
+    temperature = units.Q_(46.8, units.ureg.degF)
+    return lambda: provider.create_measure(
+        station, 1767225600, 270, wind_average, wind_maximum, temperature=temperature, humidity=65
+    )
+
+
+@benchmark("create_measure_pressure")
+def create_measure_pressure(provider):
+    pressure = Pressure(qfe=836.3, qnh=None, qff=None)
+    return lambda: provider.create_measure(
+        station, 1767225600, 270, 12.5, 20.3, temperature=8.2, humidity=65, pressure=pressure
+    )
+
+
+@benchmark("create_measure_quantities_pressure")
+def create_measure_quantities_pressure(provider):
+    wind_average, wind_maximum = units.Q_(3.5, units.ureg.meter / units.ureg.second), units.Q_(11, units.ureg.knot)
+    pressure = Pressure(qfe=None, qnh=units.Q_(1013, units.ureg.hPa), qff=None)
+    return lambda: provider.create_measure(
+        station, 1767225600, 270, wind_average, wind_maximum, temperature=8.2, humidity=65, pressure=pressure
+    )
+
+
+@benchmark("compute_pressures_qfe")
+def compute_pressures_qfe(provider):
+    compute_pressures = provider._Provider__compute_pressures
+    pressure = Pressure(qfe=836.3, qnh=None, qff=None)
+    return lambda: compute_pressures(pressure, 1588, 8.2, 65)
+
+
+@benchmark("compute_pressures_qff_quantity")
+def compute_pressures_qff_quantity(provider):
+    compute_pressures = provider._Provider__compute_pressures
+    pressure = Pressure(qfe=None, qnh=None, qff=units.Q_(1015, units.ureg.hPa))
+    return lambda: compute_pressures(pressure, 1588, 8.2, 65)
+
+
+def create_converter_benchmark(name, value):
+    # value: a float, or a quantity given as its magnitude and unit
+    @benchmark(f"to_{name}_quantity" if isinstance(value, tuple) else f"to_{name}")
+    def converter(provider):
+        convert = getattr(provider, f"_Provider__to_{name}")
+        converted_value = units.Q_(*value) if isinstance(value, tuple) else value
+        return lambda: convert(converted_value)
+
+
+for converter_name, converter_value in [
+    ("int", "12.6"),
+    ("float", "12.66"),
+    ("bool", "yes"),
+    ("wind_direction", 270.4),
+    ("wind_direction", (4.71, "radian")),
+    ("wind_speed", 12.46),
+    ("wind_speed", (6.2, "knot")),
+    ("temperature", 8.24),
+    ("temperature", (46.8, "degF")),
+    ("pressure", 1013.25),
+    ("pressure", (29.92, "inHg")),
+    ("altitude", 1588.4),
+    ("altitude", (5210, "foot")),
+    ("rain", 1.24),
+    ("rain", (1.2, "millimeter")),
+]:
+    create_converter_benchmark(converter_name, converter_value)
+
+
+@benchmark("haversine_distance")
+def haversine_distance(provider):
+    distance = provider._Provider__haversine_distance
+    return lambda: distance(46.8133, 6.9425, 46.8134, 6.9426)
+
+
+@benchmark("save_station_measure_sync")
+def save_station_measure_sync(provider):
+    # The station saved by the last metadata sync
+    provider.sync_metadata = True
+    provider.save_station("cached", StationNames("Payerne", "Payerne"), 46.8133, 6.9425, StationStatus.GREEN)
+    provider.sync_metadata = False
+    return lambda: provider.save_station(
+        "cached", StationNames("Payerne", "Payerne"), 46.8133, 6.9425, StationStatus.GREEN
+    )
+
+
+@benchmark("save_station_warm_caches")
+def save_station_warm_caches(provider):
+    # Metadata sync: geocoding, elevation and timezone already cached
+    provider.sync_metadata = True
+
+    def save_station():
+        return provider.save_station("warm", lambda names: names, 46.5197, 6.6323, StationStatus.GREEN)
+
+    save_station()
+    return save_station
+
+
+@benchmark("parse_dms")
+def benchmark_parse_dms(provider):
+    return lambda: parse_dms("46°48'47.9\"N")
+
+
+@benchmark("station_to_altimeter")
+def station_to_altimeter(provider):
+    return lambda: TWxUtils.StationToAltimeter(836.3, elevationM=1588)
+
+
+@benchmark("altimeter_to_station_pressure")
+def altimeter_to_station_pressure(provider):
+    return lambda: TWxUtils.AltimeterToStationPressure(1013, elevationM=1588)
+
+
+@benchmark("station_to_sea_level_pressure")
+def station_to_sea_level_pressure(provider):
+    return lambda: TWxUtils.StationToSeaLevelPressure(
+        836.3, elevationM=1588, currentTempC=8.2, meanTempC=8.2, humidity=65
+    )
+
+
+@benchmark("sea_level_to_station_pressure")
+def sea_level_to_station_pressure(provider):
+    return lambda: TWxUtils.SeaLevelToStationPressure(
+        1015, elevationM=1588, currentTempC=8.2, meanTempC=8.2, humidity=65
+    )
+
+
+def time_function(func, min_time=0.1, repeat=5) -> float:
+    # Best time of a call in microseconds, the other timings are slowed down by the machine. Like timeit, the garbage
+    # collector doesn't run during the timings.
+    def time_calls(number) -> float:
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - started_at
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while (duration := time_calls(number)) < min_time:
+            number *= 10 if duration < min_time / 10 else 2
+        timings = [duration] + [time_calls(number) for _ in range(repeat - 1)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return min(timings) / number * 1e6
+
+
+def run_microbench(names: list[str] = None, min_time=0.1, repeat=5) -> dict:
+    # The reference is timed before and after the benchmarks, the machine can speed up or slow down in between
+    reference_time = time_function(reference, min_time, repeat)
+    per_calls = {}
+    with fake_backends({}):
+        provider = MicrobenchProvider()
+        for name, setup in benchmarks.items():
+            if names and name not in names:
+                continue
+            per_calls[name] = time_function(setup(provider), min_time, repeat)
+    reference_time = min(reference_time, time_function(reference, min_time, repeat))
+    results = {
+        name: {"per_call_us": per_call, "relative": per_call / reference_time} for name, per_call in per_calls.items()
+    }
+    return {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "created_at": time.time(),
+        "reference_us": reference_time,
+        "benchmarks": results,
+    }
+
+
+def compare_results(result: dict, baselines: dict, threshold=default_threshold) -> tuple[list[str], list[str]]:
+    # Report lines and regressed benchmarks
+    lines = [f"Compared to '{baselines.get('revision')}':"]
+    regressions = []
+    for name, benchmark_result in result["benchmarks"].items():
+        if not (baseline := baselines["benchmarks"].get(name)):
+            lines.append(f"  {name}: no baseline")
+            continue
+        change = benchmark_result["relative"] / baseline["relative"] - 1
+        max_change = baseline.get("threshold", threshold)
+        regressed = change > max_change
+        if regressed:
+            regressions.append(name)
+        lines.append(
+            f"  {name}: {baseline['per_call_us']:.3g}us -> {benchmark_result['per_call_us']:.3g}us "
+            f"({change:+.1%}, {'FAIL' if regressed else 'ok'}, threshold {max_change:+.0%})"
+        )
+    return lines, regressions
+
+
+def update_baselines(result: dict, baselines: dict | None) -> dict:
+    # The thresholds set by hand are kept
+    thresholds = {
+        name: baseline["threshold"]
+        for name, baseline in (baselines or {}).get("benchmarks", {}).items()
+        if "threshold" in baseline
+    }
+    return {
+        **result,
+        "benchmarks": {
+            name: {**benchmark_result, **({"threshold": thresholds[name]} if name in thresholds else {})}
+            for name, benchmark_result in result["benchmarks"].items()
+        },
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the providers hot paths, compared to baselines")
+    parser.add_argument("names", nargs="*", help=f"Benchmarks to run, default: all of {', '.join(benchmarks)}")
+    parser.add_argument("--baselines", type=Path, default=default_baselines_path)
+    parser.add_argument("--threshold", type=float, default=default_threshold, help="Allowed slowdown, e.g. 0.5")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds of a timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baselines")
+    args = parser.parse_args(args)
+
+    if unknown_names := set(args.names) - set(benchmarks):
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown_names))}")
+    result = run_microbench(args.names, args.min_time, args.repeat)
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.exists() else None
+    print(f"reference: {result['reference_us']:.3g}us")
+    if args.update:
+        for name, benchmark_result in result["benchmarks"].items():
+            print(f"  {name}: {benchmark_result['per_call_us']:.3g}us")
+        if args.names and baselines:
+            result["benchmarks"] = {**baselines["benchmarks"], **result["benchmarks"]}
+        args.baselines.write_text(json.dumps(update_baselines(result, baselines), indent=2) + "\n")
+        print(f"Baselines written to '{args.baselines}'")
+        return
+    if not baselines:
+        parser.error(f"No baselines in '{args.baselines}', run with --update")
+    lines, regressions = compare_results(result, baselines, args.threshold)
+    if regressions:
+        # Confirm the regressions, the machine can be busy for a few seconds
+        retry = run_microbench(regressions, args.min_time, args.repeat)
+        for name, benchmark_result in retry["benchmarks"].items():
+            if benchmark_result["relative"] < result["benchmarks"][name]["relative"]:
+                result["benchmarks"][name] = benchmark_result
+        lines, regressions = compare_results(result, baselines, args.threshold)
+    for line in lines:
+        print(line)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import math
+
+
+def assign_phase_offsets(jobs: dict[str, tuple[float, float, float]], slot=10) -> dict[str, float]:
+    # jobs: name -> (interval, average run duration, average inserted measures), durations in seconds
+    # Place the heaviest jobs first, each one at the phase of its interval overlapping the lowest load
+    if not jobs:
+        return {}
+    period = math.lcm(*(max(round(interval / slot), 1) for interval, _, _ in jobs.values()))
+    load = [0.0] * period
+    max_measures = max(measures for _, _, measures in jobs.values()) or 1
+
+    def weight(name):
+        # A busy worker, heavier when it writes more measures to the database
+        _, duration, measures = jobs[name]
+        return duration * (1 + measures / max_measures)
+
+    offsets = {}
+    for name in sorted(jobs, key=lambda job_name: (-weight(job_name), job_name)):
+        interval, duration, measures = jobs[name]
+        interval_slots = max(round(interval / slot), 1)
+        duration_slots = min(max(math.ceil(duration / slot), 1), interval_slots)
+        best_cost, best_phase, best_slots = None, 0, []
+        for phase in range(interval_slots):
+            slots = [
+                (start + index) % period
+                for start in range(phase, period, interval_slots)
+                for index in range(duration_slots)
+            ]
+            cost = (max(load[i] for i in slots), sum(load[i] for i in slots))
+            if best_cost is None or cost < best_cost:
+                best_cost, best_phase, best_slots = cost, phase, slots
+        for i in best_slots:
+            load[i] += 1 + measures / max_measures
+        offsets[name] = best_phase * slot
+    return offsets
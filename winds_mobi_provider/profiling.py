@@ -0,0 +1,77 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+from settings import PROFILING_DIR, PROFILING_TOP
+
+# cProfile and tracemalloc are global to the process: profile one run at a time
+_profiling_lock = threading.Lock()
+
+
+def get_profiling_rate(provider_code) -> float:
+    # PROFILE_PROVIDER_{CODE}: "true" to profile every run or the fraction of the runs to profile, e.g. "0.05"
+    value = os.environ.get(f"PROFILE_PROVIDER_{provider_code.upper()}")
+    if not value:
+        return 0
+    try:
+        return min(max(float(value), 0), 1)
+    except ValueError:
+        return 1 if TypeAdapter(bool).validate_python(value) else 0
+
+
+@contextmanager
+def profile_run(provider_code, name, log: logging.Logger):
+    # Write the pstats and the top allocations of a sampled run to PROFILING_DIR, then log the top functions
+    rate = get_profiling_rate(provider_code)
+    if not rate or random.random() >= rate:
+        yield
+        return
+    if not _profiling_lock.acquire(blocking=False):
+        log.info(f"Another run of the process is being profiled, '{name}' not profiled")
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        tracemalloc.start(10)
+        start_snapshot = tracemalloc.take_snapshot()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            end_snapshot = tracemalloc.take_snapshot()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            write_profile(name, profiler, start_snapshot, end_snapshot, peak_memory, log)
+    finally:
+        _profiling_lock.release()
+
+
+def write_profile(name, profiler, start_snapshot, end_snapshot, peak_memory, log: logging.Logger):
+    try:
+        path = Path(PROFILING_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path.with_suffix(".pstats"))
+
+        allocations = end_snapshot.compare_to(start_snapshot, "lineno")[:PROFILING_TOP]
+        with open(path.with_suffix(".allocations.txt"), "w") as file:
+            file.write(f"Peak traced memory: {peak_memory / 1024**2:.1f}MB\n")
+            for allocation in allocations:
+                file.write(f"{allocation}\n")
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILING_TOP)
+        log.info(f"Profile of '{name}' written to '{path}.pstats', peak memory {peak_memory / 1024**2:.1f}MB")
+        log.info(output.getvalue())
+    except Exception as e:
+        log.exception(f"Unable to write the profile of '{name}': {e}")
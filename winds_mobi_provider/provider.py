@@ -1,9 +1,23 @@
+import fcntl
+import gc
+import hashlib
+import importlib
 import json
 import logging
 import math
-from collections import namedtuple
+import multiprocessing
+import resource
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, defaultdict, namedtuple
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar, copy_context
 from enum import Enum
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
 import arrow
@@ -11,16 +25,179 @@ import redis
 import requests
 import sentry_sdk
 from furl import furl
+from pydantic import TypeAdapter
 from pymongo import ASCENDING, GEOSPHERE, MongoClient
 from sentry_sdk import metrics
-from timezonefinder import TimezoneFinder
 
-from settings import GOOGLE_API_KEY, MONGODB_URL, REDIS_URL
+from settings import (
+    GOOGLE_API_KEY,
+    GOOGLE_API_URL,
+    HTTP_HOST_CONCURRENCY,
+    MONGODB_URL,
+    REDIS_URL,
+    STATION_QUEUE,
+    WORKER_MAX_MEMORY_MB,
+)
+from winds_mobi_provider import units
+from winds_mobi_provider.cadence import Cadence
+from winds_mobi_provider.cassettes import get_cassette
+from winds_mobi_provider.lease import is_fencing_token_valid
 from winds_mobi_provider.logging import configure_logging
-from winds_mobi_provider.units import Pressure, ureg
+from winds_mobi_provider.profiling import profile_run
+from winds_mobi_provider.run_metrics import (
+    MeteredRedisConnection,
+    MongoCommandsListener,
+    RunMetrics,
+    run_metrics_context,
+)
+from winds_mobi_provider.tracing import Tracer
+from winds_mobi_provider.units import Pressure
 from winds_mobi_provider.uwxutils import TWxUtils
 
-configure_logging()
+# Clients and caches shared by all the providers of a worker process, they are kept warm between the runs
+_warm_resources = {}
+_warm_resources_lock = threading.RLock()
+_active_runs = 0
+
+
+def get_warm_resource(name, factory: Callable):
+    with _warm_resources_lock:
+        if name not in _warm_resources:
+            _warm_resources[name] = factory()
+        return _warm_resources[name]
+
+
+def release_warm_resources():
+    for warm_resource in _warm_resources.values():
+        if close := getattr(warm_resource, "close", None) or getattr(warm_resource, "shutdown", None):
+            # Mongo and Redis clients, shards process pools
+            close()
+    _warm_resources.clear()
+    gc.collect()
+
+
+def create_redis_client() -> redis.StrictRedis:
+    return redis.StrictRedis.from_url(url=REDIS_URL, decode_responses=True, connection_class=MeteredRedisConnection)
+
+
+def create_timezone_finder():
+    # Loading the timezones polygons is slow and memory hungry, only the runs saving new stations need them
+    from timezonefinder import TimezoneFinder
+
+    return TimezoneFinder(in_memory=True)
+
+
+# Concurrent requests by host, for the runs sharing a process
+_host_semaphores = {}
+
+
+def get_host_semaphore(host) -> threading.BoundedSemaphore:
+    with _warm_resources_lock:
+        return _host_semaphores.setdefault(host, threading.BoundedSemaphore(HTTP_HOST_CONCURRENCY))
+
+
+# Context of the providers created by a run, the runs can be concurrent in the threads of the thread runner
+# Full station metadata sync (default) or lightweight measure sync reusing the saved stations documents
+_sync_metadata = ContextVar("sync_metadata", default=True)
+# Lease name and fencing token of the run when the scheduler runs on several nodes
+_fencing = ContextVar("fencing", default=None)
+# Shard index, shards count and directory of the payloads shared by the shards of the run
+_shard = ContextVar("shard", default=None)
+_run_stats = ContextVar("run_stats", default=None)
+
+
+def is_metadata_sync_due(func_name, metadata_sync_interval: float) -> bool:
+    # Claim the metadata sync of the provider: the key expires slightly before the next one is due, to promote the first
+    # run of the scheduler after it
+    redis_client = get_warm_resource("redis_client", create_redis_client)
+    return bool(
+        redis_client.set(
+            f"metadata-sync/{func_name}", int(time.time()), nx=True, px=int(metadata_sync_interval * 0.95 * 1000)
+        )
+    )
+
+
+def run_provider(
+    func_ref: str, sync_metadata=True, fencing: tuple[str, int] = None, shards=1, metadata_sync_interval=None
+) -> dict:
+    # Entry point used by the scheduler to run a provider function, e.g. "providers.metar:metar", in a given mode. With
+    # metadata_sync_interval, in seconds, a measure sync is promoted to a metadata sync when the last one is older.
+    global _active_runs
+    module_name, func_name = func_ref.split(":")
+    if metadata_sync_interval and not sync_metadata:
+        sync_metadata = is_metadata_sync_due(func_name, metadata_sync_interval)
+    if shards > 1:
+        return run_shards(func_ref, sync_metadata, fencing, shards)
+    func = getattr(importlib.import_module(module_name), func_name)
+    tokens = [_sync_metadata.set(sync_metadata), _fencing.set(fencing), _run_stats.set({"inserted_measures": 0})]
+    with _warm_resources_lock:
+        _active_runs += 1
+    started_at = time.time()
+    try:
+        func()
+        # Returned to the scheduler to smooth the load of the runs
+        return {
+            "started_at": started_at,
+            "duration": time.time() - started_at,
+            "sync_metadata": sync_metadata,
+            "inserted_measures": _run_stats.get()["inserted_measures"],
+            "metrics": _run_stats.get().get("metrics"),
+        }
+    finally:
+        with _warm_resources_lock:
+            _active_runs -= 1
+        for token in tokens:
+            token.var.reset(token)
+
+
+def run_shard(func_ref: str, sync_metadata, fencing, shard: tuple[int, int, str]) -> dict:
+    token = _shard.set(shard)
+    try:
+        return run_provider(func_ref, sync_metadata, fencing)
+    finally:
+        _shard.reset(token)
+
+
+def run_shards(func_ref: str, sync_metadata, fencing, shards: int) -> dict:
+    # Run the provider in several processes, each one processing the stations whose id hashes to its shard
+    executor = get_warm_resource(
+        f"shards_executor_{shards}",
+        lambda: ProcessPoolExecutor(shards, mp_context=multiprocessing.get_context("spawn")),
+    )
+    started_at = time.time()
+    with tempfile.TemporaryDirectory(prefix="winds-mobi-shards-") as shared_dir:
+        futures = [
+            executor.submit(run_shard, func_ref, sync_metadata, fencing, (index, shards, shared_dir))
+            for index in range(shards)
+        ]
+        results = [future.result() for future in futures]
+    return {
+        "started_at": started_at,
+        "duration": time.time() - started_at,
+        "sync_metadata": sync_metadata,
+        "inserted_measures": sum(result["inserted_measures"] for result in results),
+    }
+
+
+def get_memory_usage_mb() -> float:
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * resource.getpagesize() / 1024**2
+    except OSError:
+        # Not on Linux: fallback to the peak memory usage
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Counts of the station tasks processed by the workers, added to the metrics of the run. The failed stations are counted
+# from the failed tasks.
+station_queue_counters = [
+    "stations_seen",
+    "stations_skipped",
+    "measures_inserted",
+    "measures_duplicate",
+    "payload_bytes",
+]
 
 
 class StationStatus(Enum):
@@ -41,37 +218,90 @@ class Provider:
     connect_timeout = 7
     read_timeout = 30
 
+    # Learn the report cadence of each station to skip the requests of the stations without new data expected
+    adaptive_station_polling = False
+    station_silent_duration = 6 * 3600
+    station_slow_polling_interval = 3600
+
+    # The runs are split into station tasks: they can be sharded and consumed by the station queue workers when
+    # STATION_QUEUE is enabled
+    station_queue = False
+    station_queue_batch_size = 50
+    station_queue_run_duration = 15 * 60
+
     __api_limit_cache_duration = 3600
     __api_error_cache_duration = 30 * 24 * 3600
     __api_cache_duration = 3 * 30 * 24 * 3600
+    # Same duration as the measures collections TTL
+    __watermarks_cache_duration = 10 * 24 * 3600
+    __collection_names_cache_duration = 3600
+    __run_lock_duration = 30 * 60
+    __run_lock_wait = 5 * 60
+    __fencing_check_interval = 10
 
     def __init__(self):
         if None in (self.provider_code, self.provider_name, self.provider_url):
             raise ProviderException("Missing provider_code, provider_name or provider_url")
-        self.mongo_db = MongoClient(MONGODB_URL).get_database()
+        configure_logging()
+        self.mongo_db = get_warm_resource(
+            "mongo_client", lambda: MongoClient(MONGODB_URL, event_listeners=[MongoCommandsListener()])
+        ).get_database()
         self.__providers_collection = self.mongo_db.providers
         self.__stations_collection = self.mongo_db.stations
-        self.__stations_collection.create_index(
-            [
-                ("loc", GEOSPHERE),
-                ("status", ASCENDING),
-                ("pv-code", ASCENDING),
-                ("short", ASCENDING),
-                ("name", ASCENDING),
-            ]
+        get_warm_resource(
+            "stations_index",
+            lambda: self.__stations_collection.create_index(
+                [
+                    ("loc", GEOSPHERE),
+                    ("status", ASCENDING),
+                    ("pv-code", ASCENDING),
+                    ("short", ASCENDING),
+                    ("name", ASCENDING),
+                ]
+            ),
         )
-        self.collection_names = self.mongo_db.list_collection_names()
-        self.redis = redis.StrictRedis.from_url(url=REDIS_URL, decode_responses=True)
+        collection_names = get_warm_resource("collection_names", dict)
+        if time.monotonic() - collection_names.get("loaded_at", -math.inf) > self.__collection_names_cache_duration:
+            # The measures collections can be dropped by the admin jobs: refresh the list from time to time
+            # A set: the large providers look up thousands of stations on each run
+            collection_names["names"] = set(self.mongo_db.list_collection_names())
+            collection_names["loaded_at"] = time.monotonic()
+        self.collection_names = collection_names["names"]
+        self.redis = get_warm_resource("redis_client", create_redis_client)
         self.google_api_key = GOOGLE_API_KEY
-        self.timezone_finder = TimezoneFinder(in_memory=True)
         self.log = logging.getLogger(self.provider_code)
         sentry_sdk.set_tag("provider", self.provider_code)
+        self.__watermarks = {}
+        self.__new_watermarks = {}
+        self.__station_cadences = {}
+        self.__updated_station_cadences = set()
+        self.sync_metadata = _sync_metadata.get()
+        self.__cached_stations = None
+        self.__fencing = _fencing.get()
+        self.__fencing_checked_at = -math.inf
+        self.__station_queue_run_id = None
+        self.shard = _shard.get()
+        self.metrics = RunMetrics(self.provider_code, self.sync_metadata, self.shard)
+        self.tracer = Tracer(self.provider_code, self.log)
+        self.cassette = get_cassette(self.provider_code)
+
+    @property
+    def timezone_finder(self):
+        return get_warm_resource("timezone_finder", create_timezone_finder)
+
+    def __check_fencing(self):
+        # Stop writing as soon as another scheduler node has claimed the lease of the run
+        if self.__fencing and time.monotonic() - self.__fencing_checked_at > self.__fencing_check_interval:
+            lease_name, token = self.__fencing
+            if not is_fencing_token_valid(self.redis, lease_name, token):
+                raise ProviderException(f"Lease '{lease_name}' has been claimed by another node")
+            self.__fencing_checked_at = time.monotonic()
 
     def __create_measures_collection(self, station_id):
         if station_id not in self.collection_names:
             self.mongo_db.create_collection(station_id)
             self.mongo_db[station_id].create_index([("time", ASCENDING)], expireAfterSeconds=60 * 60 * 24 * 10)
-            self.collection_names.append(station_id)
+            self.collection_names.add(station_id)
 
     def __measures_collection(self, station_id):
         return self.mongo_db[station_id]
@@ -96,26 +326,26 @@ class Provider:
         return str(value).lower() in ["true", "yes"]
 
     def __to_wind_direction(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_int(value.to(ureg.degree).magnitude, mandatory=True)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_int(value.to(units.ureg.degree).magnitude, mandatory=True)
         else:
             return self.__to_int(value, mandatory=True)
 
     def __to_wind_speed(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_float(value.to(ureg.kilometer / ureg.hour).magnitude, mandatory=True)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_float(value.to(units.ureg.kilometer / units.ureg.hour).magnitude, mandatory=True)
         else:
             return self.__to_float(value, mandatory=True)
 
     def __to_temperature(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_float(value.to(ureg.degC).magnitude)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_float(value.to(units.ureg.degC).magnitude)
         else:
             return self.__to_float(value)
 
     def __to_pressure(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_float(value.to(ureg.hPa).magnitude, ndigits=4)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_float(value.to(units.ureg.hPa).magnitude, ndigits=4)
         else:
             return self.__to_float(value, ndigits=4)
 
@@ -143,14 +373,14 @@ class Provider:
         return {"qfe": self.__to_float(qfe), "qnh": self.__to_float(qnh), "qff": self.__to_float(qff)}
 
     def __to_altitude(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_int(value.to(ureg.meter).magnitude)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_int(value.to(units.ureg.meter).magnitude)
         else:
             return self.__to_int(value)
 
     def __to_rain(self, value):
-        if isinstance(value, ureg.Quantity):
-            return self.__to_float(value.to(ureg.liter / (ureg.meter**2)).magnitude, 1)
+        if isinstance(value, units.ureg.Quantity):
+            return self.__to_float(value.to(units.ureg.liter / (units.ureg.meter**2)).magnitude, 1)
         else:
             return self.__to_float(value, 1)
 
@@ -160,11 +390,41 @@ class Provider:
         pipe.expire(key, cache_duration)
         pipe.execute()
 
+    def http_request(self, method, url, session: requests.Session = None, **kwargs) -> requests.Response:
+        # Reuse the connections of the process and limit the concurrent requests to a host. A provider session keeps
+        # its headers and cookies.
+        session = session or get_warm_resource("http_session", requests.Session)
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        with self.tracer.span("http"), self.metrics.timer("http"), get_host_semaphore(furl(url).host):
+            if self.cassette and self.cassette.replaying and self.cassette.is_recorded(url):
+                response = self.cassette.replay_response(method, url, kwargs)
+            else:
+                started_at = time.perf_counter()
+                response = getattr(session, method)(url, **kwargs)
+                if self.cassette and self.cassette.recording and self.cassette.is_recorded(url):
+                    self.cassette.record_response(method, url, kwargs, response, time.perf_counter() - started_at)
+            self.metrics.count("payload_bytes", len(response.content))
+        return response
+
+    def http_get(self, url, **kwargs) -> requests.Response:
+        return self.http_request("get", url, **kwargs)
+
+    def http_post(self, url, **kwargs) -> requests.Response:
+        return self.http_request("post", url, **kwargs)
+
+    def connect_database(self, connect: Callable, *args, **kwargs):
+        # Connection to the SQL database of a provider, e.g. connect_database(MySQLdb.connect, host, ...), recorded and
+        # replayed by the cassettes
+        if self.cassette:
+            return self.cassette.connect_database(connect, *args, **kwargs)
+        return connect(*args, **kwargs)
+
     def __call_google_api(self, url, api_name):
         path = furl(url)
         path.args["key"] = self.google_api_key
         metrics.count("api.call", 1, attributes={"name": api_name, "provider": self.provider_code})
-        result = requests.get(path.url, timeout=(self.connect_timeout, self.read_timeout)).json()
+        with self.tracer.span("google_api"):
+            result = self.http_get(path.url).json()
         if result["status"] == "OVER_QUERY_LIMIT":
             raise UsageLimitException(f"[{api_name}] OVER_QUERY_LIMIT")
         elif result["status"] == "INVALID_REQUEST":
@@ -230,7 +490,7 @@ class Provider:
                 path += "|"
 
         result = self.__call_google_api(
-            f"https://maps.googleapis.com/maps/api/elevation/json?locations={path}", "Google Maps Elevation API"
+            f"{GOOGLE_API_URL}/maps/api/elevation/json?locations={path}", "Google Maps Elevation API"
         )
         elevation = float(result["results"][0]["elevation"])
         is_peak = False
@@ -274,6 +534,37 @@ class Provider:
     def get_station_id(self, provider_id):
         return self.provider_code + "-" + str(provider_id)
 
+    def is_in_shard(self, provider_id) -> bool:
+        if not self.shard:
+            return True
+        index, shards, _ = self.shard
+        return zlib.crc32(str(provider_id).encode()) % shards == index
+
+    def fetch_shared(self, url, **kwargs) -> bytes:
+        # Payload of all the stations, fetched once for all the shards of the run
+        if not self.shard:
+            return self.http_get(url, **kwargs).content
+        path = Path(self.shard[2], hashlib.sha1(url.encode()).hexdigest())
+        with open(path.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                content = self.http_get(url, **kwargs).content
+                path.write_bytes(content)
+                return content
+        return path.read_bytes()
+
+    def __get_cached_station(self, station_id) -> dict | None:
+        if self.__cached_stations is None:
+            # Read the stations of the provider in a single query
+            self.__cached_stations = {
+                station["_id"]: station
+                for station in self.__stations_collection.find(
+                    {"pv-code": self.provider_code},
+                    projection={"pv-id": True, "short": True, "name": True, "alt": True, "status": True, "tz": True},
+                )
+            }
+        return self.__cached_stations.get(station_id)
+
     def __create_station(
         self,
         provider_id,
@@ -334,129 +625,138 @@ class Provider:
         if provider_id is None:
             raise ProviderException("Missing provider_id")
         station_id = self.get_station_id(provider_id)
-
-        lat = self.__to_float(latitude, 6)
-        lon = self.__to_float(longitude, 6)
-        if lat is None or lon is None:
-            raise ProviderException("Missing latitude or longitude")
-        if lat < -90 or lat > 90 or lon < -180 or lon > 180:
-            raise ProviderException(f"Invalid latitude '{lat}' or longitude '{lon}'")
-
-        country_code = None
-        if isinstance(names, StationNames):
-            short_name, name = names
-        elif callable(names):
-            address_key = f"address2/{lat},{lon}"
-            if not self.redis.exists(address_key):
-                use_previous_location = False
-                if slightly_moved := self.__station_slightly_moved(station_id, lat, lon):
-                    # Reduce the number of calls to Google API when the station has moved slightly
-                    previous_lat, previous_lon = slightly_moved
-                    if self.redis.exists(f"address2/{previous_lat},{previous_lon}"):
-                        lat, lon = previous_lat, previous_lon
-                        address_key = f"address2/{lat},{lon}"
-                        use_previous_location = True
-
-                if not use_previous_location:
+        self.metrics.see_station(station_id)
+
+        with self.tracer.span("save_station", station_id):
+            if not self.sync_metadata and (station := self.__get_cached_station(station_id)):
+                # Measure sync: the station metadata is only refreshed by the metadata sync
+                return station
+
+            lat = self.__to_float(latitude, 6)
+            lon = self.__to_float(longitude, 6)
+            if lat is None or lon is None:
+                raise ProviderException("Missing latitude or longitude")
+            if lat < -90 or lat > 90 or lon < -180 or lon > 180:
+                raise ProviderException(f"Invalid latitude '{lat}' or longitude '{lon}'")
+
+            # Names, elevation and timezone from the Google APIs and timezonefinder, cached in Redis
+            with self.metrics.timer("enrichment"):
+                country_code = None
+                if isinstance(names, StationNames):
+                    short_name, name = names
+                elif callable(names):
+                    address_key = f"address2/{lat},{lon}"
+                    if not self.redis.exists(address_key):
+                        use_previous_location = False
+                        if slightly_moved := self.__station_slightly_moved(station_id, lat, lon):
+                            # Reduce the number of calls to Google API when the station has moved slightly
+                            previous_lat, previous_lon = slightly_moved
+                            if self.redis.exists(f"address2/{previous_lat},{previous_lon}"):
+                                lat, lon = previous_lat, previous_lon
+                                address_key = f"address2/{lat},{lon}"
+                                use_previous_location = True
+
+                        if not use_previous_location:
+                            try:
+                                result = self.__call_google_api(
+                                    f"{GOOGLE_API_URL}/maps/api/geocode/json?latlng={lat},{lon}",
+                                    "Google Geocoding API",
+                                )
+                                self.__add_redis_key(
+                                    address_key,
+                                    {"json": json.dumps(result)},
+                                    self.__api_cache_duration,
+                                )
+                            except TimeoutError as e:
+                                raise e
+                            except UsageLimitException as e:
+                                self.__add_redis_key(address_key, {"error": repr(e)}, self.__api_limit_cache_duration)
+                            except Exception as e:
+                                if not isinstance(e, ProviderException):
+                                    self.log.exception("Unable to call Google Geocoding API")
+                                self.__add_redis_key(address_key, {"error": repr(e)}, self.__api_error_cache_duration)
+
+                    cache = self.redis.hgetall(address_key)
+                    if error := cache.get("error"):
+                        raise ProviderException(f"Unable to get station geocoding for '{address_key}': {error}")
+                    results = json.loads(cache["json"])["results"]
+                    short_name, name = names(self.__get_station_names_from_geocoding_results(address_key, results))
+                    country_code = self.__get_country_code_from_geocoding_results(address_key, results)
+                else:
+                    raise ProviderException(f"Invalid station names '{names}'")
+                if not short_name or not name:
+                    raise ProviderException(f"Invalid station short_name '{short_name}' or name '{name}'")
+
+                alt_key = f"alt/{lat},{lon}"
+                if not self.redis.exists(alt_key):
+                    use_previous_location = False
+                    if slightly_moved := self.__station_slightly_moved(station_id, lat, lon):
+                        # Reduce the number of calls to Google API when the station has moved slightly
+                        previous_lat, previous_lon = slightly_moved
+                        if self.redis.exists(f"alt/{previous_lat},{previous_lon}"):
+                            lat, lon = previous_lat, previous_lon
+                            alt_key = f"alt/{lat},{lon}"
+                            use_previous_location = True
+
+                    if not use_previous_location:
+                        try:
+                            elevation, is_peak = self.__compute_elevation(lat, lon)
+                            self.__add_redis_key(
+                                alt_key, {"alt": elevation, "is_peak": str(is_peak)}, self.__api_cache_duration
+                            )
+                        except TimeoutError as e:
+                            raise e
+                        except UsageLimitException as e:
+                            self.__add_redis_key(alt_key, {"error": repr(e)}, self.__api_limit_cache_duration)
+                        except Exception as e:
+                            if not isinstance(e, ProviderException):
+                                self.log.exception("Unable to call Google Elevation API")
+                            self.__add_redis_key(alt_key, {"error": repr(e)}, self.__api_error_cache_duration)
+
+                cache = self.redis.hgetall(alt_key)
+                if error := cache.get("error"):
+                    raise ProviderException(f"Unable to get station elevation for '{alt_key}': {error}")
+                if not altitude:
+                    altitude = cache["alt"]
+                is_peak = cache["is_peak"] == "True"
+
+                if not timezone:
                     try:
-                        result = self.__call_google_api(
-                            f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}",
-                            "Google Geocoding API",
-                        )
-                        self.__add_redis_key(
-                            address_key,
-                            {"json": json.dumps(result)},
-                            self.__api_cache_duration,
-                        )
-                    except TimeoutError as e:
-                        raise e
-                    except UsageLimitException as e:
-                        self.__add_redis_key(address_key, {"error": repr(e)}, self.__api_limit_cache_duration)
+                        timezone = ZoneInfo(self.timezone_finder.timezone_at(lng=lon, lat=lat))
                     except Exception as e:
-                        if not isinstance(e, ProviderException):
-                            self.log.exception("Unable to call Google Geocoding API")
-                        self.__add_redis_key(address_key, {"error": repr(e)}, self.__api_error_cache_duration)
-
-            cache = self.redis.hgetall(address_key)
-            if error := cache.get("error"):
-                raise ProviderException(f"Unable to get station geocoding for '{address_key}': {error}")
-            results = json.loads(cache["json"])["results"]
-            short_name, name = names(self.__get_station_names_from_geocoding_results(address_key, results))
-            country_code = self.__get_country_code_from_geocoding_results(address_key, results)
-        else:
-            raise ProviderException(f"Invalid station names '{names}'")
-        if not short_name or not name:
-            raise ProviderException(f"Invalid station short_name '{short_name}' or name '{name}'")
-
-        alt_key = f"alt/{lat},{lon}"
-        if not self.redis.exists(alt_key):
-            use_previous_location = False
-            if slightly_moved := self.__station_slightly_moved(station_id, lat, lon):
-                # Reduce the number of calls to Google API when the station has moved slightly
-                previous_lat, previous_lon = slightly_moved
-                if self.redis.exists(f"alt/{previous_lat},{previous_lon}"):
-                    lat, lon = previous_lat, previous_lon
-                    alt_key = f"alt/{lat},{lon}"
-                    use_previous_location = True
-
-            if not use_previous_location:
-                try:
-                    elevation, is_peak = self.__compute_elevation(lat, lon)
-                    self.__add_redis_key(
-                        alt_key, {"alt": elevation, "is_peak": str(is_peak)}, self.__api_cache_duration
-                    )
-                except TimeoutError as e:
-                    raise e
-                except UsageLimitException as e:
-                    self.__add_redis_key(alt_key, {"error": repr(e)}, self.__api_limit_cache_duration)
-                except Exception as e:
-                    if not isinstance(e, ProviderException):
-                        self.log.exception("Unable to call Google Elevation API")
-                    self.__add_redis_key(alt_key, {"error": repr(e)}, self.__api_error_cache_duration)
-
-        cache = self.redis.hgetall(alt_key)
-        if error := cache.get("error"):
-            raise ProviderException(f"Unable to get station elevation for '{alt_key}': {error}")
-        if not altitude:
-            altitude = cache["alt"]
-        is_peak = cache["is_peak"] == "True"
-
-        if not timezone:
-            try:
-                timezone = ZoneInfo(self.timezone_finder.timezone_at(lng=lon, lat=lat))
-            except Exception as e:
-                raise ProviderException("Unable to determine station 'time_zone'") from e
-
-        if not url:
-            urls = {"default": self.provider_url}
-        elif isinstance(url, str):
-            urls = {"default": url}
-        elif isinstance(url, dict):
-            if "default" not in url:
-                raise ProviderException("No 'default' key in url")
-            urls = url
-        else:
-            raise ProviderException("Invalid url")
-
-        fixes = self.mongo_db.stations_fix.find_one(station_id)
-        station = self.__create_station(
-            provider_id,
-            short_name,
-            name,
-            lat,
-            lon,
-            altitude,
-            is_peak,
-            status.value,
-            country_code,
-            timezone,
-            urls,
-            fixes,
-        )
-        self.__stations_collection.update_one({"_id": station_id}, {"$set": station}, upsert=True)
-        self.__create_measures_collection(station_id)
-        station["_id"] = station_id
-        return station
+                        raise ProviderException("Unable to determine station 'time_zone'") from e
+
+            if not url:
+                urls = {"default": self.provider_url}
+            elif isinstance(url, str):
+                urls = {"default": url}
+            elif isinstance(url, dict):
+                if "default" not in url:
+                    raise ProviderException("No 'default' key in url")
+                urls = url
+            else:
+                raise ProviderException("Invalid url")
+
+            self.__check_fencing()
+            fixes = self.mongo_db.stations_fix.find_one(station_id)
+            station = self.__create_station(
+                provider_id,
+                short_name,
+                name,
+                lat,
+                lon,
+                altitude,
+                is_peak,
+                status.value,
+                country_code,
+                timezone,
+                urls,
+                fixes,
+            )
+            self.__stations_collection.update_one({"_id": station_id}, {"$set": station}, upsert=True)
+            self.__create_measures_collection(station_id)
+            station["_id"] = station_id
+            return station
 
     def create_measure(
         self,
@@ -511,45 +811,340 @@ class Provider:
 
         return measure
 
+    def __watermarks_key(self):
+        return f"watermarks/{self.provider_code}"
+
+    def load_watermarks(self):
+        # The newest measure timestamp already ingested for each station, read in a single call
+        self.__watermarks = {
+            station_id: int(timestamp) for station_id, timestamp in self.redis.hgetall(self.__watermarks_key()).items()
+        }
+        self.__new_watermarks = {}
+
+    def save_watermarks(self):
+        if self.__new_watermarks:
+            self.__add_redis_key(self.__watermarks_key(), self.__new_watermarks, self.__watermarks_cache_duration)
+            self.__watermarks.update(self.__new_watermarks)
+            self.__new_watermarks = {}
+
+    def is_new_measure(self, provider_id, timestamp: int) -> bool:
+        # Use it to skip the measure work of a station whose measure has already been ingested. The metadata sync must
+        # still save the station to refresh its status and lastSeenAt.
+        station_id = self.get_station_id(provider_id)
+        is_new = int(round(timestamp)) > self.__watermarks.get(station_id, 0)
+        self.metrics.see_station(station_id, skipped=not is_new)
+        return is_new
+
+    def __station_cadences_key(self):
+        return f"cadences/{self.provider_code}"
+
+    def load_station_cadences(self):
+        self.__station_cadences = {
+            station_id: Cadence.from_dict(json.loads(values))
+            for station_id, values in self.redis.hgetall(self.__station_cadences_key()).items()
+        }
+        self.__updated_station_cadences = set()
+
+    def save_station_cadences(self):
+        if self.__updated_station_cadences:
+            self.__add_redis_key(
+                self.__station_cadences_key(),
+                {
+                    station_id: json.dumps(self.__station_cadences[station_id].to_dict())
+                    for station_id in self.__updated_station_cadences
+                },
+                self.__watermarks_cache_duration,
+            )
+            self.__updated_station_cadences = set()
+
+    def is_station_due(self, provider_id) -> bool:
+        # Use it before requesting the data of a station: skip it until its next report is expected
+        if not self.adaptive_station_polling:
+            return True
+        station_id = self.get_station_id(provider_id)
+        cadence = self.__station_cadences.setdefault(station_id, Cadence())
+        now = time.time()
+        if not cadence.is_due(now, self.station_silent_duration, self.station_slow_polling_interval):
+            self.metrics.see_station(station_id, skipped=True)
+            return False
+        self.metrics.see_station(station_id)
+        cadence.checked_at = now
+        self.__updated_station_cadences.add(station_id)
+        return True
+
     def has_measure(self, station: dict, timestamp: int) -> bool:
-        return self.__measures_collection(station["_id"]).count_documents({"_id": timestamp}) > 0
+        with self.tracer.span("has_measure", station["_id"]):
+            if self.__measures_collection(station["_id"]).count_documents({"_id": timestamp}) > 0:
+                self.metrics.count("measures_duplicate")
+                return True
+            return False
 
     def __add_last_measure(self, measures_collection, station_id):
         last_measure = measures_collection.find_one({"$query": {}, "$orderby": {"_id": -1}})
         if last_measure:
-            self.__stations_collection.update_one({"_id": station_id}, {"$set": {"last": last_measure}})
+            # A station still ingesting measures is seen, whether the metadata sync visits it or not
+            self.__stations_collection.update_one(
+                {"_id": station_id}, {"$set": {"last": last_measure, "lastSeenAt": arrow.utcnow().datetime}}
+            )
 
     def insert_measures(self, station: dict, measures: list[dict] | dict):
         if not isinstance(measures, list):
             measures = [measures]
 
         if len(measures) > 0:
-            result = self.__measures_collection(station["_id"]).insert_many(measures, ordered=False)
-            if len(result.inserted_ids) != len(measures):
-                self.log.warning(f"{len(measures) - len(result.inserted_ids)} measure(s) not inserted")
-
-            end_date = arrow.Arrow.fromtimestamp(measures[-1]["_id"], ZoneInfo(station["tz"]))
-            self.log.info(
-                "⏱ {end_date} ({end_date_local}) '{short}'/'{name}' ({id}): {nb} values inserted".format(
-                    end_date=end_date.format("YY-MM-DD HH:mm:ssZZ"),
-                    end_date_local=end_date.to("local").format("YY-MM-DD HH:mm:ssZZ"),
-                    short=station["short"],
-                    name=station["name"],
-                    id=station["_id"],
-                    nb=len(result.inserted_ids),
+            with self.tracer.span("insert_measures", station["_id"]):
+                self.__check_fencing()
+                result = self.__measures_collection(station["_id"]).insert_many(measures, ordered=False)
+                if len(result.inserted_ids) != len(measures):
+                    self.log.warning(f"{len(measures) - len(result.inserted_ids)} measure(s) not inserted")
+                if run_stats := _run_stats.get():
+                    run_stats["inserted_measures"] += len(result.inserted_ids)
+                self.metrics.count("measures_inserted", len(result.inserted_ids))
+                self.metrics.count("measures_duplicate", len(measures) - len(result.inserted_ids))
+                inserted_ids = set(result.inserted_ids)
+                if lags := [
+                    (measure["receivedAt"] - measure["time"]).total_seconds()
+                    for measure in measures
+                    if measure["_id"] in inserted_ids and "time" in measure and "receivedAt" in measure
+                ]:
+                    self.metrics.observe_lags(station["_id"], lags)
+
+                end_date = arrow.Arrow.fromtimestamp(measures[-1]["_id"], ZoneInfo(station["tz"]))
+                self.log.info(
+                    "⏱ {end_date} ({end_date_local}) '{short}'/'{name}' ({id}): {nb} values inserted".format(
+                        end_date=end_date.format("YY-MM-DD HH:mm:ssZZ"),
+                        end_date_local=end_date.to("local").format("YY-MM-DD HH:mm:ssZZ"),
+                        short=station["short"],
+                        name=station["name"],
+                        id=station["_id"],
+                        nb=len(result.inserted_ids),
+                    )
                 )
-            )
 
-            self.__add_last_measure(self.__measures_collection(station["_id"]), station["_id"])
-            now = arrow.utcnow()
-            self.__providers_collection.update_one(
-                {"_id": self.provider_code},
-                {
-                    "$set": {"name": self.provider_name, "url": self.provider_url, "lastSeenAt": now.datetime},
-                    "$setOnInsert": {"firstSeenAt": now.datetime},
-                },
-                upsert=True,
+                self.__add_last_measure(self.__measures_collection(station["_id"]), station["_id"])
+                self.__new_watermarks[station["_id"]] = max(
+                    self.__watermarks.get(station["_id"], 0),
+                    self.__new_watermarks.get(station["_id"], 0),
+                    *(measure["_id"] for measure in measures),
+                )
+                if self.adaptive_station_polling:
+                    cadence = self.__station_cadences.setdefault(station["_id"], Cadence())
+                    for measure_id in sorted(measure["_id"] for measure in measures):
+                        cadence.observe(measure_id, time.time())
+                    self.__updated_station_cadences.add(station["_id"])
+                now = arrow.utcnow()
+                self.__providers_collection.update_one(
+                    {"_id": self.provider_code},
+                    {
+                        "$set": {"name": self.provider_name, "url": self.provider_url, "lastSeenAt": now.datetime},
+                        "$setOnInsert": {"firstSeenAt": now.datetime},
+                        # Used by the scheduler to learn the upstream refresh cadence
+                        "$max": {"lastMeasureAt": arrow.get(max(measure["_id"] for measure in measures)).datetime},
+                    },
+                    upsert=True,
+                )
+
+    @classmethod
+    def create(cls):
+        # Used by the station queue workers to instantiate the provider
+        return cls()
+
+    @classmethod
+    def create_for_run(cls, sync_metadata=True, fencing: tuple[str, int] = None):
+        # A provider for the station tasks of a run: the stations cache, the fencing token and the metrics are the ones
+        # of the run
+        def create():
+            _sync_metadata.set(sync_metadata)
+            _fencing.set(fencing)
+            return cls.create()
+
+        return copy_context().run(create)
+
+    @classmethod
+    def station_queue_key(cls):
+        return f"station-queue/{cls.provider_code}"
+
+    def load_stations_state(self, provider_ids: list):
+        # Watermarks and cadences of some stations only, read in a single call
+        station_ids = [self.get_station_id(provider_id) for provider_id in provider_ids]
+        pipe = self.redis.pipeline()
+        pipe.hmget(self.__watermarks_key(), station_ids)
+        pipe.hmget(self.__station_cadences_key(), station_ids)
+        watermarks, cadences = pipe.execute()
+        self.__watermarks = {
+            station_id: int(timestamp)
+            for station_id, timestamp in zip(station_ids, watermarks, strict=True)
+            if timestamp is not None
+        }
+        self.__new_watermarks = {}
+        self.__station_cadences = {
+            station_id: Cadence.from_dict(json.loads(values))
+            for station_id, values in zip(station_ids, cadences, strict=True)
+            if values is not None
+        }
+        self.__updated_station_cadences = set()
+
+    def trace_station(self, provider_id):
+        # Span of all the operations of a station, for the slowest stations report
+        return self.tracer.span("station", self.get_station_id(provider_id))
+
+    def process_station_task(self, task: dict) -> bool:
+        try:
+            with self.trace_station(task["provider_id"]):
+                self.process_station(task)
+            return True
+        except ProviderException as e:
+            self.log.warning(f"Error while processing station '{self.get_station_id(task['provider_id'])}': {e}")
+        except Exception as e:
+            self.log.exception(f"Error while processing station '{self.get_station_id(task['provider_id'])}': {e}")
+        return False
+
+    @classmethod
+    def process_queued_tasks(cls, queued_tasks: list[str], current_run: "Provider" = None):
+        # A batch can mix the tasks of several runs, e.g. of the shards of a run: the tasks of a run other than the
+        # current one are processed by a provider created for it
+        tasks_by_run = defaultdict(list)
+        for queued_task in queued_tasks:
+            queued_task = json.loads(queued_task)
+            tasks_by_run[queued_task["run"]].append(queued_task["task"])
+        redis_client = get_warm_resource("redis_client", create_redis_client)
+        for run_id, tasks in tasks_by_run.items():
+            if current_run and run_id == current_run.__station_queue_run_id:
+                current_run.process_run_tasks(run_id, tasks)
+                continue
+            sync_metadata, fencing = redis_client.hmget(
+                f"{cls.station_queue_key()}/{run_id}", "sync_metadata", "fencing"
             )
+            if sync_metadata is None:
+                logging.getLogger(cls.provider_code).warning(f"Run '{run_id}' expired, {len(tasks)} tasks dropped")
+                continue
+            provider = cls.create_for_run(sync_metadata != "0", tuple(json.loads(fencing)) if fencing else None)
+            with run_metrics_context(provider.metrics):
+                provider.process_run_tasks(run_id, tasks, load_state=True)
+
+    def process_run_tasks(self, run_id, tasks: list[dict], load_state=False):
+        # A provider created for the tasks loads the state of their stations and reports its counts to the run
+        if load_state:
+            self.load_stations_state([task["provider_id"] for task in tasks])
+        results = Counter(self.process_station_task(task) for task in tasks)
+        if load_state:
+            self.save_watermarks()
+            self.save_station_cadences()
+            self.metrics.stop()
+        run_key = f"{self.station_queue_key()}/{run_id}"
+        pipe = self.redis.pipeline()
+        pipe.hincrby(run_key, "done", results[True])
+        pipe.hincrby(run_key, "failed", results[False])
+        if load_state:
+            for name in station_queue_counters:
+                pipe.hincrby(run_key, f"count/{name}", self.metrics.counts[name])
+        pipe.execute()
+
+    def dispatch_station_tasks(self, tasks: list[dict]):
+        # Process the station tasks, each one a json serializable dict with a 'provider_id' key, in this process or
+        # through the station queue shared with the workers. The provider processes a task with process_station(task).
+        if not hasattr(self, "process_station"):
+            raise ProviderException(f"'{self.provider_code}' queues station tasks but doesn't define process_station()")
+        tasks = [task for task in tasks if self.is_in_shard(task["provider_id"])]
+        if not (self.station_queue and TypeAdapter(bool).validate_python(STATION_QUEUE)):
+            for task in tasks:
+                if not self.process_station_task(task):
+                    self.metrics.count("stations_failed")
+            return
+
+        run_id = uuid.uuid4().hex
+        self.__station_queue_run_id = run_id
+        run_key = f"{self.station_queue_key()}/{run_id}"
+        # The workers read the stations state from redis
+        self.save_station_cadences()
+        pipe = self.redis.pipeline()
+        run = {"total": len(tasks), "done": 0, "failed": 0, "sync_metadata": int(self.sync_metadata)}
+        if self.__fencing:
+            run["fencing"] = json.dumps(self.__fencing)
+        pipe.hset(run_key, mapping=run)
+        pipe.expire(run_key, self.station_queue_run_duration)
+        if tasks:
+            pipe.rpush(self.station_queue_key(), *(json.dumps({"run": run_id, "task": task}) for task in tasks))
+        pipe.execute()
+
+        deadline = time.monotonic() + self.station_queue_run_duration
+        processed_tasks = 0
+        while time.monotonic() < deadline:
+            # Help the workers until the queue is empty, then wait for the tasks they are processing
+            if queued_tasks := self.redis.lpop(self.station_queue_key(), self.station_queue_batch_size):
+                self.process_queued_tasks(queued_tasks, current_run=self)
+                processed_tasks += len(queued_tasks)
+                continue
+            total, done, failed = (int(value or 0) for value in self.redis.hmget(run_key, "total", "done", "failed"))
+            if done + failed >= total:
+                break
+            with self.metrics.timer("queue"):
+                time.sleep(1)
+        else:
+            self.log.warning(f"Station tasks of run '{run_id}' not completed after {self.station_queue_run_duration}s")
+        run = self.redis.hgetall(run_key)
+        total, done, failed = (int(run.get(name, 0)) for name in ("total", "done", "failed"))
+        self.metrics.count("stations_failed", failed)
+        # Counts of the tasks processed by the workers
+        for name in station_queue_counters:
+            self.metrics.count(name, int(run.get(f"count/{name}", 0)))
+        if run_stats := _run_stats.get():
+            run_stats["inserted_measures"] += int(run.get("count/measures_inserted", 0))
+        self.log.info(
+            f"{done}/{total} station tasks done, {failed} failed, {processed_tasks} processed by the run itself"
+        )
+
+    def run(self):
+        # The metadata and measure syncs of a provider must not run concurrently
+        run_lock_key = f"run/{self.provider_code}"
+        if self.shard:
+            index, shards, _ = self.shard
+            if not self.station_queue and index > 0:
+                # Only the providers with station tasks can be sharded, the first shard processes all the stations
+                self.log.warning(f"'{self.provider_code}' can't be sharded, shard {index} skipped")
+                return
+            run_lock_key = f"{run_lock_key}/{index}"
+        run_lock = self.redis.lock(run_lock_key, timeout=self.__run_lock_duration)
+        if not run_lock.acquire(blocking_timeout=self.__run_lock_wait if self.sync_metadata else 0):
+            self.log.warning(f"'{self.provider_code}' is already running, skipping this run")
+            return
+        self.log.info(f"Running '{self.provider_code}' {'metadata' if self.sync_metadata else 'measure'} sync")
+        self.metrics = RunMetrics(self.provider_code, self.sync_metadata, self.shard)
+        with run_metrics_context(self.metrics):
+            self.load_watermarks()
+            if self.adaptive_station_polling:
+                self.load_station_cadences()
+            run_name = f"{self.provider_code}-{'metadata' if self.sync_metadata else 'measure'}"
+            if self.shard:
+                run_name += f"-{self.shard[0]}"
+            try:
+                with self.tracer.trace_run(run_name), profile_run(self.provider_code, run_name, self.log):
+                    self.process_data()
+            finally:
+                self.save_watermarks()
+                self.save_station_cadences()
+                self.metrics.stop()
+                if run_stats := _run_stats.get():
+                    run_stats["metrics"] = self.metrics.to_dict()
+                try:
+                    run_lock.release()
+                except redis.exceptions.LockError:
+                    self.log.warning(f"'{self.provider_code}' run lock expired before the end of the run")
+                self.log.info(f"Run metrics: {self.metrics.summary()}")
+                try:
+                    self.metrics.send()
+                except Exception as e:
+                    self.log.exception(f"Unable to send the run metrics: {e}")
+                # The other runs of the thread runner may still use the warm resources
+                if (
+                    WORKER_MAX_MEMORY_MB
+                    and _active_runs <= 1
+                    and (memory_usage := get_memory_usage_mb()) > WORKER_MAX_MEMORY_MB
+                ):
+                    self.log.warning(
+                        f"Memory usage {memory_usage:.0f}MB is above {WORKER_MAX_MEMORY_MB}MB, releasing warm resources"
+                    )
+                    release_warm_resources()
 
 
 class ProviderException(Exception):
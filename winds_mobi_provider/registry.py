@@ -0,0 +1,76 @@
+import logging
+import os
+from dataclasses import dataclass
+
+from pydantic import TypeAdapter
+
+import settings
+
+log = logging.getLogger("registry")
+
+
+@dataclass(frozen=True)
+class ProviderJob:
+    # Provider function, e.g. "providers.metar:metar", only imported by the worker running the job
+    func_ref: str
+    # Interval, min and max intervals bounding the adaptive scheduling, in minutes
+    interval: int = 5
+    min_interval: int = 2
+    max_interval: int = 30
+    # Settings the provider can't run without
+    required_settings: tuple[str, ...] = ()
+    executor: str = "providers"
+    # Processes running the provider, each one processing the stations whose id hashes to its shard
+    shards: int = 1
+    # Offloaded to a process pool by the thread runner
+    cpu_bound: bool = False
+
+    @property
+    def name(self) -> str:
+        return self.func_ref.split(":")[1]
+
+    def is_disabled(self) -> bool:
+        return TypeAdapter(bool).validate_python(os.environ.get(f"DISABLE_PROVIDER_{self.name.upper()}", False))
+
+    def missing_settings(self) -> list[str]:
+        return [name for name in self.required_settings if not getattr(settings, name, None)]
+
+
+# Alphabetical order
+provider_jobs = [
+    ProviderJob("providers.aletsch:aletsch"),
+    ProviderJob("providers.borntofly:borntofly", required_settings=("BORN_TO_FLY_VENDOR_ID", "BORN_TO_FLY_DEVICE_ID")),
+    ProviderJob("providers.ffvl:ffvl", required_settings=("FFVL_API_KEY",)),
+    ProviderJob("providers.gxaircom:gxaircom"),
+    ProviderJob("providers.holfuy:holfuy"),
+    ProviderJob("providers.iweathar:iweathar", required_settings=("IWEATHAR_KEY",)),
+    ProviderJob("providers.kachelmannwetter:kachelmannwetter", required_settings=("KACHELMANN_API_KEY",)),
+    ProviderJob("providers.metar:metar", interval=10, min_interval=5, shards=2, cpu_bound=True),
+    ProviderJob("providers.meteoswiss:meteoswiss", cpu_bound=True),
+    ProviderJob("providers.pdcs:pdcs"),
+    ProviderJob("providers.pioupiou:pioupiou"),
+    ProviderJob("providers.pmcjoder:pmcjoder"),
+    ProviderJob("providers.pgsonda:pgsonda"),
+    ProviderJob("providers.slf:slf", min_interval=5, max_interval=60),
+    ProviderJob("providers.thunerwetter:thunerwetter"),
+    ProviderJob("providers.windball:windball"),
+    ProviderJob("providers.windline:windline", required_settings=("WINDLINE_SQL_URL",)),
+    ProviderJob("providers.windspots:windspots"),
+    ProviderJob("providers.windy:windy", required_settings=("WINDY_API_KEY",)),
+    ProviderJob("providers.wunderground:wunderground"),
+    ProviderJob("providers.yvbeach:yvbeach"),
+    ProviderJob("providers.zermatt:zermatt"),
+]
+
+
+def get_enabled_provider_jobs() -> list[ProviderJob]:
+    # Jobs not disabled by DISABLE_PROVIDER_{NAME} and with all their required settings
+    enabled_jobs = []
+    for provider_job in provider_jobs:
+        if provider_job.is_disabled():
+            continue
+        if missing_settings := provider_job.missing_settings():
+            log.warning(f"'{provider_job.name}' is not scheduled, missing settings: {', '.join(missing_settings)}")
+            continue
+        enabled_jobs.append(provider_job)
+    return enabled_jobs
@@ -0,0 +1,254 @@
+import math
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+
+import redis
+from pymongo import monitoring
+from sentry_sdk import metrics
+
+from settings import METRICS_TEXTFILE_DIR
+
+# Time of a run by phase, on the wall clock of the run: the concurrent HTTP requests of a provider fetching from several
+# threads count once. In a thread, each second is attributed to the outermost running phase: the Google API calls and
+# the cache lookups enriching a new station are enrichment time, not HTTP or Redis time. The phases of different threads
+# can overlap, the remaining time if any is spent parsing the payloads in the provider code.
+phases = ["http", "mongo", "redis", "enrichment", "queue", "parsing"]
+counters = [
+    "stations_seen",
+    "stations_skipped",
+    "stations_failed",
+    "measures_inserted",
+    "measures_duplicate",
+    "payload_bytes",
+]
+# Ingestion lag quantiles, from the observation time of the measures to their insertion
+lag_quantiles = {"p50": 0.5, "p95": 0.95, "max": 1}
+worst_lag_stations = 5
+
+# Metrics of the run of the current context, read by the Mongo and Redis clients shared by the runs of the process
+_current_run_metrics = ContextVar("run_metrics", default=None)
+
+
+def get_quantiles(values: list[float]) -> dict[str, float]:
+    # Quantiles of the ingestion lags, also reported for the timings of the soak tests
+    values = sorted(values)
+    if not values:
+        return {name: 0 for name in lag_quantiles}
+    return {name: values[math.ceil(quantile * len(values)) - 1] for name, quantile in lag_quantiles.items()}
+
+
+class RunMetrics:
+    def __init__(self, provider_code, sync_metadata=True, shard: tuple[int, int, str] = None):
+        self.provider_code = provider_code
+        self.sync_metadata = sync_metadata
+        self.shard = shard
+        self.started_at = time.time()
+        self.duration = None
+        self.timings = Counter()
+        self.counts = Counter()
+        self.stations = set()
+        self.skipped_stations = set()
+        self.lags = []
+        self.station_lags = {}
+        # The providers can fetch their data from several threads
+        self.__lock = threading.Lock()
+        self.__thread = threading.local()
+        self.__running_phases = Counter()
+        self.__phase_started_at = {}
+
+    def start_phase(self, phase):
+        depth = getattr(self.__thread, "depth", 0)
+        self.__thread.depth = depth + 1
+        if depth:
+            return
+        self.__thread.phase = phase
+        with self.__lock:
+            if not self.__running_phases[phase]:
+                self.__phase_started_at[phase] = time.perf_counter()
+            self.__running_phases[phase] += 1
+
+    def stop_phase(self):
+        self.__thread.depth -= 1
+        if self.__thread.depth:
+            return
+        phase = self.__thread.phase
+        with self.__lock:
+            self.__running_phases[phase] -= 1
+            if not self.__running_phases[phase]:
+                self.timings[phase] += time.perf_counter() - self.__phase_started_at[phase]
+
+    @contextmanager
+    def timer(self, phase):
+        self.start_phase(phase)
+        try:
+            yield
+        finally:
+            self.stop_phase()
+
+    def count(self, name, value=1):
+        with self.__lock:
+            self.counts[name] += value
+
+    def see_station(self, station_id, skipped=False):
+        with self.__lock:
+            self.stations.add(station_id)
+            if skipped:
+                self.skipped_stations.add(station_id)
+
+    def observe_lags(self, station_id, lags: list[float]):
+        with self.__lock:
+            self.lags.extend(lags)
+            self.station_lags[station_id] = max(self.station_lags.get(station_id, 0), *lags)
+
+    def get_lag_quantiles(self) -> dict[str, float]:
+        return get_quantiles(self.lags)
+
+    def get_worst_lag_stations(self) -> list[tuple[str, float]]:
+        return sorted(self.station_lags.items(), key=lambda item: item[1], reverse=True)[:worst_lag_stations]
+
+    def stop(self):
+        self.duration = time.time() - self.started_at
+        self.timings["parsing"] = max(
+            self.duration - sum(duration for phase, duration in self.timings.items() if phase != "parsing"), 0
+        )
+        # Added to the counts of the stations processed by the station queue workers
+        self.counts["stations_seen"] += len(self.stations)
+        self.counts["stations_skipped"] += len(self.skipped_stations)
+
+    def summary(self) -> str:
+        timings = ", ".join(f"{phase}={self.timings[phase]:.1f}s" for phase in phases)
+        counts = ", ".join(f"{name}={self.counts[name]}" for name in counters)
+        lags = ", ".join(f"{name}={lag:.0f}s" for name, lag in self.get_lag_quantiles().items())
+        return f"duration={self.duration:.1f}s ({timings}), {counts}, ingestion lag ({lags})"
+
+    def to_dict(self) -> dict:
+        return {
+            "provider": self.provider_code,
+            "sync": "metadata" if self.sync_metadata else "measure",
+            "shard": self.shard[0] if self.shard else None,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "timings": {phase: self.timings[phase] for phase in phases},
+            "counts": {name: self.counts[name] for name in counters},
+            "ingestion_lag": self.get_lag_quantiles(),
+            "worst_lag_stations": self.get_worst_lag_stations(),
+        }
+
+    def send(self):
+        record = self.to_dict()
+        attributes = {"provider": record["provider"], "sync": record["sync"]}
+        metrics.distribution("provider.run.duration", record["duration"], unit="second", attributes=attributes)
+        for phase, duration in record["timings"].items():
+            metrics.distribution(f"provider.run.{phase}", duration, unit="second", attributes=attributes)
+        for name, value in record["counts"].items():
+            metrics.count(
+                f"provider.run.{name}", value, unit="byte" if name == "payload_bytes" else None, attributes=attributes
+            )
+        if record["counts"]["measures_inserted"]:
+            for name, lag in record["ingestion_lag"].items():
+                metrics.gauge("provider.ingestion_lag", lag, unit="second", attributes={**attributes, "quantile": name})
+            for station_id, lag in record["worst_lag_stations"]:
+                metrics.gauge(
+                    "provider.station_ingestion_lag",
+                    lag,
+                    unit="second",
+                    attributes={**attributes, "station": station_id},
+                )
+
+        labels = {**attributes, "shard": str(record["shard"] or 0)}
+        file_name = f"provider_{record['provider']}_{record['sync']}"
+        if record["shard"]:
+            file_name += f"_{record['shard']}"
+        write_textfile(
+            file_name,
+            {
+                "winds_mobi_provider_run_timestamp_seconds": ("gauge", [(labels, record["started_at"])]),
+                "winds_mobi_provider_run_duration_seconds": ("gauge", [(labels, record["duration"])]),
+                "winds_mobi_provider_run_phase_seconds": (
+                    "gauge",
+                    [({**labels, "phase": phase}, duration) for phase, duration in record["timings"].items()],
+                ),
+                "winds_mobi_provider_run_count": (
+                    "gauge",
+                    [({**labels, "name": name}, value) for name, value in record["counts"].items()],
+                ),
+                "winds_mobi_provider_ingestion_lag_seconds": (
+                    "gauge",
+                    [
+                        ({**labels, "quantile": str(lag_quantiles[name])}, lag)
+                        for name, lag in record["ingestion_lag"].items()
+                    ],
+                ),
+                "winds_mobi_provider_station_ingestion_lag_seconds": (
+                    "gauge",
+                    [({**labels, "station": station_id}, lag) for station_id, lag in record["worst_lag_stations"]],
+                ),
+            },
+        )
+
+
+@contextmanager
+def run_metrics_context(run_metrics: RunMetrics):
+    token = _current_run_metrics.set(run_metrics)
+    try:
+        yield run_metrics
+    finally:
+        _current_run_metrics.reset(token)
+
+
+def timer(phase):
+    if run_metrics := _current_run_metrics.get():
+        return run_metrics.timer(phase)
+    return nullcontext()
+
+
+class MongoCommandsListener(monitoring.CommandListener):
+    # Round trips of the Mongo client shared by the runs
+
+    # The events of a command are published in the thread running it
+
+    def started(self, event):
+        if run_metrics := _current_run_metrics.get():
+            run_metrics.start_phase("mongo")
+
+    def succeeded(self, event):
+        if run_metrics := _current_run_metrics.get():
+            run_metrics.stop_phase()
+
+    def failed(self, event):
+        if run_metrics := _current_run_metrics.get():
+            run_metrics.stop_phase()
+
+
+class MeteredRedisConnection(redis.Connection):
+    # Round trips of the Redis client shared by the runs
+
+    def send_packed_command(self, *args, **kwargs):
+        with timer("redis"):
+            return super().send_packed_command(*args, **kwargs)
+
+    def read_response(self, *args, **kwargs):
+        with timer("redis"):
+            return super().read_response(*args, **kwargs)
+
+
+def write_textfile(name, samples: dict[str, tuple[str, list[tuple[dict, float]]]]):
+    # Prometheus text format, collected by the node exporter textfile collector
+    if not METRICS_TEXTFILE_DIR:
+        return
+    lines = []
+    for metric_name, (metric_type, values) in samples.items():
+        lines.append(f"# TYPE {metric_name} {metric_type}")
+        for labels, value in values:
+            labels_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{metric_name}{{{labels_text}}} {value}")
+    path = Path(METRICS_TEXTFILE_DIR, f"{name}.prom")
+    # Written atomically, the collector must not read a partial file
+    temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    temp_path.write_text("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
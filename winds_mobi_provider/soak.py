@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import redis
+from pymongo import MongoClient
+
+from settings import CASSETTE_DIR
+from winds_mobi_provider.fakes import FakeGoogleApi
+from winds_mobi_provider.registry import get_enabled_provider_jobs
+from winds_mobi_provider.run_metrics import get_quantiles
+
+# Soak test of the scheduler: run_scheduler.py runs all the providers with their production configuration against the
+# upstream responses replayed from their cassettes, local Mongo and Redis and a local stand-in of the Google APIs. The
+# jobs run --speedup times more often to simulate hours of runs in minutes.
+
+root_dir = Path(__file__).parents[1]
+default_mongodb_url = "mongodb://localhost:8011/winds_mobi_soak"
+default_redis_url = "redis://localhost:8012/1"
+
+# Log lines of the scheduler and of the apscheduler executors
+executed_pattern = re.compile(
+    r"\[scheduler\] \| '(?P<job>\w+)' queued (?P<queueing>[\d.]+)s, ran (?P<duration>[\d.]+)s, "
+    r"inserted (?P<measures>\d+) measures"
+)
+skipped_pattern = re.compile(r"\[scheduler\] \| '(?P<job>\w+)' run (?P<reason>missed|max_instances)")
+failed_pattern = re.compile(r'Job "(?P<job>\w+) \(trigger: .*\)" raised an exception')
+redis_write_commands = {
+    "set",
+    "setex",
+    "del",
+    "unlink",
+    "expire",
+    "hset",
+    "hmset",
+    "hincrby",
+    "hdel",
+    "rpush",
+    "lpush",
+    "lpop",
+    "incr",
+    "incrby",
+    "eval",
+    "evalsha",
+}
+
+
+class GoogleApiHandler(BaseHTTPRequestHandler):
+    google_api = FakeGoogleApi()
+
+    def do_GET(self):
+        body = json.dumps(self.google_api.get(f"http://{self.headers['Host']}{self.path}")).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_google_api() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GoogleApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_recorded_providers(cassettes_dir: Path) -> set[str]:
+    if not cassettes_dir.is_dir():
+        return set()
+    return {path.name for path in cassettes_dir.iterdir() if path.is_dir() and any(path.rglob("*.json.gz"))}
+
+
+def get_descendants(pid) -> list[int]:
+    children = defaultdict(list)
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:
+            continue
+        # The process name can contain spaces and parentheses
+        parent_pid = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children[parent_pid].append(int(stat_path.parent.name))
+    descendants = []
+    parents = [pid]
+    while parents:
+        parent_pid = parents.pop()
+        descendants.extend(children[parent_pid])
+        parents.extend(children[parent_pid])
+    return descendants
+
+
+def get_rss_mb(pid) -> float | None:
+    try:
+        pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def get_write_counts(mongo_client: MongoClient, redis_client: redis.Redis) -> dict[str, int]:
+    # Server wide counters: the soak databases should be the only ones written
+    opcounters = mongo_client.admin.command("serverStatus")["opcounters"]
+    command_stats = redis_client.info("commandstats")
+    return {
+        "mongo": sum(opcounters[operation] for operation in ("insert", "update", "delete")),
+        "redis": sum(
+            stats["calls"]
+            for name, stats in command_stats.items()
+            if name.removeprefix("cmdstat_") in redis_write_commands
+        ),
+    }
+
+
+class SoakStats:
+    def __init__(self):
+        self.runs = defaultdict(list)
+        self.skipped_runs = Counter()
+        self.failed_runs = Counter()
+        # RSS samples of each process of the scheduler: first, last and max
+        self.processes = {}
+        self.__lock = threading.Lock()
+
+    def parse_line(self, line):
+        with self.__lock:
+            if match := executed_pattern.search(line):
+                self.runs[match["job"]].append(
+                    (float(match["queueing"]), float(match["duration"]), int(match["measures"]))
+                )
+            elif match := skipped_pattern.search(line):
+                self.skipped_runs[match["job"], match["reason"]] += 1
+            elif match := failed_pattern.search(line):
+                self.failed_runs[match["job"]] += 1
+
+    def sample_processes(self, scheduler_pid):
+        now = time.time()
+        for pid in [scheduler_pid, *get_descendants(scheduler_pid)]:
+            if (rss := get_rss_mb(pid)) is None:
+                continue
+            if pid not in self.processes:
+                self.processes[pid] = {
+                    "role": "scheduler" if pid == scheduler_pid else "worker",
+                    "first_seen": now,
+                    "first_rss_mb": rss,
+                    "max_rss_mb": rss,
+                }
+            process = self.processes[pid]
+            process.update(last_seen=now, last_rss_mb=rss, max_rss_mb=max(process["max_rss_mb"], rss))
+
+    def summary(self) -> str:
+        with self.__lock:
+            runs = sum(len(runs) for runs in self.runs.values())
+            skipped = sum(self.skipped_runs.values())
+            failed = sum(self.failed_runs.values())
+        return f"{runs} runs, {skipped} skipped, {failed} failed, {len(self.processes)} processes"
+
+
+def create_report(stats: SoakStats, job_intervals: dict[str, float], speedup, wall_duration, writes) -> dict:
+    simulated_duration = wall_duration * speedup
+    jobs = {}
+    for job_id, interval in sorted(job_intervals.items()):
+        runs = stats.runs.get(job_id, [])
+        jobs[job_id] = {
+            "expected_runs": int(simulated_duration / (interval * 60)),
+            "runs": len(runs),
+            "missed_runs": stats.skipped_runs[job_id, "missed"],
+            "max_instances_runs": stats.skipped_runs[job_id, "max_instances"],
+            "failed_runs": stats.failed_runs[job_id],
+            # Simulated seconds
+            "queueing": {name: value * speedup for name, value in get_quantiles([run[0] for run in runs]).items()},
+            "duration": get_quantiles([run[1] for run in runs]),
+            "inserted_measures": sum(run[2] for run in runs),
+        }
+    processes = {}
+    for pid, process in sorted(stats.processes.items()):
+        lifetime = process["last_seen"] - process["first_seen"]
+        growth = process["last_rss_mb"] - process["first_rss_mb"]
+        processes[pid] = {
+            **process,
+            "growth_mb": growth,
+            "growth_mb_per_simulated_hour": growth / (lifetime * speedup / 3600) if lifetime else 0,
+        }
+    return {
+        "speedup": speedup,
+        "wall_duration": wall_duration,
+        "simulated_duration": simulated_duration,
+        "jobs": jobs,
+        "processes": processes,
+        "writes": {
+            backend: {
+                "total": nb,
+                "per_second": nb / wall_duration if wall_duration else 0,
+                "per_simulated_minute": nb / (simulated_duration / 60) if simulated_duration else 0,
+            }
+            for backend, nb in writes.items()
+        },
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"Soak of {report['simulated_duration'] / 3600:.1f} simulated hours in {report['wall_duration'] / 60:.1f} "
+        f"minutes (speedup {report['speedup']:g})"
+    )
+    print(
+        "  job: runs/expected, missed, max_instances, failed, queueing p50/p95/max (simulated s), "
+        "duration p50/p95/max (s)"
+    )
+    for job_id, job in report["jobs"].items():
+        queueing, duration = job["queueing"], job["duration"]
+        print(
+            f"  {job_id}: {job['runs']}/{job['expected_runs']}, {job['missed_runs']}, {job['max_instances_runs']}, "
+            f"{job['failed_runs']}, {queueing['p50']:.1f}/{queueing['p95']:.1f}/{queueing['max']:.1f}, "
+            f"{duration['p50']:.1f}/{duration['p95']:.1f}/{duration['max']:.1f}"
+        )
+    print("  processes: RSS first -> last (max), growth by simulated hour")
+    for pid, process in report["processes"].items():
+        print(
+            f"  {process['role']} {pid}: {process['first_rss_mb']:.0f}MB -> {process['last_rss_mb']:.0f}MB "
+            f"({process['max_rss_mb']:.0f}MB), {process['growth_mb_per_simulated_hour']:+.1f}MB/h"
+        )
+    print(
+        "  writes: "
+        + ", ".join(
+            f"{backend}={writes['per_second']:.1f}/s ({writes['per_simulated_minute']:.1f}/simulated min)"
+            for backend, writes in report["writes"].items()
+        )
+    )
+
+
+def run_scheduler_process(env: dict, wall_duration, stats: SoakStats, log_file=None) -> tuple[float, bool]:
+    process = subprocess.Popen(
+        [sys.executable, "run_scheduler.py"],
+        cwd=root_dir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        # The scheduler and its workers are stopped together
+        start_new_session=True,
+    )
+
+    def read_logs():
+        for line in process.stdout:
+            stats.parse_line(line)
+            if log_file:
+                log_file.write(line)
+
+    reader = threading.Thread(target=read_logs, daemon=True)
+    reader.start()
+    started_at = time.time()
+    speedup = float(env["SCHEDULER_SPEEDUP"])
+    last_progress = started_at
+    try:
+        while time.time() - started_at < wall_duration and process.poll() is None:
+            stats.sample_processes(process.pid)
+            if time.time() - last_progress >= 60:
+                last_progress = time.time()
+                print(f"{(last_progress - started_at) * speedup / 3600:.1f} simulated hours: {stats.summary()}")
+            time.sleep(5)
+    finally:
+        stopped_early = process.poll() is not None
+        if not stopped_early:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+        reader.join(10)
+    return time.time() - started_at, stopped_early
+
+
+def run_soak(
+    duration, speedup, cassettes_dir: Path, mongodb_url, redis_url, replay_timings=True, log_path: Path = None
+) -> dict:
+    recorded_providers = get_recorded_providers(cassettes_dir)
+    provider_jobs = [job for job in get_enabled_provider_jobs() if job.name in recorded_providers]
+    if not provider_jobs:
+        raise ValueError(f"No cassette of an enabled provider in '{cassettes_dir}'")
+    job_intervals = {provider_job.name: provider_job.interval for provider_job in provider_jobs}
+
+    google_api = start_google_api()
+    env = {
+        **os.environ,
+        "MONGODB_URL": mongodb_url,
+        "REDIS_URL": redis_url,
+        "CASSETTE_MODE": "replay",
+        "CASSETTE_DIR": str(cassettes_dir),
+        "CASSETTE_REPLAY_TIMINGS": str(replay_timings).lower(),
+        "GOOGLE_API_URL": f"http://127.0.0.1:{google_api.server_address[1]}",
+        "SCHEDULER_SPEEDUP": str(speedup),
+        # The replayed measures don't get newer, the adaptive scheduling would slow down all the providers
+        "ADAPTIVE_SCHEDULING": "false",
+        "PYTHONUNBUFFERED": "1",
+    }
+    # The providers without cassette would call their upstream
+    for name in sorted({job.name for job in get_enabled_provider_jobs()} - recorded_providers):
+        print(f"'{name}' is not scheduled, no cassette in '{cassettes_dir}'")
+        env[f"DISABLE_PROVIDER_{name.upper()}"] = "true"
+
+    mongo_client = MongoClient(mongodb_url)
+    redis_client = redis.StrictRedis.from_url(url=redis_url, decode_responses=True)
+    writes_before = get_write_counts(mongo_client, redis_client)
+    stats = SoakStats()
+    try:
+        with open(log_path, "w") if log_path else nullcontext() as log_file:
+            wall_duration, stopped_early = run_scheduler_process(env, duration * 3600 / speedup, stats, log_file)
+    finally:
+        google_api.shutdown()
+
+    writes_after = get_write_counts(mongo_client, redis_client)
+    report = create_report(
+        stats,
+        job_intervals,
+        speedup,
+        wall_duration,
+        {backend: writes_after[backend] - writes_before[backend] for backend in writes_after},
+    )
+    report["stopped_early"] = stopped_early
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Run the scheduler with all the recorded providers against local stand-ins, and report its runs"
+    )
+    parser.add_argument("--duration", type=float, default=6, help="Simulated hours")
+    parser.add_argument("--speedup", type=float, default=10, help="Simulated seconds by second")
+    parser.add_argument("--cassettes", type=Path, default=Path(CASSETTE_DIR), help="Cassettes of the providers")
+    parser.add_argument("--mongodb-url", default=default_mongodb_url)
+    parser.add_argument("--redis-url", default=default_redis_url)
+    parser.add_argument(
+        "--replay-timings", action=argparse.BooleanOptionalAction, default=True, help="Replay the upstream latencies"
+    )
+    parser.add_argument("--log", type=Path, help="Write the logs of the scheduler to a file")
+    parser.add_argument("--output", type=Path, help="Write the report to a json file")
+    args = parser.parse_args(args)
+
+    report = run_soak(
+        args.duration, args.speedup, args.cassettes, args.mongodb_url, args.redis_url, args.replay_timings, args.log
+    )
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Report written to '{args.output}'")
+    if report["stopped_early"]:
+        print("The scheduler stopped before the end of the soak")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
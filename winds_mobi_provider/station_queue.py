@@ -0,0 +1,49 @@
+import importlib
+import logging
+import sys
+
+import redis
+
+from settings import REDIS_URL
+from winds_mobi_provider.logging import configure_logging
+from winds_mobi_provider.provider import Provider
+
+log = logging.getLogger("station_queue")
+
+# Providers splitting their runs into station tasks
+default_provider_refs = [
+    "providers.holfuy:Holfuy",
+    "providers.metar:Metar",
+    "providers.pioupiou:Pioupiou",
+    "providers.windy:Windy",
+]
+
+
+def run_station_worker(provider_refs: list[str]):
+    # Consume the station tasks pushed by the provider runs, on any number of processes or nodes
+    configure_logging()
+    provider_classes: dict[str, type[Provider]] = {}
+    for provider_ref in provider_refs:
+        module_name, class_name = provider_ref.split(":")
+        provider_class = getattr(importlib.import_module(module_name), class_name)
+        provider_classes[provider_class.station_queue_key()] = provider_class
+    redis_client = redis.StrictRedis.from_url(url=REDIS_URL, decode_responses=True)
+
+    log.info(f"Consuming station tasks of {', '.join(provider_classes)}")
+    while True:
+        if not (result := redis_client.blpop(list(provider_classes), timeout=60)):
+            continue
+        queue_key, queued_task = result
+        try:
+            provider_class = provider_classes[queue_key]
+            queued_tasks = [queued_task] + (
+                redis_client.lpop(queue_key, provider_class.station_queue_batch_size - 1) or []
+            )
+            # A provider is created for the tasks of each run
+            provider_class.process_queued_tasks(queued_tasks)
+        except Exception as e:
+            log.exception(f"Unable to process station tasks from '{queue_key}': {e}")
+
+
+if __name__ == "__main__":
+    run_station_worker(sys.argv[1:] or default_provider_refs)
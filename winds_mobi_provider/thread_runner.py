@@ -0,0 +1,19 @@
+import contextvars
+
+import sentry_sdk
+
+from winds_mobi_provider.provider import run_provider
+
+# Run the providers concurrently in the threads of the scheduler process, sharing the clients and caches of the process.
+# The providers code is synchronous: each run blocks its thread while waiting for the network. The CPU-heavy providers
+# run in a process pool instead.
+
+
+def run_provider_in_thread(func_ref: str, sync_metadata=True, **kwargs) -> dict:
+    # Each run has its own context and Sentry scope: the tags set by a provider don't leak to the other runs of the
+    # thread
+    def run():
+        with sentry_sdk.isolation_scope():
+            return run_provider(func_ref, sync_metadata, **kwargs)
+
+    return contextvars.copy_context().run(run)
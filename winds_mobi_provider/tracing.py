@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import sentry_sdk
+
+from settings import TRACING, TRACING_FILE
+
+slowest_stations = 10
+
+
+class Tracer:
+    # Spans of the HTTP, Mongo and Redis operations of a run, by station. Enabled by TRACING: "sentry" to send them to
+    # Sentry performance, "jsonl" to append them to TRACING_FILE.
+
+    def __init__(self, provider_code, log: logging.Logger):
+        self.provider_code = provider_code
+        self.log = log
+        self.enabled = TRACING in ("sentry", "jsonl")
+        self.run_id = None
+        self.spans = []
+        # Station of the running span, by thread
+        self.__local = threading.local()
+
+    @contextmanager
+    def trace_run(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.run_id = uuid.uuid4().hex
+        self.spans = []
+        transaction = (
+            sentry_sdk.start_transaction(op="provider.run", name=name) if TRACING == "sentry" else nullcontext()
+        )
+        try:
+            with transaction:
+                yield
+        finally:
+            self.report_slowest_stations()
+            if TRACING == "jsonl":
+                self.write_spans()
+            self.run_id = None
+            self.spans = []
+
+    def span(self, operation, station_id=None):
+        if not (self.enabled and self.run_id):
+            return nullcontext()
+        return self.__span(operation, station_id)
+
+    @contextmanager
+    def __span(self, operation, station_id):
+        parent_station_id = getattr(self.__local, "station_id", None)
+        station_id = station_id or parent_station_id
+        self.__local.station_id = station_id
+        sentry_span = (
+            sentry_sdk.start_span(op=operation, name=station_id or operation) if TRACING == "sentry" else nullcontext()
+        )
+        started_at = time.time()
+        try:
+            with sentry_span as span:
+                if span:
+                    span.set_data("provider", self.provider_code)
+                    span.set_data("station", station_id)
+                yield
+        finally:
+            self.__local.station_id = parent_station_id
+            self.spans.append(
+                {
+                    "run": self.run_id,
+                    "provider": self.provider_code,
+                    "station": station_id,
+                    "operation": operation,
+                    "started_at": started_at,
+                    "duration": time.time() - started_at,
+                    # Outermost span of the station
+                    "root": station_id != parent_station_id,
+                }
+            )
+
+    def get_slowest_stations(self) -> list[tuple[str, float, dict[str, float]]]:
+        # Time of each station from its outermost spans, with the time of each operation
+        durations = defaultdict(float)
+        operations = defaultdict(lambda: defaultdict(float))
+        for span in self.spans:
+            if not span["station"]:
+                continue
+            if span["root"]:
+                durations[span["station"]] += span["duration"]
+            if span["operation"] != "station":
+                operations[span["station"]][span["operation"]] += span["duration"]
+        slowest = sorted(durations.items(), key=lambda item: item[1], reverse=True)[:slowest_stations]
+        return [(station_id, duration, dict(operations[station_id])) for station_id, duration in slowest]
+
+    def report_slowest_stations(self):
+        if stations := self.get_slowest_stations():
+            self.log.info(
+                "Slowest stations: "
+                + ", ".join(
+                    f"'{station_id}' {duration:.1f}s ("
+                    + ", ".join(
+                        f"{operation}={operation_duration:.1f}s" for operation, operation_duration in ops.items()
+                    )
+                    + ")"
+                    for station_id, duration, ops in stations
+                )
+            )
+
+    def write_spans(self):
+        try:
+            lines = "".join(json.dumps(span) + "\n" for span in self.spans)
+            # Single append, the runs of several processes can write to the same file
+            fd = os.open(TRACING_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines.encode())
+            finally:
+                os.close(fd)
+        except Exception as e:
+            self.log.exception(f"Unable to write the spans to '{TRACING_FILE}': {e}")
@@ -1,8 +1,20 @@
+import threading
 from collections import namedtuple
 
-import pint
+Pressure = namedtuple("Pressure", ["qfe", "qnh", "qff"])
 
-ureg = pint.UnitRegistry()
-Q_ = ureg.Quantity
+_registry_lock = threading.Lock()
 
-Pressure = namedtuple("Pressure", ["qfe", "qnh", "qff"])
+
+def __getattr__(name):
+    # The pint registry takes a few hundred milliseconds to build: only build it when a provider first uses a unit.
+    # The quantities of different registries can't be mixed, the threads of a process share a single one.
+    if name in ("ureg", "Q_"):
+        with _registry_lock:
+            if "ureg" not in globals():
+                import pint
+
+                ureg = pint.UnitRegistry()
+                globals().update(ureg=ureg, Q_=ureg.Quantity)
+        return globals()[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")